@@ -262,6 +262,7 @@ setup_args = {
     'package_dir'        : {'': 'src'},
     'scripts'            : ['bin/radicalpilot-bson2json',
                             'bin/radicalpilot-fetch-profiles',
+                            'bin/radicalpilot-prof2csv',
                             'bin/radicalpilot-inspect',
                             'bin/radicalpilot-version',
                             'bin/radicalpilot-close-session',
@@ -35,7 +35,7 @@ from .compute_pilot             import ComputePilot
 from .compute_pilot_description import ComputePilotDescription
 
 from .resource_config    import ResourceConfig
-from .staging_directives import COPY, LINK, MOVE, TRANSFER, SKIP_FAILED, CREATE_PARENTS
+from .staging_directives import COPY, LINK, MOVE, TRANSFER, SKIP_FAILED, CREATE_PARENTS, BUNDLE, CACHE
 
 from .utils import version, version_detail, version_branch
 from .utils import sdist_name, sdist_path
@@ -136,22 +136,30 @@ __license__   = "MIT"
 
 import os
 import copy
+import json
 import math
+import heapq
 import stat
+import hashlib
 import sys
 import time
 import errno
-import Queue
+import fcntl
 import pprint
+import pipes
 import signal
 import shutil
+import select
 import hostlist
 import tempfile
 import netifaces
 import threading
+import itertools
 import traceback
 import subprocess
+import collections
 import multiprocessing
+import multiprocessing.pool
 
 import saga                as rs
 import radical.utils       as ru
@@ -228,9 +236,20 @@ SCHEDULER_NAME_CONTINUOUS   = "CONTINUOUS"
 SCHEDULER_NAME_SCATTERED    = "SCATTERED"
 SCHEDULER_NAME_TORUS        = "TORUS"
 
+# 'enum' for the order in which waiting units are rescheduled
+SCHEDULER_POLICY_FIFO       = "FIFO"
+SCHEDULER_POLICY_LARGEST    = "LARGEST_FIRST"
+SCHEDULER_POLICY_SMALLEST   = "SMALLEST_FIRST"
+
 # 'enum' for pilot's unit spawner types
 SPAWNER_NAME_POPEN          = "POPEN"
 SPAWNER_NAME_SHELL          = "SHELL"
+SPAWNER_NAME_FORK           = "FORK"
+
+# max number of launch script templates an executor keeps around
+TEMPLATE_CACHE_SIZE         = 1024
+FINAL_UNITS_MEMORY          = 10000  # recently finalized uids kept for cancel
+STAGED_UNITS_MEMORY         = 100000 # recently staged uids kept for dedup
 
 # defines for pilot commands
 COMMAND_CANCEL_PILOT        = "Cancel_Pilot"
@@ -252,6 +271,16 @@ LINK     = 'Link'     # local ln -s
 MOVE     = 'Move'     # local mv
 TRANSFER = 'Transfer' # saga remote transfer
                       # TODO: This might just be a special case of copy
+EXTRACT  = 'Extract'  # extract a member from a staging bundle (internal)
+CACHED   = 'Cached'   # copy via the staging cache (internal)
+
+# staging flags: transfer the file in a bundle with other small files, and
+# stage the file via the staging cache
+BUNDLE   = 'Bundle'
+CACHE    = 'Cache'
+
+# name of the output bundle archive in the unit workdir
+OUTPUT_BUNDLE = 'staging_output.tar'
 
 # tri-state for unit spawn retval
 OK       = 'OK'
@@ -461,10 +490,20 @@ class AgentSchedulingComponent(rpu.Component):
         self._lrms_cores_per_node = self._cfg['lrms_info']['cores_per_node']
         # FIXME: this information is insufficient for the torus scheduler!
 
-        self._wait_pool = list()            # set of units which wait for the resource
+        # units which wait for the resource are bucketed by the number of
+        # requested cores: {cores : OrderedDict(uid : (seq, cu))}.  The
+        # sequence number records the arrival order across buckets.
+        self._wait_pool = dict()            # set of units which wait for the resource
+        self._wait_seq  = itertools.count() # arrival order of waiting units
         self._wait_lock = threading.RLock() # look on the above set
         self._slot_lock = threading.RLock() # look for slot allocation/deallocation
 
+        self._wait_policy = self._cfg.get('scheduler_policy', SCHEDULER_POLICY_FIFO)
+        if self._wait_policy not in [SCHEDULER_POLICY_FIFO,
+                                     SCHEDULER_POLICY_LARGEST,
+                                     SCHEDULER_POLICY_SMALLEST]:
+            raise ValueError("Scheduler policy '%s' unknown" % self._wait_policy)
+
         # configure the scheduler instance
         self._configure()
 
@@ -516,7 +555,26 @@ class AgentSchedulingComponent(rpu.Component):
         cmd = msg['cmd']
         arg = msg['arg']
 
-        if cmd == 'shutdown':
+        if cmd == 'cancel_units':
+            # units which wait for resources are canceled right away -- units
+            # we see later are canceled by the executing component
+            canceled = list()
+            with self._wait_lock:
+                for uid in arg:
+                    for cores in self._wait_pool.keys():
+                        entry = self._wait_pool[cores].pop(uid, None)
+                        if entry:
+                            if not self._wait_pool[cores]:
+                                del(self._wait_pool[cores])
+                            canceled.append(entry[1])
+                            break
+
+            self._log.info('canceled %d waiting units', len(canceled))
+            for cu in canceled:
+                self._prof.prof('unqueue', msg="canceled", uid=cu['_id'])
+                self.advance(cu, rp.CANCELED, publish=True, push=False)
+
+        elif cmd == 'shutdown':
             self._log.info('received shutdown command')
             self.stop()
 
@@ -545,6 +603,17 @@ class AgentSchedulingComponent(rpu.Component):
         raise NotImplementedError("_release_slot() not implemented for Scheduler '%s'." % self._cname)
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _max_free_cores(self):
+        """
+        Return an upper bound for the number of cores a single unit could be
+        allocated right now, or None if the scheduler can't tell.  That bound
+        limits which wait pool buckets are retried on reschedule.
+        """
+        return None
+
+
     # --------------------------------------------------------------------------
     #
     def _try_allocation(self, cu):
@@ -578,39 +647,116 @@ class AgentSchedulingComponent(rpu.Component):
         return True
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _wait_pool_candidates(self, sizes):
+        """
+        Yield waiting (seq, cu) tuples from the given buckets, in the order of
+        the configured policy.  Buckets are iterated in place: the caller must
+        hold the wait lock, and must not change the pool before the iteration
+        is finished.
+        """
+
+        if self._wait_policy == SCHEDULER_POLICY_FIFO:
+            # merge the buckets (which each are in arrival order)
+            return heapq.merge(*[self._wait_pool[size].itervalues()
+                                 for size in sizes])
+
+        if self._wait_policy == SCHEDULER_POLICY_LARGEST:
+            sizes.sort(reverse=True)
+        else:
+            sizes.sort()
+
+        return itertools.chain(*[self._wait_pool[size].itervalues()
+                                 for size in sizes])
+
+
     # --------------------------------------------------------------------------
     #
     def reschedule_cb(self, topic, msg):
-        # we ignore any passed CU.  In principle the cu info could be used to
-        # determine which slots have been freed.  No need for that optimization
-        # right now.  This will become interesting once reschedule becomes too
-        # expensive.
+        # The passed CU is the one which freed its cores.  We don't use it
+        # directly, but ask the scheduler what fits after the release, so that
+        # only wait pool buckets which can possibly be served are retried.
 
         cu = msg
 
         self._prof.prof('reschedule', uid=self._pilot_id)
         self._log.info("slot status before reschedule: %s" % self.slot_status())
 
-        # cycle through wait queue, and see if we get anything running now.  We
-        # cycle over a copy of the list, so that we can modify the list on the
-        # fly
-        for cu in self._wait_pool[:]:
+        allocated = list()
+        failed    = set()   # sizes which did not fit anymore
+
+        with self._wait_lock :
+
+            max_cores = self._max_free_cores()
+            sizes     = [size for size in self._wait_pool
+                              if max_cores is None or size <= max_cores]
+
+            for seq, cu in self._wait_pool_candidates(sizes):
+
+                cores = cu['description']['cores']
+
+                # all units in a bucket request the same number of cores, so
+                # after one of them failed, there is no need to try the others
+                if cores in failed:
+                    continue
+
+                if max_cores is not None and cores > max_cores:
+                    failed.add(cores)
 
-            if self._try_allocation(cu):
+                elif self._try_allocation(cu):
+                    allocated.append(cu)
+                    max_cores = self._max_free_cores()
 
-                # allocated cu -- advance it
-                self.advance(cu, rp.EXECUTING_PENDING, publish=True, push=True)
+                else:
+                    failed.add(cores)
+
+                # stop early if nothing else can fit
+                if len(failed) == len(sizes):
+                    break
+
+                if max_cores is not None and max_cores < min(sizes):
+                    break
+
+            # remove allocated units from the wait pool
+            for cu in allocated:
+                self._wait_pool_remove(cu)
+                self._prof.prof('unqueue', msg="re-allocation done", uid=cu['_id'])
 
-                # remove it from the wait queue
-                with self._wait_lock :
-                    self._wait_pool.remove(cu)
-                    self._prof.prof('unqueue', msg="re-allocation done", uid=cu['_id'])
+        # allocated cus -- advance them
+        for cu in allocated:
+            self.advance(cu, rp.EXECUTING_PENDING, publish=True, push=True)
 
         # Note: The extra space below is for visual alignment
         self._log.info("slot status after  reschedule: %s" % self.slot_status ())
         self._prof.prof('reschedule done')
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _wait_pool_add(self, cu):
+
+        cores = cu['description']['cores']
+        with self._wait_lock :
+            if cores not in self._wait_pool:
+                self._wait_pool[cores] = collections.OrderedDict()
+            self._wait_pool[cores][cu['_id']] = (self._wait_seq.next(), cu)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _wait_pool_remove(self, cu):
+
+        cores = cu['description']['cores']
+        with self._wait_lock :
+            bucket = self._wait_pool.get(cores)
+            if bucket is None:
+                return
+            bucket.pop(cu['_id'], None)
+            if not bucket:
+                del(self._wait_pool[cores])
+
+
     # --------------------------------------------------------------------------
     #
     def unschedule_cb(self, topic, msg):
@@ -661,8 +807,7 @@ class AgentSchedulingComponent(rpu.Component):
         else:
             # No resources available, put in wait queue
             self._prof.prof('schedule', msg="allocation failed", uid=cu['_id'])
-            with self._wait_lock :
-                self._wait_pool.append(cu)
+            self._wait_pool_add(cu)
 
 
 
@@ -670,11 +815,15 @@ class AgentSchedulingComponent(rpu.Component):
 #
 class SchedulerContinuous(AgentSchedulingComponent):
 
+    # core states in the occupancy map
+    CORE_FREE = '\x00'
+    CORE_BUSY = '\x01'
+
     # --------------------------------------------------------------------------
     #
     def __init__(self, cfg):
 
-        self.slots = None
+        self._cores = None
 
         AgentSchedulingComponent.__init__(self, cfg)
 
@@ -688,23 +837,111 @@ class SchedulerContinuous(AgentSchedulingComponent):
         if not self._lrms_cores_per_node:
             raise RuntimeError("LRMS %s didn't _configure cores_per_node." % self._lrms.name)
 
-        # Slots represents the internal process management structure.
-        # The structure is as follows:
-        # [
-        #    {'node': 'node1', 'cores': [p_1, p_2, p_3, ... , p_cores_per_node]},
-        #    {'node': 'node2', 'cores': [p_1, p_2, p_3. ... , p_cores_per_node]
-        # ]
+        # The core occupancy is kept in a flat bytearray, with one byte per
+        # core (CORE_FREE or CORE_BUSY), and the nodes laid out in the order
+        # of the LRMS node list -- the global core offset is thus
         #
-        # We put it in a list because we care about (and make use of) the order.
+        #   node_index * cores_per_node + core
         #
-        self.slots = []
-        for node in self._lrms_node_list:
-            self.slots.append({
-                'node': node,
-                # TODO: Maybe use the real core numbers in the case of
-                # non-exclusive host reservations?
-                'cores': [FREE for _ in range(0, self._lrms_cores_per_node)]
-            })
+        # We care about (and make use of) that order.
+        #
+        # On top of that bitmap we maintain a segment tree over the nodes,
+        # which keeps, per node range, the number of free cores at its start
+        # (pref) and end (suf), the longest free run across node boundaries
+        # (best), and the longest free run within a single node (nbest).
+        # A search for a free run then only descends the tree (O(log nodes))
+        # and scans a single node, and an allocation or release only updates
+        # the leaves of the nodes it touches.  The leaves beyond the last node
+        # have length zero.
+        #
+        self._node_names = list(self._lrms_node_list)
+        self._node_index = dict()
+        for idx, node in enumerate(self._node_names):
+            # for duplicated node names, the first entry wins
+            if node not in self._node_index:
+                self._node_index[node] = idx
+
+        cpn    = self._lrms_cores_per_node
+        nnodes = len(self._node_names)
+
+        self._cores = bytearray(self.CORE_FREE * (nnodes * cpn))
+
+        size = 1
+        while size < nnodes:
+            size *= 2
+        self._tree_size = size
+
+        self._tree_len   = [0] * (2 * size)
+        self._tree_pref  = [0] * (2 * size)
+        self._tree_suf   = [0] * (2 * size)
+        self._tree_best  = [0] * (2 * size)
+        self._tree_nbest = [0] * (2 * size)
+
+        for idx in range(nnodes):
+            leaf = size + idx
+            self._tree_len  [leaf] = cpn
+            self._tree_pref [leaf] = cpn
+            self._tree_suf  [leaf] = cpn
+            self._tree_best [leaf] = cpn
+            self._tree_nbest[leaf] = cpn
+
+        for pos in range(size - 1, 0, -1):
+            self._tree_merge(pos)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _tree_merge(self, pos):
+
+        l = 2 * pos
+        r = l + 1
+
+        len_l = self._tree_len[l]
+        len_r = self._tree_len[r]
+        suf_l = self._tree_suf[l]
+        pre_r = self._tree_pref[r]
+
+        self._tree_len[pos] = len_l + len_r
+
+        if self._tree_pref[l] < len_l: self._tree_pref[pos] = self._tree_pref[l]
+        else                         : self._tree_pref[pos] = len_l + pre_r
+
+        if self._tree_suf[r] < len_r : self._tree_suf[pos]  = self._tree_suf[r]
+        else                         : self._tree_suf[pos]  = len_r + suf_l
+
+        self._tree_best [pos] = max(self._tree_best[l], self._tree_best[r],
+                                    suf_l + pre_r)
+        self._tree_nbest[pos] = max(self._tree_nbest[l], self._tree_nbest[r])
+
+
+    # --------------------------------------------------------------------------
+    #
+    # Recompute the tree leaves for the given node range (inclusive), and
+    # propagate the changes to the root.
+    #
+    def _tree_update(self, first_node, last_node):
+
+        cpn   = self._lrms_cores_per_node
+        busy  = self.CORE_BUSY
+        size  = self._tree_size
+
+        for idx in range(first_node, last_node + 1):
+
+            cores = self._cores[idx * cpn : (idx + 1) * cpn]
+            leaf  = size + idx
+
+            self._tree_pref [leaf] = cpn - len(cores.lstrip(self.CORE_FREE))
+            self._tree_suf  [leaf] = cpn - len(cores.rstrip(self.CORE_FREE))
+            self._tree_best [leaf] = max([len(run) for run in cores.split(busy)])
+            self._tree_nbest[leaf] = self._tree_best[leaf]
+
+        first = (size + first_node) / 2
+        last  = (size + last_node)  / 2
+        while first >= 1:
+            for pos in range(first, last + 1):
+                self._tree_merge(pos)
+            first /= 2
+            last  /= 2
 
 
     # --------------------------------------------------------------------------
@@ -713,14 +950,13 @@ class SchedulerContinuous(AgentSchedulingComponent):
         """Returns a multi-line string corresponding to slot status.
         """
 
+        cpn   = self._lrms_cores_per_node
+        cores = str(self._cores).replace(self.CORE_FREE, '-') \
+                                .replace(self.CORE_BUSY, '+')
+
         slot_matrix = ""
-        for slot in self.slots:
-            slot_matrix += "|"
-            for core in slot['cores']:
-                if core == FREE:
-                    slot_matrix += "-"
-                else:
-                    slot_matrix += "+"
+        for idx in range(len(self._node_names)):
+            slot_matrix += "|" + cores[idx * cpn : (idx + 1) * cpn]
         slot_matrix += "|"
         return {'timestamp' : rpu.timestamp(),
                 'slotstate' : slot_matrix}
@@ -745,30 +981,37 @@ class SchedulerContinuous(AgentSchedulingComponent):
         # Switch between searching for single or multi-node
         if single_node:
             if continuous:
-                task_slots = self._find_slots_single_cont(cores_requested)
+                offset = self._find_slots_single_cont(cores_requested)
             else:
                 raise NotImplementedError('No scattered single node scheduler implemented yet.')
         else:
             if continuous:
-                task_slots = self._find_slots_multi_cont(cores_requested)
+                offset = self._find_slots_multi_cont(cores_requested)
             else:
                 raise NotImplementedError('No scattered multi node scheduler implemented yet.')
 
-        if not task_slots:
+        if offset is None:
             # allocation failed
             return {}
 
-        self._change_slot_states(task_slots, BUSY)
-        task_offsets = self.slots2offset(task_slots)
+        self._change_slot_states(offset, cores_requested, BUSY)
 
-        return {'task_slots'   : task_slots, 
-                'task_offsets' : task_offsets, 
+        return {'task_slots'   : self.offset2slots(offset, cores_requested),
+                'task_offsets' : offset,
                 'lm_info'      : self._lrms_lm_info}
 
 
     # --------------------------------------------------------------------------
     #
-    # Convert a set of slots into an index into the global slots list
+    def _max_free_cores(self):
+
+        # the longest free run, across node boundaries
+        return self._tree_best[1]
+
+
+    # --------------------------------------------------------------------------
+    #
+    # Convert a set of slots into an index into the global core map
     #
     def slots2offset(self, task_slots):
         # TODO: This assumes all hosts have the same number of cores
@@ -776,161 +1019,119 @@ class SchedulerContinuous(AgentSchedulingComponent):
         first_slot = task_slots[0]
         # Get the host and the core part
         [first_slot_host, first_slot_core] = first_slot.split(':')
-        # Find the entry in the the all_slots list based on the host
-        slot_entry = (slot for slot in self.slots if slot["node"] == first_slot_host).next()
-        # Transform it into an index in to the all_slots list
-        all_slots_slot_index = self.slots.index(slot_entry)
-
-        return all_slots_slot_index * self._lrms_cores_per_node + int(first_slot_core)
+        # Transform it into an index in to the core map
+        return self._node_index[first_slot_host] * self._lrms_cores_per_node \
+             + int(first_slot_core)
 
 
     # --------------------------------------------------------------------------
     #
-    def _release_slot(self, opaque_slots):
+    # Convert a continuous range of the global core map into a list of
+    # 'node:core' slots
+    #
+    def offset2slots(self, offset, cores):
 
-        if not 'task_slots' in opaque_slots:
-            raise RuntimeError('insufficient information to release slots via %s: %s' \
-                    % (self.name, opaque_slots))
+        cpn   = self._lrms_cores_per_node
+        names = self._node_names
 
-        self._change_slot_states(opaque_slots['task_slots'], FREE)
+        return ['%s:%d' % (names[idx / cpn], idx % cpn)
+                for idx in xrange(offset, offset + cores)]
 
 
     # --------------------------------------------------------------------------
     #
-    # Find a needle (continuous sub-list) in a haystack (list)
-    #
-    def _find_sublist(self, haystack, needle):
-        n = len(needle)
-        # Find all matches (returns list of False and True for every position)
-        hits = [(needle == haystack[i:i+n]) for i in xrange(len(haystack)-n+1)]
-        try:
-            # Grab the first occurrence
-            index = hits.index(True)
-        except ValueError:
-            index = None
+    def _release_slot(self, opaque_slots):
 
-        return index
+        if not 'task_slots' in opaque_slots:
+            raise RuntimeError('insufficient information to release slots via %s: %s' \
+                    % (self.name, opaque_slots))
 
+        # the continuous scheduler always hands out continuous core ranges, so
+        # we only need to know where it starts.
+        task_slots = opaque_slots['task_slots']
+        offset     = opaque_slots.get('task_offsets')
+        if offset is None:
+            offset = self.slots2offset(task_slots)
 
-    # --------------------------------------------------------------------------
-    #
-    # Transform the number of cores into a continuous list of "status"es,
-    # and use that to find a sub-list.
-    #
-    def _find_cores_cont(self, slot_cores, cores_requested, status):
-        return self._find_sublist(slot_cores, [status for _ in range(cores_requested)])
+        self._change_slot_states(offset, len(task_slots), FREE)
 
 
     # --------------------------------------------------------------------------
     #
-    # Find an available continuous slot within node boundaries.
+    # Find an available continuous slot within node boundaries.  Returns the
+    # offset of the first core in the global core map, or None.
     #
     def _find_slots_single_cont(self, cores_requested):
 
-        for slot in self.slots:
-            slot_node = slot['node']
-            slot_cores = slot['cores']
+        if self._tree_nbest[1] < cores_requested:
+            return None
 
-            slot_cores_offset = self._find_cores_cont(slot_cores, cores_requested, FREE)
+        # descend to the first node which has a large enough free run
+        pos  = 1
+        size = self._tree_size
+        while pos < size:
+            if self._tree_nbest[2 * pos] >= cores_requested:
+                pos = 2 * pos
+            else:
+                pos = 2 * pos + 1
 
-            if slot_cores_offset is not None:
-              # self._log.info('Node %s satisfies %d cores at offset %d',
-              #               slot_node, cores_requested, slot_cores_offset)
-                return ['%s:%d' % (slot_node, core) for core in
-                        range(slot_cores_offset, slot_cores_offset + cores_requested)]
+        cpn   = self._lrms_cores_per_node
+        start = (pos - size) * cpn
 
-        return None
+        return self._cores.find(self.CORE_FREE * cores_requested,
+                                start, start + cpn)
 
 
     # --------------------------------------------------------------------------
     #
-    # Find an available continuous slot across node boundaries.
+    # Find an available continuous slot across node boundaries.  Returns the
+    # offset of the first core in the global core map, or None.
     #
     def _find_slots_multi_cont(self, cores_requested):
 
-        # Convenience aliases
-        cores_per_node = self._lrms_cores_per_node
-        all_slots = self.slots
-
-        # Glue all slot core lists together
-        all_slot_cores = [core for node in [node['cores'] for node in all_slots] for core in node]
-        # self._log.debug("all_slot_cores: %s", all_slot_cores)
-
-        # Find the start of the first available region
-        all_slots_first_core_offset = self._find_cores_cont(all_slot_cores, cores_requested, FREE)
-        self._log.debug("all_slots_first_core_offset: %s", all_slots_first_core_offset)
-        if all_slots_first_core_offset is None:
+        if self._tree_best[1] < cores_requested:
             return None
 
-        # Determine the first slot in the slot list
-        first_slot_index = all_slots_first_core_offset / cores_per_node
-        self._log.debug("first_slot_index: %s", first_slot_index)
-        # And the core offset within that node
-        first_slot_core_offset = all_slots_first_core_offset % cores_per_node
-        self._log.debug("first_slot_core_offset: %s", first_slot_core_offset)
-
-        # Note: We subtract one here, because counting starts at zero;
-        #       Imagine a zero offset and a count of 1, the only core used
-        #       would be core 0.
-        #       TODO: Verify this claim :-)
-        all_slots_last_core_offset = (first_slot_index * cores_per_node) +\
-                                     first_slot_core_offset + cores_requested - 1
-        self._log.debug("all_slots_last_core_offset: %s", all_slots_last_core_offset)
-        last_slot_index = (all_slots_last_core_offset) / cores_per_node
-        self._log.debug("last_slot_index: %s", last_slot_index)
-        last_slot_core_offset = all_slots_last_core_offset % cores_per_node
-        self._log.debug("last_slot_core_offset: %s", last_slot_core_offset)
-
-        # Convenience aliases
-        last_slot = self.slots[last_slot_index]
-        self._log.debug("last_slot: %s", last_slot)
-        last_node = last_slot['node']
-        self._log.debug("last_node: %s", last_node)
-        first_slot = self.slots[first_slot_index]
-        self._log.debug("first_slot: %s", first_slot)
-        first_node = first_slot['node']
-        self._log.debug("first_node: %s", first_node)
-
-        # Collect all node:core slots here
-        task_slots = []
-
-        # Add cores from first slot for this unit
-        # As this is a multi-node search, we can safely assume that we go
-        # from the offset all the way to the last core.
-        task_slots.extend(['%s:%d' % (first_node, core) for core in
-                           range(first_slot_core_offset, cores_per_node)])
-
-        # Add all cores from "middle" slots
-        for slot_index in range(first_slot_index+1, last_slot_index):
-            slot_node = all_slots[slot_index]['node']
-            task_slots.extend(['%s:%d' % (slot_node, core) for core in range(0, cores_per_node)])
+        # descend to the first free run which is large enough -- that either
+        # lives in the left subtree, spans both subtrees, or lives in the right
+        # subtree.
+        pos   = 1
+        start = 0
+        size  = self._tree_size
+        while pos < size:
+            l = 2 * pos
+            r = l + 1
+            if self._tree_best[l] >= cores_requested:
+                pos = l
+            elif self._tree_suf[l] + self._tree_pref[r] >= cores_requested:
+                offset = start + self._tree_len[l] - self._tree_suf[l]
+                self._log.debug("all_slots_first_core_offset: %s", offset)
+                return offset
+            else:
+                start += self._tree_len[l]
+                pos    = r
 
-        # Add the cores of the last slot
-        task_slots.extend(['%s:%d' % (last_node, core) for core in range(0, last_slot_core_offset+1)])
+        # the run fits within a single node
+        cpn    = self._lrms_cores_per_node
+        offset = self._cores.find(self.CORE_FREE * cores_requested, start, start + cpn)
+        self._log.debug("all_slots_first_core_offset: %s", offset)
 
-        return task_slots
+        return offset
 
 
     # --------------------------------------------------------------------------
     #
-    # Change the reserved state of slots (FREE or BUSY)
+    # Change the reserved state of a continuous core range (FREE or BUSY)
     #
-    def _change_slot_states(self, task_slots, new_state):
+    def _change_slot_states(self, offset, cores, new_state):
 
-        # Convenience alias
-        all_slots = self.slots
+        if new_state == FREE: state = self.CORE_FREE
+        else                : state = self.CORE_BUSY
 
-        # logger.debug("change_slot_states: unit slots: %s", task_slots)
-
-        for slot in task_slots:
-            # logger.debug("change_slot_states: slot content: %s", slot)
-            # Get the node and the core part
-            [slot_node, slot_core] = slot.split(':')
-            # Find the entry in the the all_slots list
-            slot_entry = (slot for slot in all_slots if slot["node"] == slot_node).next()
-            # Change the state of the slot
-            slot_entry['cores'][int(slot_core)] = new_state
+        cpn = self._lrms_cores_per_node
 
+        self._cores[offset : offset + cores] = state * cores
+        self._tree_update(offset / cpn, (offset + cores - 1) / cpn)
 
 
 # ==============================================================================
@@ -3604,6 +3805,9 @@ class AgentExecutingComponent(rpu.Component):
 
         rpu.Component.__init__(self, 'AgentExecutingComponent', cfg)
 
+        # launch script templates, see _get_template()
+        self._templates = dict()
+
 
     # --------------------------------------------------------------------------
     #
@@ -3621,7 +3825,8 @@ class AgentExecutingComponent(rpu.Component):
         try:
             impl = {
                 SPAWNER_NAME_POPEN : AgentExecutingComponent_POPEN,
-                SPAWNER_NAME_SHELL : AgentExecutingComponent_SHELL
+                SPAWNER_NAME_SHELL : AgentExecutingComponent_SHELL,
+                SPAWNER_NAME_FORK  : AgentExecutingComponent_FORK
             }[name]
 
             impl = impl(cfg)
@@ -3631,6 +3836,45 @@ class AgentExecutingComponent(rpu.Component):
             raise ValueError("AgentExecutingComponent '%s' unknown or defunct" % name)
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _get_template(self, descr):
+        """
+        Units of a bag of tasks usually differ in their arguments only, so we
+        don't build their launch scripts from scratch.  The parts of a script
+        which only depend on the environment and pre- and post-exec of a unit
+        are compiled (by the spawner's _compile_template()) into a template,
+        which is cached and then filled in per unit with a single format
+        operation.
+        """
+
+        pre  = descr['pre_exec']
+        post = descr['post_exec']
+        env  = descr['environment']
+
+        if isinstance(pre,  list): pre  = tuple(pre)
+        if isinstance(post, list): post = tuple(post)
+        if env                   : env  = tuple(sorted(env.iteritems()))
+
+        key  = (pre, post, env)
+        tmpl = self._templates.get(key)
+
+        if tmpl is None:
+            if len(self._templates) >= TEMPLATE_CACHE_SIZE:
+                self._templates.clear()
+            tmpl = self._compile_template(descr)
+            self._templates[key] = tmpl
+
+        return tmpl
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _compile_template(self, descr):
+
+        raise NotImplementedError("_compile_template() missing for '%s'" % self.cname)
+
+
 
 # ==============================================================================
 #
@@ -3663,9 +3907,16 @@ class AgentExecutingComponent_POPEN (AgentExecutingComponent) :
         self.declare_subscriber('command', rp.AGENT_COMMAND_PUBSUB, self.command_cb)
 
         self._cancel_lock    = threading.RLock()
-        self._cus_to_cancel  = list()
-        self._cus_to_watch   = list()
-        self._watch_queue    = Queue.Queue ()
+        self._cus_to_cancel  = set()
+        self._canceled       = set()
+
+        # running units are indexed by pid (for the watcher) and uid (for
+        # cancellation).  The spawner registers units while holding the lock,
+        # so the watcher will always find the units it collects.
+        self._watch_lock     = threading.RLock()
+        self._pids           = dict()   # pid -> cu
+        self._uids           = dict()   # uid -> pid
+        self._spawned        = threading.Event()
 
         self._pilot_id = self._cfg['pilot_id']
 
@@ -3695,14 +3946,19 @@ class AgentExecutingComponent_POPEN (AgentExecutingComponent) :
 
         self.tmpdir = tempfile.gettempdir()
 
+        # simple units can be launched without writing a launch script
+        self._launch_script = self._cfg.get('launch_script', True)
+
 
     # --------------------------------------------------------------------------
     #
     def finalize_child(self):
 
-        # terminate watcher thread
+        # terminate watcher thread.  It may be blocked on still running units,
+        # but is a daemon thread and won't hold up the component shutdown.
         self._terminate.set()
-        self._watcher.join()
+        self._spawned.set()
+        self._watcher.join(timeout=1.0)
 
         # communicate finalization
         self.publish('command', {'cmd' : 'final',
@@ -3716,11 +3972,16 @@ class AgentExecutingComponent_POPEN (AgentExecutingComponent) :
         cmd = msg['cmd']
         arg = msg['arg']
 
-        if cmd == 'cancel_unit':
+        if cmd == 'cancel_units':
+
+            self._log.info("cancel units command (%d units)" % len(arg))
+            with self._cancel_lock:
+                self._cus_to_cancel.update(arg)
+            self._check_canceled()
 
-            self._log.info("cancel unit command (%s)" % arg)
+        elif cmd == 'cancel_done':
             with self._cancel_lock:
-                self._cus_to_cancel.append(arg)
+                self._cus_to_cancel.difference_update(arg)
 
         elif cmd == 'shutdown':
             self._log.info('received shutdown command')
@@ -3769,6 +4030,17 @@ class AgentExecutingComponent_POPEN (AgentExecutingComponent) :
     #
     def work(self, cu):
 
+        # units which got canceled while queued are not spawned
+        with self._cancel_lock:
+            canceled = cu['_id'] in self._cus_to_cancel
+            self._cus_to_cancel.discard(cu['_id'])
+
+        if canceled:
+            self._prof.prof('final', msg="execution canceled", uid=cu['_id'])
+            self.publish('unschedule', cu)
+            self.advance(cu, rp.CANCELED, publish=True, push=False)
+            return
+
       # self.advance(cu, rp.AGENT_EXECUTING, publish=True, push=False)
         self.advance(cu, rp.EXECUTING, publish=True, push=False)
 
@@ -3805,6 +4077,81 @@ class AgentExecutingComponent_POPEN (AgentExecutingComponent) :
             self.advance(cu, rp.FAILED, publish=True, push=False)
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _compile_template(self, descr):
+
+        # user provided values are escaped for the format operation (they are
+        # not necessarily strings, like numeric environment values)
+        def esc(val):
+            return ('%s' % val).replace('%', '%%')
+
+        def lines(cmds):
+            if isinstance(cmds, list): return ''.join(["%s\n" % esc(c) for c in cmds])
+            else                     : return "%s\n" % esc(cmds)
+
+        profile = 'RADICAL_PILOT_PROFILE' in os.environ
+
+        # Create string for environment variable setting
+        env = 'export'
+        if descr['environment']:
+            for key,val in descr['environment'].iteritems():
+                env += ' %s=%s' % (esc(key), esc(val))
+        env += " RP_SESSION_ID=%s" % self._cfg['session_id']
+        env += " RP_PILOT_ID=%s"   % self._cfg['pilot_id']
+        env += " RP_AGENT_ID=%s"   % self._cfg['agent_name']
+        env += " RP_SPAWNER_ID=%s" % self.cname
+        env += " RP_UNIT_ID=%(uid)s"
+
+        script = '#!/bin/bash -l\n\n'
+
+        if profile:
+            script += "echo script start_script `%(gtod)s` >> %(workdir)s/PROF\n"
+        script += '\n# Change to working directory for unit\ncd %(workdir)s\n'
+        if profile:
+            script += "echo script after_cd `%(gtod)s` >> %(workdir)s/PROF\n"
+
+        # Before the Big Bang there was nothing
+        if descr['pre_exec']:
+            # Note: extra spaces below are for visual alignment
+            script += "# Pre-exec commands\n"
+            if profile:
+                script += "echo pre  start `%(gtod)s` >> %(workdir)s/PROF\n"
+            script += lines(descr['pre_exec'])
+            if profile:
+                script += "echo pre  stop `%(gtod)s` >> %(workdir)s/PROF\n"
+
+        script += '# Environment variables\n%s\n' % env
+
+        script += "# The command to run\n"
+        script += "%(command)s\n"
+        script += "RETVAL=$?\n"
+        if profile:
+            script += "echo script after_exec `%(gtod)s` >> %(workdir)s/PROF\n"
+
+        # After the universe dies the infrared death, there will be nothing
+        if descr['post_exec']:
+            script += "# Post-exec commands\n"
+            if profile:
+                script += "echo post start `%(gtod)s` >> %(workdir)s/PROF\n"
+            script += '%s\n' % lines(descr['post_exec'])
+            if profile:
+                script += "echo post stop  `%(gtod)s` >> %(workdir)s/PROF\n"
+
+        script += "# Exit the script with the return code from the command\n"
+        script += "exit $RETVAL\n"
+
+        # Units without pre- and post-exec don't need a script: the spawner
+        # runs the command line in the unit's workdir anyway.
+        if descr['pre_exec'] or descr['post_exec'] or profile:
+            inline = None
+        else:
+            inline = '%s\n%%(command)s\n' % env
+
+        return {'script' : script,
+                'inline' : inline}
+
+
     # --------------------------------------------------------------------------
     #
     def spawn(self, launcher, cu):
@@ -3818,103 +4165,66 @@ class AgentExecutingComponent_POPEN (AgentExecutingComponent) :
 
         rec_makedir(cu_tmpdir)
         launch_script_name = '%s/radical_pilot_cu_launch_script.sh' % cu_tmpdir
-        self._log.debug("Created launch_script: %s", launch_script_name)
-
-        with open(launch_script_name, "w") as launch_script:
-            launch_script.write('#!/bin/bash -l\n\n')
-
-            if 'RADICAL_PILOT_PROFILE' in os.environ:
-                launch_script.write("echo script start_script `%s` >> %s/PROF\n" % (cu['gtod'], cu_tmpdir))
-            launch_script.write('\n# Change to working directory for unit\ncd %s\n' % cu_tmpdir)
-            if 'RADICAL_PILOT_PROFILE' in os.environ:
-                launch_script.write("echo script after_cd `%s` >> %s/PROF\n" % (cu['gtod'], cu_tmpdir))
-
-            # Before the Big Bang there was nothing
-            if cu['description']['pre_exec']:
-                pre_exec_string = ''
-                if isinstance(cu['description']['pre_exec'], list):
-                    for elem in cu['description']['pre_exec']:
-                        pre_exec_string += "%s\n" % elem
+
+        descr = cu['description']
+        tmpl  = self._get_template(descr)
+
+        # unit Arguments (if any)
+        task_args_string = ''
+        if descr['arguments']:
+            for arg in descr['arguments']:
+                if not arg:
+                    # ignore empty args
+                    continue
+
+                arg = arg.replace('"', '\\"')          # Escape all double quotes
+                if arg[0] == arg[-1] == "'" :          # If a string is between outer single quotes,
+                    task_args_string += '%s ' % arg    # ... pass it as is.
                 else:
-                    pre_exec_string += "%s\n" % cu['description']['pre_exec']
-                # Note: extra spaces below are for visual alignment
-                launch_script.write("# Pre-exec commands\n")
-                if 'RADICAL_PILOT_PROFILE' in os.environ:
-                    launch_script.write("echo pre  start `%s` >> %s/PROF\n" % (cu['gtod'], cu_tmpdir))
-                launch_script.write(pre_exec_string)
-                if 'RADICAL_PILOT_PROFILE' in os.environ:
-                    launch_script.write("echo pre  stop `%s` >> %s/PROF\n" % (cu['gtod'], cu_tmpdir))
-
-            # Create string for environment variable setting
-            env_string = 'export'
-            if cu['description']['environment']:
-                for key,val in cu['description']['environment'].iteritems():
-                    env_string += ' %s=%s' % (key, val)
-            env_string += " RP_SESSION_ID=%s" % self._cfg['session_id']
-            env_string += " RP_PILOT_ID=%s"   % self._cfg['pilot_id']
-            env_string += " RP_AGENT_ID=%s"   % self._cfg['agent_name']
-            env_string += " RP_SPAWNER_ID=%s" % self.cname
-            env_string += " RP_UNIT_ID=%s"    % cu['_id']
-            launch_script.write('# Environment variables\n%s\n' % env_string)
-
-            # unit Arguments (if any)
-            task_args_string = ''
-            if cu['description']['arguments']:
-                for arg in cu['description']['arguments']:
-                    if not arg:
-                        # ignore empty args
-                        continue
+                    task_args_string += '"%s" ' % arg  # Otherwise return between double quotes.
 
-                    arg = arg.replace('"', '\\"')          # Escape all double quotes
-                    if arg[0] == arg[-1] == "'" :          # If a string is between outer single quotes,
-                        task_args_string += '%s ' % arg    # ... pass it as is.
-                    else:
-                        task_args_string += '"%s" ' % arg  # Otherwise return between double quotes.
+        # The actual command line, constructed per launch-method
+        try:
+            launch_command, hop_cmd = \
+                launcher.construct_command(descr['executable'],
+                                           task_args_string,
+                                           descr['cores'],
+                                           launch_script_name,
+                                           cu['opaque_slots'])
+        except Exception as e:
+            msg = "Error in spawner (%s)" % e
+            self._log.exception(msg)
+            raise RuntimeError(msg)
 
-            # The actual command line, constructed per launch-method
-            try:
-                launch_command, hop_cmd = \
-                    launcher.construct_command(cu['description']['executable'],
-                                               task_args_string,
-                                               cu['description']['cores'],
-                                               launch_script_name,
-                                               cu['opaque_slots'])
-                if hop_cmd : cmdline = hop_cmd
-                else       : cmdline = launch_script_name
+        values = {'uid'     : cu['_id'],
+                  'gtod'    : cu['gtod'],
+                  'workdir' : cu_tmpdir,
+                  'command' : launch_command}
 
-            except Exception as e:
-                msg = "Error in spawner (%s)" % e
-                self._log.exception(msg)
-                raise RuntimeError(msg)
+        if not self._launch_script and tmpl['inline'] and not hop_cmd:
+            # simple unit, no need for a script.  The command is run by the
+            # same (login) shell which would run the launch script.
+            cmdline = 'exec /bin/bash -l -c %s' % pipes.quote(tmpl['inline'] % values)
+            self._prof.prof('command', msg='launch command constructed', uid=cu['_id'])
 
-            launch_script.write("# The command to run\n")
-            launch_script.write("%s\n" % launch_command)
-            launch_script.write("RETVAL=$?\n")
-            if 'RADICAL_PILOT_PROFILE' in os.environ:
-                launch_script.write("echo script after_exec `%s` >> %s/PROF\n" % (cu['gtod'], cu_tmpdir))
-
-            # After the universe dies the infrared death, there will be nothing
-            if cu['description']['post_exec']:
-                post_exec_string = ''
-                if isinstance(cu['description']['post_exec'], list):
-                    for elem in cu['description']['post_exec']:
-                        post_exec_string += "%s\n" % elem
-                else:
-                    post_exec_string += "%s\n" % cu['description']['post_exec']
-                launch_script.write("# Post-exec commands\n")
-                if 'RADICAL_PILOT_PROFILE' in os.environ:
-                    launch_script.write("echo post start `%s` >> %s/PROF\n" % (cu['gtod'], cu_tmpdir))
-                launch_script.write('%s\n' % post_exec_string)
-                if 'RADICAL_PILOT_PROFILE' in os.environ:
-                    launch_script.write("echo post stop  `%s` >> %s/PROF\n" % (cu['gtod'], cu_tmpdir))
-
-            launch_script.write("# Exit the script with the return code from the command\n")
-            launch_script.write("exit $RETVAL\n")
-
-        # done writing to launch script, get it ready for execution.
-        st = os.stat(launch_script_name)
-        os.chmod(launch_script_name, st.st_mode | stat.S_IEXEC)
-        self._prof.prof('command', msg='launch script constructed', uid=cu['_id'])
+        else:
+            with open(launch_script_name, "w") as launch_script:
+                launch_script.write(tmpl['script'] % values)
+            self._log.debug("Created launch_script: %s", launch_script_name)
+
+            # done writing to launch script, get it ready for execution.
+            os.chmod(launch_script_name, 0755)
+            self._prof.prof('command', msg='launch script constructed', uid=cu['_id'])
+
+            if hop_cmd : cmdline = hop_cmd
+            else       : cmdline = launch_script_name
+
+        self._launch(cu, cmdline, cu_tmpdir)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _launch(self, cu, cmdline, cu_tmpdir):
 
         _stdout_file_h = open(cu['stdout_file'], "w")
         _stderr_file_h = open(cu['stderr_file'], "w")
@@ -3922,27 +4232,34 @@ class AgentExecutingComponent_POPEN (AgentExecutingComponent) :
 
         self._log.info("Launching unit %s via %s in %s", cu['_id'], cmdline, cu_tmpdir)
 
-        proc = subprocess.Popen(args               = cmdline,
-                                bufsize            = 0,
-                                executable         = None,
-                                stdin              = None,
-                                stdout             = _stdout_file_h,
-                                stderr             = _stderr_file_h,
-                                preexec_fn         = None,
-                                close_fds          = True,
-                                shell              = True,
-                                cwd                = cu_tmpdir,
-                                env                = self._cu_environment,
-                                universal_newlines = False,
-                                startupinfo        = None,
-                                creationflags      = 0)
-
+        with self._watch_lock:
+
+            proc = subprocess.Popen(args               = cmdline,
+                                    bufsize            = 0,
+                                    executable         = None,
+                                    stdin              = None,
+                                    stdout             = _stdout_file_h,
+                                    stderr             = _stderr_file_h,
+                                    preexec_fn         = None,
+                                    close_fds          = True,
+                                    shell              = True,
+                                    cwd                = cu_tmpdir,
+                                    env                = self._cu_environment,
+                                    universal_newlines = False,
+                                    startupinfo        = None,
+                                    creationflags      = 0)
+
+            cu['started'] = rpu.timestamp()
+            cu['proc']    = proc
+
+            self._pids[proc.pid]  = cu
+            self._uids[cu['_id']] = proc.pid
+
+        self._spawned.set()
         self._prof.prof('spawn', msg='spawning passed to popen', uid=cu['_id'])
 
-        cu['started'] = rpu.timestamp()
-        cu['proc']    = proc
-
-        self._watch_queue.put(cu)
+        # the unit may have been canceled before it got here
+        self._check_canceled()
 
 
     # --------------------------------------------------------------------------
@@ -3958,37 +4275,53 @@ class AgentExecutingComponent_POPEN (AgentExecutingComponent) :
 
             while not self._terminate.is_set():
 
-                cus = list()
+                with self._watch_lock:
+                    running = len(self._pids)
 
-                try:
+                if not running:
+                    # nothing to collect -- wait for the next spawn
+                    self._spawned.wait(self._cfg['db_poll_sleeptime'])
+                    self._spawned.clear()
+                    continue
 
-                    # we don't want to only wait for one CU -- then we would
-                    # pull CU state too frequently.  OTOH, we also don't want to
-                    # learn about CUs until all slots are filled, because then
-                    # we may not be able to catch finishing CUs in time -- so
-                    # there is a fine balance here.  Balance means 100 (FIXME).
-                  # self._prof.prof('ExecWorker popen watcher pull cu from queue')
-                    MAX_QUEUE_BULKSIZE = 100
-                    while len(cus) < MAX_QUEUE_BULKSIZE :
-                        cus.append (self._watch_queue.get_nowait())
+                # All children of this process are units, so we can block
+                # until any one of them finishes.  That way we only ever touch
+                # units which completed, and we get their resource usage for
+                # free.
+                try:
+                    pid, status, rusage = os.wait4(-1, 0)
+                except OSError as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    if e.errno == errno.ECHILD:
+                        self._log.error("no children to collect (%d running)", running)
+                        self._spawned.wait(self._cfg['db_poll_sleeptime'])
+                        self._spawned.clear()
+                        continue
+                    raise
 
-                except Queue.Empty:
+                with self._watch_lock:
+                    cu = self._pids.pop(pid, None)
+                    if cu:
+                        del(self._uids[cu['_id']])
 
-                    # nothing found -- no problem, see if any CUs finished
-                    pass
+                if not cu:
+                    self._log.error("collected unknown child %s (%s)", pid, status)
+                    continue
 
-                # add all cus we found to the watchlist
-                for cu in cus :
+                if os.WIFSIGNALED(status): exit_code = -os.WTERMSIG(status)
+                else                     : exit_code =  os.WEXITSTATUS(status)
 
-                    self._prof.prof('passed', msg="ExecWatcher picked up unit", uid=cu['_id'])
-                    self._cus_to_watch.append (cu)
+                # the proc is collected -- make sure Popen does not try again
+                proc = cu['proc']
+                proc.returncode = exit_code
+                del(cu['proc'])  # proc is not json serializable
 
-                # check on the known cus.
-                action = self._check_running()
+                cu['rusage'] = {'utime'  : rusage.ru_utime,
+                                'stime'  : rusage.ru_stime,
+                                'maxrss' : rusage.ru_maxrss}
 
-                if not action and not cus :
-                    # nothing happened at all!  Zzz for a bit.
-                    time.sleep(self._cfg['db_poll_sleeptime'])
+                self._unit_exited(cu, exit_code)
 
         except Exception as e:
             self._log.exception("Error in ExecWorker watch loop (%s)" % e)
@@ -3999,98 +4332,436 @@ class AgentExecutingComponent_POPEN (AgentExecutingComponent) :
 
 
     # --------------------------------------------------------------------------
-    # Iterate over all running tasks, check their status, and decide on the
-    # next step.  Also check for a requested cancellation for the tasks.
-    def _check_running(self):
-
-        action = 0
+    #
+    def _check_canceled(self):
 
-        for cu in self._cus_to_watch:
+        with self._cancel_lock:
 
-            # poll subprocess object
-            exit_code = cu['proc'].poll()
-            now       = rpu.timestamp()
+            if not self._cus_to_cancel:
+                return
 
-            if exit_code is None:
-                # Process is still running
+            with self._watch_lock:
 
-                if cu['_id'] in self._cus_to_cancel:
+                # look up the smaller set in the larger one -- units which are
+                # not running (yet) stay in the cancel set
+                if len(self._cus_to_cancel) < len(self._uids):
+                    uids = [uid for uid in self._cus_to_cancel if uid in self._uids]
+                else:
+                    uids = [uid for uid in self._uids if uid in self._cus_to_cancel]
 
-                    # FIXME: there is a race condition between the state poll
-                    # above and the kill command below.  We probably should pull
-                    # state after kill again?
+                for uid in uids:
 
-                    # We got a request to cancel this cu
-                    action += 1
-                    cu['proc'].kill()
-                    cu['proc'].wait() # make sure proc is collected
+                    # the watcher will collect the unit
+                    self._cus_to_cancel.discard(uid)
+                    self._canceled.add(uid)
+                    self._pids[self._uids[uid]]['proc'].kill()
 
-                    with self._cancel_lock:
-                        self._cus_to_cancel.remove(cu['_id'])
 
-                    self._prof.prof('final', msg="execution canceled", uid=cu['_id'])
+    # --------------------------------------------------------------------------
+    #
+    def _unit_exited(self, cu, exit_code):
 
-                    del(cu['proc'])  # proc is not json serializable
-                    self.publish('unschedule', cu)
-                    self.advance(cu, rp.CANCELED, publish=True, push=False)
+        uid = cu['_id']
 
-            else:
-                self._prof.prof('exec', msg='execution complete', uid=cu['_id'])
+        self._log.info("Unit %s has return code %s.", uid, exit_code)
 
-                # make sure proc is collected
-                cu['proc'].wait()
+        cu['exit_code'] = exit_code
+        cu['finished']  = rpu.timestamp()
 
-                # we have a valid return code -- unit is final
-                action += 1
-                self._log.info("Unit %s has return code %s.", cu['_id'], exit_code)
+        # Free the Slots, Flee the Flots, Ree the Frots!
+        self.publish('unschedule', cu)
 
-                cu['exit_code'] = exit_code
-                cu['finished']  = now
+        with self._cancel_lock:
+            canceled = uid in self._canceled
+            self._canceled.discard(uid)
+            self._cus_to_cancel.discard(uid)
 
-                # Free the Slots, Flee the Flots, Ree the Frots!
-                self._cus_to_watch.remove(cu)
-                del(cu['proc'])  # proc is not json serializable
-                self.publish('unschedule', cu)
+        if canceled:
+            self._prof.prof('final', msg="execution canceled", uid=uid)
+            self.advance(cu, rp.CANCELED, publish=True, push=False)
+            return
 
-                if exit_code != 0:
-                    # The unit failed - fail after staging output
-                    self._prof.prof('final', msg="execution failed", uid=cu['_id'])
-                    cu['target_state'] = rp.FAILED
+        self._prof.prof('exec', msg='execution complete', uid=uid)
 
-                else:
-                    # The unit finished cleanly, see if we need to deal with
-                    # output data.  We always move to stageout, even if there are no
-                    # directives -- at the very least, we'll upload stdout/stderr
-                    self._prof.prof('final', msg="execution succeeded", uid=cu['_id'])
-                    cu['target_state'] = rp.DONE
+        if exit_code != 0:
+            # The unit failed - fail after staging output
+            self._prof.prof('final', msg="execution failed", uid=uid)
+            cu['target_state'] = rp.FAILED
 
-                self.advance(cu, rp.AGENT_STAGING_OUTPUT_PENDING, publish=True, push=True)
+        else:
+            # The unit finished cleanly, see if we need to deal with
+            # output data.  We always move to stageout, even if there are no
+            # directives -- at the very least, we'll upload stdout/stderr
+            self._prof.prof('final', msg="execution succeeded", uid=uid)
+            cu['target_state'] = rp.DONE
 
-        return action
+        self.advance(cu, rp.AGENT_STAGING_OUTPUT_PENDING, publish=True, push=True)
 
 
 # ==============================================================================
 #
-class AgentExecutingComponent_SHELL(AgentExecutingComponent):
+# The FORK executor does not spawn units from the (large, multi-threaded)
+# component process, but from a small launcher helper which is forked very
+# early during component startup, before any threads, sockets or launch
+# methods exist.  Forking that helper is cheap, the helper's file descriptors
+# are closed once at startup (instead of on every launch), and no shell script
+# permission fiddling or Popen bookkeeping happens in the component.
+#
+# The component talks to the helper over two pipes, with one json message per
+# line:
+#
+#   component -> helper : {'cmd' : 'env',   'env' : {...}}
+#                         {'cmd' : 'spawn', 'uid' : ..., 'cmdline' : ...,
+#                          'cwd' : ..., 'stdout' : ..., 'stderr' : ...}
+#                         {'cmd' : 'kill',  'uid' : ...}
+#
+#   helper -> component : {'uid' : ..., 'pid' : ..., 'exit_code' : ...,
+#                          'utime' : ..., 'stime' : ..., 'maxrss' : ...}
+#                         {'uid' : ..., 'pid' : None, 'error' : ...}
+#
+# The helper collects exited children on SIGCHLD (via a self-pipe), so that no
+# polling is needed on either side.  Units are run in their own process group,
+# so that a kill request reaches all processes of the unit.  When the component
+# closes the request pipe, the helper kills all remaining units and exits.
+#
+def _fork_server(req_fd, rep_fd):
+
+    # the helper only uses async-signal-safe calls, raw fds and os._exit -- it
+    # must not touch any of the inherited loggers, profilers or sockets.
+    keep = sorted([req_fd, rep_fd])
+    os.closerange(3,           keep[0])
+    os.closerange(keep[0] + 1, keep[1])
+    os.closerange(keep[1] + 1, os.sysconf('SC_OPEN_MAX'))
+
+    sig_r, sig_w = os.pipe()
+    for fd in [req_fd, rep_fd, sig_r, sig_w]:
+        fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+    for fd in [sig_r, sig_w]:
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT,  signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.siginterrupt(signal.SIGCHLD, False)
+    signal.set_wakeup_fd(sig_w)
+
+    env  = None
+    pids = dict()   # uid -> pid
+    uids = dict()   # pid -> uid
+    buf  = ''
+
+    def reply(msg):
+        data = json.dumps(msg) + '\n'
+        while data:
+            data = data[os.write(rep_fd, data):]
+
+    def spawn(req):
+        pid = os.fork()
+        if not pid:
+            try:
+                os.setpgid(0, 0)
+                fd_in  = os.open('/dev/null', os.O_RDONLY)
+                fd_out = os.open(req['stdout'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666)
+                fd_err = os.open(req['stderr'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666)
+                os.dup2(fd_in,  0)
+                os.dup2(fd_out, 1)
+                os.dup2(fd_err, 2)
+                os.chdir(req['cwd'])
+                signal.signal(signal.SIGINT,  signal.SIG_DFL)
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                os.execve('/bin/sh', ['/bin/sh', '-c', req['cmdline']], env)
+            except Exception as e:
+                try:
+                    os.write(2, "cannot exec unit: %s\n" % e)
+                finally:
+                    os._exit(127)
+        # also set the process group here, so that a kill cannot race the child
+        try:
+            os.setpgid(pid, pid)
+        except OSError:
+            pass
+        pids[req['uid']] = pid
+        uids[pid]        = req['uid']
+
+    def reap():
+        while uids:
+            try:
+                pid, status, rusage = os.wait4(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    break
+                raise
+            if not pid:
+                break
+            if os.WIFSIGNALED(status): exit_code = -os.WTERMSIG(status)
+            else                     : exit_code =  os.WEXITSTATUS(status)
+            uid = uids.pop(pid, None)
+            if uid:
+                pids.pop(uid, None)
+                reply({'uid'       : uid,
+                       'pid'       : pid,
+                       'exit_code' : exit_code,
+                       'utime'     : rusage.ru_utime,
+                       'stime'     : rusage.ru_stime,
+                       'maxrss'    : rusage.ru_maxrss})
+
+    while True:
+
+        try:
+            rlist = select.select([req_fd, sig_r], [], [])[0]
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
 
+        if sig_r in rlist:
+            try:
+                while os.read(sig_r, 1024):
+                    pass
+            except OSError:
+                pass
+            reap()
+
+        if req_fd not in rlist:
+            continue
+
+        data = os.read(req_fd, 64 * 1024)
+        if not data:
+            # component is gone
+            break
+
+        lines = (buf + data).split('\n')
+        buf   = lines.pop()
+
+        for line in lines:
+            req = json.loads(line)
+            if req['cmd'] == 'env':
+                env = dict([(str(k), str(v)) for k, v in req['env'].iteritems()])
+            elif req['cmd'] == 'spawn':
+                try:
+                    spawn(req)
+                except Exception as e:
+                    reply({'uid' : req['uid'], 'pid' : None, 'error' : str(e)})
+            elif req['cmd'] == 'kill':
+                if req['uid'] in pids:
+                    try:
+                        os.killpg(pids[req['uid']], signal.SIGKILL)
+                    except OSError:
+                        pass
+
+    for pid in uids:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+# ==============================================================================
+#
+class AgentExecutingComponent_FORK(AgentExecutingComponent_POPEN):
 
     # --------------------------------------------------------------------------
     #
     def __init__(self, cfg):
 
-        AgentExecutingComponent.__init__ (self, cfg)
+        AgentExecutingComponent_POPEN.__init__ (self, cfg)
 
 
     # --------------------------------------------------------------------------
     #
     def initialize_child(self):
 
-        self.declare_input (rp.EXECUTING_PENDING, rp.AGENT_EXECUTING_QUEUE)
-        self.declare_worker(rp.EXECUTING_PENDING, self.work)
+        # fork the launcher helper before anything else happens in this
+        # process: it should be as small as possible, and have no threads
+        req_r, req_w = os.pipe()
+        rep_r, rep_w = os.pipe()
 
-        self.declare_output(rp.AGENT_STAGING_OUTPUT_PENDING, rp.AGENT_STAGING_OUTPUT_QUEUE)
+        pid = os.fork()
+        if not pid:
+            os.close(req_w)
+            os.close(rep_r)
+            try:
+                _fork_server(req_r, rep_w)
+            except:
+                os._exit(1)
+            os._exit(0)
 
-        self.declare_publisher ('unschedule', rp.AGENT_UNSCHEDULE_PUBSUB)
+        os.close(req_r)
+        os.close(rep_w)
+
+        for fd in [req_w, rep_r]:
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+        self._fs_pid      = pid
+        self._fs_req      = req_w
+        self._fs_rep      = rep_r
+        self._fs_lock     = threading.RLock()
+        self._fs_units    = dict()   # uid -> cu, for all units handed to the helper
+
+        AgentExecutingComponent_POPEN.initialize_child(self)
+
+        self._fs_send({'cmd' : 'env',
+                       'env' : dict(self._cu_environment)})
+
+
+    # --------------------------------------------------------------------------
+    #
+    def finalize_child(self):
+
+        AgentExecutingComponent_POPEN.finalize_child(self)
+
+        # closing the request pipe terminates the helper
+        os.close(self._fs_req)
+        os.close(self._fs_rep)
+        os.waitpid(self._fs_pid, 0)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _fs_send(self, msg):
+
+        data = json.dumps(msg) + '\n'
+
+        with self._fs_lock:
+            while data:
+                data = data[os.write(self._fs_req, data):]
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _launch(self, cu, cmdline, cu_tmpdir):
+
+        self._log.info("Launching unit %s via %s in %s", cu['_id'], cmdline, cu_tmpdir)
+
+        cu['started'] = rpu.timestamp()
+
+        # register the unit before the helper can report it as done
+        with self._fs_lock:
+            self._fs_units[cu['_id']] = cu
+
+        self._fs_send({'cmd'     : 'spawn',
+                       'uid'     : cu['_id'],
+                       'cmdline' : cmdline,
+                       'cwd'     : cu_tmpdir,
+                       'stdout'  : cu['stdout_file'],
+                       'stderr'  : cu['stderr_file']})
+
+        self._prof.prof('spawn', msg='spawning passed to launcher', uid=cu['_id'])
+
+        # the unit may have been canceled before it got here
+        self._check_canceled()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _watch(self):
+
+        cname = self.name.replace('Component', 'Watcher')
+        self._prof = rpu.Profiler(cname)
+        self._prof.prof('run', uid=self._pilot_id)
+        try:
+            self._log = ru.get_logger(cname, target="%s.log" % cname,
+                                      level='DEBUG') # FIXME?
+
+            buf = ''
+            while not self._terminate.is_set():
+
+                # the helper sends a message for each unit which completes --
+                # we wait for those, but check for termination once in a while
+                rlist = select.select([self._fs_rep], [], [],
+                                      self._cfg['db_poll_sleeptime'])[0]
+                if not rlist:
+                    continue
+
+                data = os.read(self._fs_rep, 64 * 1024)
+                if not data:
+                    raise RuntimeError('launcher helper died')
+
+                lines = (buf + data).split('\n')
+                buf   = lines.pop()
+
+                for line in lines:
+                    self._handle_msg(json.loads(line))
+
+        except Exception as e:
+            self._log.exception("Error in ExecWorker watch loop (%s)" % e)
+            # FIXME: this should signal the ExecWorker for shutdown...
+
+        self._prof.prof('stop', uid=self._pilot_id)
+        self._prof.flush()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _check_canceled(self):
+
+        with self._cancel_lock:
+
+            if not self._cus_to_cancel:
+                return
+
+            with self._fs_lock:
+                if len(self._cus_to_cancel) < len(self._fs_units):
+                    cancel = [uid for uid in self._cus_to_cancel if uid in self._fs_units]
+                else:
+                    cancel = [uid for uid in self._fs_units if uid in self._cus_to_cancel]
+
+            for uid in cancel:
+                self._cus_to_cancel.discard(uid)
+                self._canceled.add(uid)
+                self._fs_send({'cmd' : 'kill',
+                               'uid' : uid})
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _handle_msg(self, msg):
+
+        uid = msg['uid']
+
+        with self._fs_lock:
+            cu = self._fs_units.pop(uid, None)
+
+        if not cu:
+            self._log.error("launcher reports unknown unit %s", uid)
+            return
+
+        if msg.get('error'):
+            self._log.error("launcher failed to spawn unit %s: %s", uid, msg['error'])
+            cu['stderr'] += "\nPilot cannot start compute unit:\n%s\n" % msg['error']
+            self.publish('unschedule', cu)
+            self.advance(cu, rp.FAILED, publish=True, push=False)
+            return
+
+        cu['rusage'] = {'utime'  : msg['utime'],
+                        'stime'  : msg['stime'],
+                        'maxrss' : msg['maxrss']}
+
+        self._unit_exited(cu, msg['exit_code'])
+
+
+# ==============================================================================
+#
+class AgentExecutingComponent_SHELL(AgentExecutingComponent):
+
+
+    # --------------------------------------------------------------------------
+    #
+    def __init__(self, cfg):
+
+        AgentExecutingComponent.__init__ (self, cfg)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def initialize_child(self):
+
+        self.declare_input (rp.EXECUTING_PENDING, rp.AGENT_EXECUTING_QUEUE)
+        self.declare_worker(rp.EXECUTING_PENDING, self.work)
+
+        self.declare_output(rp.AGENT_STAGING_OUTPUT_PENDING, rp.AGENT_STAGING_OUTPUT_QUEUE)
+
+        self.declare_publisher ('unschedule', rp.AGENT_UNSCHEDULE_PUBSUB)
         self.declare_publisher ('state',      rp.AGENT_STATE_PUBSUB)
 
         # all components use the command channel for control messages
@@ -4169,7 +4840,7 @@ class AgentExecutingComponent_SHELL(AgentExecutingComponent):
         self._registry      = dict()
         self._registry_lock = threading.RLock()
 
-        self._cus_to_cancel  = list()
+        self._cus_to_cancel  = set()
         self._cancel_lock    = threading.RLock()
 
         self._cached_events = list() # keep monitoring events for pid's which
@@ -4227,11 +4898,15 @@ class AgentExecutingComponent_SHELL(AgentExecutingComponent):
         cmd = msg['cmd']
         arg = msg['arg']
 
-        if cmd == 'cancel_unit':
+        if cmd == 'cancel_units':
+
+            self._log.info("cancel units command (%d units)" % len(arg))
+            with self._cancel_lock:
+                self._cus_to_cancel.update(arg)
 
-            self._log.info("cancel unit command (%s)" % arg)
+        elif cmd == 'cancel_done':
             with self._cancel_lock:
-                self._cus_to_cancel.append(arg)
+                self._cus_to_cancel.difference_update(arg)
 
         elif cmd == 'shutdown':
             self._log.info('received shutdown command')
@@ -4243,11 +4918,11 @@ class AgentExecutingComponent_SHELL(AgentExecutingComponent):
     def work(self, cu):
 
         # check that we don't start any units which need cancelling
-        if cu['_id'] in self._cus_to_cancel:
-
-            with self._cancel_lock:
-                self._cus_to_cancel.remove(cu['_id'])
+        with self._cancel_lock:
+            canceled = cu['_id'] in self._cus_to_cancel
+            self._cus_to_cancel.discard(cu['_id'])
 
+        if canceled:
             self.publish('unschedule', cu)
             self.advance(cu, rp.CANCELED, publish=True, push=False)
             return True
@@ -4256,27 +4931,22 @@ class AgentExecutingComponent_SHELL(AgentExecutingComponent):
         # FIXME: this should probably go into a separate idle callback
         if self._cus_to_cancel:
 
-            # NOTE: cu cancellation is costly: we keep a potentially long list
-            # of cancel candidates, perform one inversion and n lookups on the
-            # registry, and lock the registry for that complete time span...
-
-            with self._registry_lock :
-                # inverse registry for quick lookups:
-                inv_registry = {v: k for k, v in self._registry.items()}
+            # the registry is indexed by pid -- we check each registered unit
+            # against the cancel set once
+            with self._registry_lock, self._cancel_lock:
 
-                for cu_uid in self._cus_to_cancel:
-                    pid = inv_registry.get(cu_uid)
-                    if pid:
-                        # we own that cu, cancel it!
-                        ret, out, _ = self.launcher_shell.run_sync ('CANCEL %s\n' % pid)
-                        if  ret != 0 :
-                            self._log.error ("failed to cancel unit '%s': (%s)(%s)" \
-                                            , (cu_uid, ret, out))
-                        # successful or not, we only try once
-                        del(self._registry[pid])
+                cancel = [[pid, reg_cu['_id']] for pid, reg_cu in self._registry.items()
+                                               if reg_cu['_id'] in self._cus_to_cancel]
 
-                        with self._cancel_lock:
-                            self._cus_to_cancel.remove(cu_uid)
+                for pid, cu_uid in cancel:
+                    # we own that cu, cancel it!
+                    ret, out, _ = self.launcher_shell.run_sync ('CANCEL %s\n' % pid)
+                    if  ret != 0 :
+                        self._log.error ("failed to cancel unit '%s': (%s)(%s)" \
+                                        , (cu_uid, ret, out))
+                    # successful or not, we only try once
+                    del(self._registry[pid])
+                    self._cus_to_cancel.discard(cu_uid)
 
             # The state advance will be managed by the watcher, which will pick
             # up the cancel notification.  
@@ -4353,53 +5023,10 @@ class AgentExecutingComponent_SHELL(AgentExecutingComponent):
         # ----------------------------------------------------------------------
 
         args  = ""
-        env   = self._deactivate
-        cwd   = ""
-        pre   = ""
-        post  = ""
         io    = ""
-        cmd   = ""
+        hop   = ""
         descr = cu['description']
-
-        if  cu['workdir'] :
-            cwd  += "# CU workdir\n"
-            cwd  += "mkdir -p %s\n" % cu['workdir']
-            # TODO: how do we align this timing with the mkdir with POPEN? (do we at all?)
-            cwd  += "cd       %s\n" % cu['workdir']
-            if 'RADICAL_PILOT_PROFILE' in os.environ:
-                cwd  += "echo script after_cd `%s` >> %s/PROF\n" % (cu['gtod'], cu['workdir'])
-            cwd  += "\n"
-
-        env  += "# CU environment\n"
-        if descr['environment']:
-            for e in descr['environment'] :
-                env += "export %s=%s\n"  %  (e, descr['environment'][e])
-        env  += "export RP_SESSION_ID=%s\n" % self._cfg['session_id']
-        env  += "export RP_PILOT_ID=%s\n"   % self._cfg['pilot_id']
-        env  += "export RP_AGENT_ID=%s\n"   % self._cfg['agent_name']
-        env  += "export RP_SPAWNER_ID=%s\n" % self.cname
-        env  += "export RP_UNIT_ID=%s\n"    % cu['_id']
-        env  += "\n"
-
-        if  descr['pre_exec'] :
-            pre  += "# CU pre-exec\n"
-            if 'RADICAL_PILOT_PROFILE' in os.environ:
-                pre  += "echo pre  start `%s` >> %s/PROF\n" % (cu['gtod'], cu['workdir'])
-            pre  += '\n'.join(descr['pre_exec' ])
-            pre  += "\n"
-            if 'RADICAL_PILOT_PROFILE' in os.environ:
-                pre  += "echo pre  stop  `%s` >> %s/PROF\n" % (cu['gtod'], cu['workdir'])
-            pre  += "\n"
-
-        if  descr['post_exec'] :
-            post += "# CU post-exec\n"
-            if 'RADICAL_PILOT_PROFILE' in os.environ:
-                post += "echo post start `%s` >> %s/PROF\n" % (cu['gtod'], cu['workdir'])
-            post += '\n'.join(descr['post_exec' ])
-            post += "\n"
-            if 'RADICAL_PILOT_PROFILE' in os.environ:
-                post += "echo post stop  `%s` >> %s/PROF\n" % (cu['gtod'], cu['workdir'])
-            post += "\n"
+        tmpl  = self._get_template(descr)
 
         if  descr['arguments']  :
             args  = ' ' .join (quote_args (descr['arguments']))
@@ -4416,40 +5043,105 @@ class AgentExecutingComponent_SHELL(AgentExecutingComponent):
                                                    '/usr/bin/env RP_SPAWNER_HOP=TRUE "$0"',
                                                    cu['opaque_slots'])
 
-        script = ''
-        if 'RADICAL_PILOT_PROFILE' in os.environ:
-            script += "echo script start_script `%s` >> %s/PROF\n" % (cu['gtod'], cu['workdir'])
-
         if hop_cmd :
             # the script will itself contain a remote callout which calls again
             # the script for the invokation of the real workload (cmd) -- we
             # thus introduce a guard for the first execution.  The hop_cmd MUST
             # set RP_SPAWNER_HOP to some value for the startup to work
 
-            script += "# ------------------------------------------------------\n"
-            script += '# perform one hop for the actual command launch\n'
-            script += 'if test -z "$RP_SPAWNER_HOP"\n'
-            script += 'then\n'
-            script += '    %s\n' % hop_cmd
-            script += '    exit\n'
-            script += 'fi\n\n'
+            hop += "# ------------------------------------------------------\n"
+            hop += '# perform one hop for the actual command launch\n'
+            hop += 'if test -z "$RP_SPAWNER_HOP"\n'
+            hop += 'then\n'
+            hop += '    %s\n' % hop_cmd
+            hop += '    exit\n'
+            hop += 'fi\n\n'
+
+        script = tmpl['script'] % {'uid'     : cu['_id'],
+                                   'gtod'    : cu['gtod'],
+                                   'workdir' : cu['workdir'],
+                                   'hop'     : hop,
+                                   'command' : "%s %s" % (cmd, io)}
 
+      # self._log.debug ("execution script:\n%s\n" % script)
+
+        return script
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _compile_template(self, descr):
+
+        # user provided values are escaped for the format operation (they are
+        # not necessarily strings, like numeric environment values)
+        def esc(val):
+            return ('%s' % val).replace('%', '%%')
+
+        env     = esc(self._deactivate)
+        cwd     = ""
+        pre     = ""
+        post    = ""
+        profile = 'RADICAL_PILOT_PROFILE' in os.environ
+
+        # the workdir is always set by the input stager
+        cwd  += "# CU workdir\n"
+        cwd  += "mkdir -p %(workdir)s\n"
+        # TODO: how do we align this timing with the mkdir with POPEN? (do we at all?)
+        cwd  += "cd       %(workdir)s\n"
+        if profile:
+            cwd  += "echo script after_cd `%(gtod)s` >> %(workdir)s/PROF\n"
+        cwd  += "\n"
+
+        env  += "# CU environment\n"
+        if descr['environment']:
+            for e in descr['environment'] :
+                env += "export %s=%s\n"  %  (esc(e), esc(descr['environment'][e]))
+        env  += "export RP_SESSION_ID=%s\n" % self._cfg['session_id']
+        env  += "export RP_PILOT_ID=%s\n"   % self._cfg['pilot_id']
+        env  += "export RP_AGENT_ID=%s\n"   % self._cfg['agent_name']
+        env  += "export RP_SPAWNER_ID=%s\n" % self.cname
+        env  += "export RP_UNIT_ID=%(uid)s\n"
+        env  += "\n"
+
+        if  descr['pre_exec'] :
+            pre  += "# CU pre-exec\n"
+            if profile:
+                pre  += "echo pre  start `%(gtod)s` >> %(workdir)s/PROF\n"
+            pre  += esc('\n'.join(descr['pre_exec' ]))
+            pre  += "\n"
+            if profile:
+                pre  += "echo pre  stop  `%(gtod)s` >> %(workdir)s/PROF\n"
+            pre  += "\n"
+
+        if  descr['post_exec'] :
+            post += "# CU post-exec\n"
+            if profile:
+                post += "echo post start `%(gtod)s` >> %(workdir)s/PROF\n"
+            post += esc('\n'.join(descr['post_exec' ]))
+            post += "\n"
+            if profile:
+                post += "echo post stop  `%(gtod)s` >> %(workdir)s/PROF\n"
+            post += "\n"
+
+        script = ''
+        if profile:
+            script += "echo script start_script `%(gtod)s` >> %(workdir)s/PROF\n"
+
+        script += "%(hop)s"
         script += "# ------------------------------------------------------\n"
         script += "%s"        %  cwd
         script += "%s"        %  env
         script += "%s"        %  pre
         script += "# CU execution\n"
-        script += "%s %s\n\n" % (cmd, io)
+        script += "%(command)s\n\n"
         script += "RETVAL=$?\n"
-        if 'RADICAL_PILOT_PROFILE' in os.environ:
-            script += "echo script after_exec `%s` >> %s/PROF\n" % (cu['gtod'], cu['workdir'])
+        if profile:
+            script += "echo script after_exec `%(gtod)s` >> %(workdir)s/PROF\n"
         script += "%s"        %  post
         script += "exit $RETVAL\n"
         script += "# ------------------------------------------------------\n\n"
 
-      # self._log.debug ("execution script:\n%s\n" % script)
-
-        return script
+        return {'script' : script}
 
 
     # --------------------------------------------------------------------------
@@ -4641,6 +5333,10 @@ class AgentExecutingComponent_SHELL(AgentExecutingComponent):
 
         self._prof.prof('exec', msg='execution complete', uid=cu['_id'])
 
+        # a cancel request which did not make it in time is void now
+        with self._cancel_lock:
+            self._cus_to_cancel.discard(cu['_id'])
+
         # for final states, we can free the slots.
         self.publish('unschedule', cu)
 
@@ -4677,10 +5373,34 @@ class AgentUpdateWorker(rpu.Worker):
     An UpdateWorker pushes CU and Pilot state updates to mongodb.  Its instances
     compete for update requests on the update_queue.  Those requests will be
     triplets of collection name, query dict, and update dict.  Update requests
-    will be collected into bulks over some time (BULK_COLLECTION_TIME), to
-    reduce number of roundtrips.
+    will be collected into bulks, to reduce number of roundtrips.  A bulk is
+    pushed when whichever comes first:
+
+      - it holds updates for BULK_COLLECTION_SIZE units,
+      - its oldest update is older than BULK_COLLECTION_TIME, or
+      - no new update arrived for BULK_COLLECTION_IDLE.
+
+    All state updates for the same unit within a bulk are coalesced into a
+    single DB update.  Units in transient agent states (which are usually
+    followed by the next state within milliseconds) are held back on idle
+    pushes, so that their updates get coalesced with the next state change,
+    too -- but never for longer than BULK_COLLECTION_TIME.  The state history
+    timestamps are taken when the state changes (see rpu.Component.advance),
+    so the history is the same, no matter when it is pushed.
     """
 
+    # states in which units leave the agent
+    FINAL_STATES     = [rp.DONE, rp.FAILED, rp.CANCELED, rp.PENDING_OUTPUT_STAGING]
+
+    # states which are not pushed on their own on idle pushes
+    TRANSIENT_STATES = [rp.AGENT_STAGING_INPUT_PENDING,
+                        rp.AGENT_STAGING_INPUT,
+                        rp.ALLOCATING_PENDING,
+                        rp.ALLOCATING,
+                        rp.EXECUTING_PENDING,
+                        rp.AGENT_STAGING_OUTPUT_PENDING,
+                        rp.AGENT_STAGING_OUTPUT]
+
     # --------------------------------------------------------------------------
     #
     def __init__(self, cfg):
@@ -4704,13 +5424,33 @@ class AgentUpdateWorker(rpu.Worker):
         self._mongodb_url   = self._cfg['mongodb_url']
         self._pilot_id      = self._cfg['pilot_id']
 
+        self._bulk_time     = self._cfg.get('bulk_collection_time', 1.0)
+        self._bulk_size     = self._cfg.get('bulk_collection_size', 1024)
+        self._bulk_idle     = self._cfg.get('bulk_collection_idle', 0.1)
+
         _, db, _, _, _      = ru.mongodb_connect(self._mongodb_url)
         self._mongo_db      = db
         self._cinfo         = dict()            # collection cache
         self._lock          = threading.RLock() # protect _cinfo
 
+        # bulk statistics
+        self._metrics       = {'bulks'   : 0,   # number of pushed bulks
+                               'updates' : 0,   # number of received updates
+                               'ops'     : 0,   # number of DB update ops
+                               'wait'    : 0.0, # time updates waited for push
+                               'exec'    : 0.0} # time spent in bulk execution
+
+        # the components keep the uids of units to cancel until they see
+        # the unit.  Units which left the agent before that are announced
+        # with a 'cancel_done' command, so that the uids can be forgotten.
+        # We remember recently finalized units, for cancel requests which
+        # arrive after the unit left.
+        self._cus_to_cancel = set()
+        self._cancel_done   = list()
+        self._final         = collections.OrderedDict()
+
         self.declare_subscriber('state', 'agent_state_pubsub', self.state_cb)
-        self.declare_idle_cb(self.idle_cb, self._cfg.get('bulk_collection_time'))
+        self.declare_idle_cb(self.idle_cb, self._bulk_idle)
 
         # all components use the command channel for control messages
         self.declare_publisher ('command', rp.AGENT_COMMAND_PUBSUB)
@@ -4725,6 +5465,16 @@ class AgentUpdateWorker(rpu.Worker):
     #
     def finalize_child(self):
 
+        m = self._metrics
+        if m['bulks']:
+            self._log.info('bulk metrics: %d bulks, %d updates, %d ops, '
+                           'avg size %.1f, avg wait %.3fs, avg exec %.3fs, '
+                           'coalescing %.2f',
+                           m['bulks'], m['updates'], m['ops'],
+                           float(m['ops'])  / m['bulks'],
+                           m['wait'] / m['bulks'], m['exec'] / m['bulks'],
+                           float(m['updates']) / max(m['ops'], 1))
+
         # communicate finalization
         self.publish('command', {'cmd' : 'final',
                                  'arg' : self.cname})
@@ -4737,7 +5487,15 @@ class AgentUpdateWorker(rpu.Worker):
         cmd = msg['cmd']
         arg = msg['arg']
 
-        if cmd == 'shutdown':
+        if cmd == 'cancel_units':
+            with self._lock:
+                for uid in arg:
+                    if uid in self._final:
+                        self._cancel_done.append(uid)
+                    else:
+                        self._cus_to_cancel.add(uid)
+
+        elif cmd == 'shutdown':
             self._log.info('received shutdown command')
             self.stop()
 
@@ -4747,31 +5505,80 @@ class AgentUpdateWorker(rpu.Worker):
     def _timed_bulk_execute(self, cinfo):
 
         # is there any bulk to look at?
-        if not cinfo['bulk']:
+        n_ops = len(cinfo['units']) + len(cinfo['raw'])
+        if not n_ops:
             return False
 
         now = time.time()
-        age = now - cinfo['last']
 
-        # only push if collection time has been exceeded
-        if not age > self._cfg['bulk_collection_time']:
+        # push if any of the bulk limits is reached
+        if   n_ops >= self._bulk_size                  : reason = 'size'
+        elif now - cinfo['first'] >= self._bulk_time   : reason = 'age'
+        elif now - cinfo['last']  >= self._bulk_idle   : reason = 'idle'
+        else:
             return False
 
-        res = cinfo['bulk'].execute()
+        # on idle pushes, hold back units in transient states, unless they
+        # waited for too long already
+        units = cinfo['units']
+        held  = collections.OrderedDict()
+        if reason == 'idle':
+            for uid, entry in units.items():
+                if  entry['set']['state'] in self.TRANSIENT_STATES \
+                and now - entry['first'] < self._bulk_time:
+                    held[uid] = units.pop(uid)
+
+            n_ops = len(units) + len(cinfo['raw'])
+            if not n_ops:
+                cinfo['units'] = held
+                return False
+
+        # the ops don't depend on each other (one per unit), so the DB is free
+        # to apply them in any order
+        bulk = cinfo['coll'].initialize_unordered_bulk_op()
+
+        for uid, entry in units.iteritems():
+            bulk.find  ({'_id' : uid}) \
+                .update({'$set' : entry['set'],
+                         '$push': {'statehistory': {'$each': entry['history']}}})
+
+        for query_dict, update_dict in cinfo['raw']:
+            bulk.find(query_dict).update(update_dict)
+
+        res = bulk.execute()
+        done = time.time()
         self._log.debug("bulk update result: %s", res)
 
-        self._prof.prof('unit update bulk pushed (%d)' % len(cinfo['uids']), uid=self._pilot_id)
-        for entry in cinfo['uids']:
-            uid   = entry[0]
-            state = entry[1]
-            if state:
-                self._prof.prof('update', msg='unit update pushed (%s)' % state, uid=uid)
-            else:
-                self._prof.prof('update', msg='unit update pushed', uid=uid)
-
-        cinfo['last'] = now
-        cinfo['bulk'] = None
-        cinfo['uids'] = list()
+        # collect metrics
+        wait = now  - cinfo['first']
+        exe  = done - now
+        m    = self._metrics
+        updates = len(cinfo['raw']) \
+                + sum([len(entry['history']) for entry in units.itervalues()])
+
+        m['bulks']   += 1
+        m['updates'] += updates
+        m['ops']     += n_ops
+        m['wait']    += wait
+        m['exec']    += exe
+
+        self._prof.prof('unit update bulk pushed (%d)' % n_ops, uid=self._pilot_id,
+                        msg='%s: updates %d, wait %.3fs, exec %.3fs, held %d' \
+                            % (reason, updates, wait, exe, len(held)))
+
+        if self._prof.enabled:
+            for uid, entry in units.iteritems():
+                for hist in entry['history']:
+                    self._prof.prof('update', msg='unit update pushed (%s)' % hist['state'], uid=uid)
+
+        cinfo['units'] = held
+        cinfo['raw']   = list()
+
+        if held:
+            cinfo['first'] = min([entry['first'] for entry in held.itervalues()])
+        else:
+            cinfo['first'] = None
+            cinfo['last']  = None
 
         return True
 
@@ -4785,7 +5592,14 @@ class AgentUpdateWorker(rpu.Worker):
             for cname in self._cinfo:
                 action += self._timed_bulk_execute(self._cinfo[cname])
 
-        return bool(action)
+            done = self._cancel_done
+            self._cancel_done = list()
+
+        if done:
+            self.publish('command', {'cmd' : 'cancel_done',
+                                     'arg' : done})
+
+        return bool(action or done)
 
 
     # --------------------------------------------------------------------------
@@ -4815,47 +5629,76 @@ class AgentUpdateWorker(rpu.Worker):
             query_dict  = cu.get('query')
             update_dict = cu.get('update')
 
-            if not query_dict:
-                query_dict  = {'_id'  : uid} # make sure unit is not final?
-            if not update_dict:
-                update_dict = {'$set' : {'state': state},
-                               '$push': {'statehistory': {
-                                             'state': state,
-                                             'timestamp': rpu.timestamp()}}}
-
-            # when the unit is about to leave the agent, we also update stdout,
-            # stderr exit code etc
-            # FIXME: this probably should be a parameter ('FULL') on 'msg'
-            if state in [rp.DONE, rp.FAILED, rp.CANCELED, rp.PENDING_OUTPUT_STAGING]:
-                update_dict['$set']['stdout'   ] = cu.get('stdout')
-                update_dict['$set']['stderr'   ] = cu.get('stderr')
-                update_dict['$set']['exit_code'] = cu.get('exit_code')
-
             # check if we handled the collection before.  If not, initialize
             cname = self._session_id + cbase
 
             with self._lock:
                 if not cname in self._cinfo:
                     self._cinfo[cname] = {
-                            'coll' : self._mongo_db[cname],
-                            'bulk' : None,
-                            'last' : time.time(),  # time of last push
-                            'uids' : list()
+                            'coll'    : self._mongo_db[cname],
+                            'units'   : collections.OrderedDict(), # coalesced updates
+                            'raw'     : list(),     # explicit query/update pairs
+                            'first'   : None,       # time of first update in bulk
+                            'last'    : None        # time of last  update in bulk
                             }
 
-
-                # check if we have an active bulk for the collection.  If not,
-                # create one.
                 cinfo = self._cinfo[cname]
+                now   = time.time()
 
-                if not cinfo['bulk']:
-                    cinfo['bulk'] = cinfo['coll'].initialize_ordered_bulk_op()
+                if query_dict or update_dict:
+                    # explicit updates are passed on as they are
+                    if not query_dict:
+                        query_dict  = {'_id'  : uid} # make sure unit is not final?
+                    cinfo['raw'].append([query_dict, update_dict])
 
+                else:
+                    # state updates for the same unit are coalesced into one
+                    # '$set' of the last state, and one '$push' of all state
+                    # history entries
+                    if uid not in cinfo['units']:
+                        cinfo['units'][uid] = {'set'     : dict(),
+                                               'history' : list(),
+                                               'first'   : now}
+                    entry = cinfo['units'][uid]
+
+                    # notifications from different components can overtake
+                    # each other -- the last state is the most recent one
+                    ts = cu.get('state_timestamp') or rpu.timestamp()
+                    if not entry['history'] or ts >= entry['history'][-1]['timestamp']:
+                        entry['set']['state'] = state
+                        entry['history'].append({'state'     : state,
+                                                 'timestamp' : ts})
+                    else:
+                        entry['history'].append({'state'     : state,
+                                                 'timestamp' : ts})
+                        entry['history'].sort(key=lambda x: x['timestamp'])
+
+                    # when the unit is about to leave the agent, we also update stdout,
+                    # stderr exit code etc
+                    # FIXME: this probably should be a parameter ('FULL') on 'msg'
+                    if state in self.FINAL_STATES:
+                        entry['set']['stdout'   ] = cu.get('stdout')
+                        entry['set']['stderr'   ] = cu.get('stderr')
+                        entry['set']['exit_code'] = cu.get('exit_code')
+                        if 'rusage' in cu:
+                            entry['set']['rusage'] = cu['rusage']
+                        if 'io_info' in cu:
+                            entry['set']['io_info'] = cu['io_info']
+                        if 'FTW_Output_Bundle' in cu:
+                            entry['set']['FTW_Output_Bundle'] = cu['FTW_Output_Bundle']
+
+                if state in self.FINAL_STATES:
+                    self._final[uid] = True
+                    if len(self._final) > FINAL_UNITS_MEMORY:
+                        self._final.popitem(last=False)
+                    if uid in self._cus_to_cancel:
+                        self._cus_to_cancel.discard(uid)
+                        self._cancel_done.append(uid)
+
+                cinfo['last'] = now
+                if not cinfo['first']:
+                    cinfo['first'] = now
 
-                # push the update request onto the bulk
-                cinfo['uids'].append([uid, state])
-                cinfo['bulk'].find  (query_dict) \
-                             .update(update_dict)
                 self._prof.prof('bulk', msg='bulked (%s)' % state, uid=uid)
 
                 # attempt a timed update
@@ -4899,7 +5742,7 @@ class AgentStagingInputComponent(rpu.Component):
     def initialize_child(self):
 
         self.declare_input (rp.AGENT_STAGING_INPUT_PENDING, rp.AGENT_STAGING_INPUT_QUEUE)
-        self.declare_worker(rp.AGENT_STAGING_INPUT_PENDING, self.work)
+        self.declare_worker(rp.AGENT_STAGING_INPUT_PENDING, self.work, bulk=True)
 
         self.declare_output(rp.ALLOCATING_PENDING, rp.AGENT_SCHEDULING_QUEUE)
 
@@ -4909,6 +5752,49 @@ class AgentStagingInputComponent(rpu.Component):
         self.declare_publisher ('command', rp.AGENT_COMMAND_PUBSUB)
         self.declare_subscriber('command', rp.AGENT_COMMAND_PUBSUB, self.command_cb)
 
+        # the units of a bulk are staged concurrently, so that a slow metadata
+        # operation on a shared file system does not hold up the other units.
+        # The directives of a unit are performed in order.  Hardlinks for copy
+        # directives are only used if configured, as the unit could then alter
+        # the source file.
+        self._hardlink = self._cfg.get('staging_hardlink', False)
+        self._pool     = multiprocessing.pool.ThreadPool(
+                                         self._cfg.get('staging_threads', 8))
+
+        # directories created in the current bulk
+        self._dirs      = set()
+        self._dirs_lock = threading.Lock()
+
+        # units which got canceled before we saw them
+        self._cus_to_cancel = set()
+        self._cancel_lock   = threading.Lock()
+
+        # units pushed over the client channel are pulled from the database,
+        # too, if the unit manager did not see them arrive in time.  We
+        # remember the recently staged units, to stage them only once.
+        self._staged        = collections.OrderedDict()
+
+        # copy directives flagged with CACHE copy the file into the staging
+        # cache once, and hardlink it into the unit workdirs from there.  The
+        # files are keyed by path, mtime and size, and the least recently used
+        # ones are evicted once the cache exceeds its size.  Files which the
+        # unit manager placed in the cache are linked, but never evicted.
+        self._cache_size  = self._cfg.get('staging_cache_size', 1024 * 1024 * 1024)
+        self._cache_dir   = os.path.join(self._cfg['workdir'], self._cfg['staging_area'], 'cache')
+        self._cache       = collections.OrderedDict()  # key: entry, in LRU order
+        self._cache_used  = 0
+        self._cache_lock  = threading.Lock()
+        self._cache_stats = {'hits'    : 0,
+                             'misses'  : 0,
+                             'saved'   : 0,     # bytes not copied
+                             'evicted' : 0}
+
+        # staging statistics
+        self._metrics  = {'directives' : 0,     # number of directives performed
+                          'time'       : 0.0,   # time spent performing them
+                          'bytes'      : 0,     # bytes copied
+                          'methods'    : collections.defaultdict(int)}
+
         # communicate successful startup
         self.publish('command', {'cmd' : 'alive',
                                  'arg' : self.cname})
@@ -4918,6 +5804,22 @@ class AgentStagingInputComponent(rpu.Component):
     #
     def finalize_child(self):
 
+        self._pool.close()
+        self._pool.join()
+
+        m = self._metrics
+        if m['directives']:
+            self._log.info('staging metrics: %d directives, avg time %.3fs, '
+                           '%d bytes copied, methods: %s',
+                           m['directives'], m['time'] / m['directives'],
+                           m['bytes'], dict(m['methods']))
+
+        c = self._cache_stats
+        if c['hits'] or c['misses']:
+            self._log.info('staging cache: %d hits, %d misses, %d bytes saved, '
+                           '%d evicted', c['hits'], c['misses'], c['saved'],
+                           c['evicted'])
+
         # communicate finalization
         self.publish('command', {'cmd' : 'final',
                                  'arg' : self.cname})
@@ -4930,96 +5832,376 @@ class AgentStagingInputComponent(rpu.Component):
         cmd = msg['cmd']
         arg = msg['arg']
 
-        if cmd == 'shutdown':
+        if cmd == 'cancel_units':
+            with self._cancel_lock:
+                self._cus_to_cancel.update(arg)
+
+        elif cmd == 'cancel_done':
+            with self._cancel_lock:
+                self._cus_to_cancel.difference_update(arg)
+
+        elif cmd == 'shutdown':
             self._log.info('received shutdown command')
             self.stop()
 
 
     # --------------------------------------------------------------------------
     #
-    def work(self, cu):
+    def work(self, units):
 
-        self.advance(cu, rp.AGENT_STAGING_INPUT, publish=True, push=False)
-        self._log.info('handle %s' % cu['_id'])
+        # units which we staged before are dropped
+        dups = [cu['_id'] for cu in units if cu['_id'] in self._staged]
+        if dups:
+            self._log.warn('drop units staged before: %s', dups)
+            units = [cu for cu in units if cu['_id'] not in self._staged]
+            if not units:
+                return
+
+        for cu in units:
+            self._staged[cu['_id']] = True
+        while len(self._staged) > STAGED_UNITS_MEMORY:
+            self._staged.popitem(last=False)
+
+        # units which got canceled while queued are not staged
+        if self._cus_to_cancel:
+            with self._cancel_lock:
+                canceled = [cu for cu in units if cu['_id']     in self._cus_to_cancel]
+                units    = [cu for cu in units if cu['_id'] not in self._cus_to_cancel]
+                self._cus_to_cancel.difference_update([cu['_id'] for cu in canceled])
+
+            if canceled:
+                self._release_bundles(canceled)
+                self.advance(canceled, rp.CANCELED, publish=True, push=False)
+            if not units:
+                return
+
+        self.advance(units, rp.AGENT_STAGING_INPUT, publish=True, push=False)
 
-        workdir      = os.path.join(self._cfg['workdir'], '%s' % cu['_id'])
-        gtod         = os.path.join(self._cfg['workdir'], 'gtod')
         staging_area = os.path.join(self._cfg['workdir'], self._cfg['staging_area'])
-        staging_ok   = True
+        gtod         = os.path.join(self._cfg['workdir'], 'gtod')
+        unit_ops     = list()   # one list of staging ops per unit
+        failed       = dict()
 
-        cu['workdir']     = workdir
-        cu['stdout']      = ''
-        cu['stderr']      = ''
-        cu['opaque_clot'] = None
-        # TODO: See if there is a more central place to put this
-        cu['gtod']        = gtod
+        for cu in units:
 
-        stdout_file       = cu['description'].get('stdout')
-        stdout_file       = stdout_file if stdout_file else 'STDOUT'
-        stderr_file       = cu['description'].get('stderr')
-        stderr_file       = stderr_file if stderr_file else 'STDERR'
+            self._log.info('handle %s' % cu['_id'])
 
-        cu['stdout_file'] = os.path.join(workdir, stdout_file)
-        cu['stderr_file'] = os.path.join(workdir, stderr_file)
+            workdir = os.path.join(self._cfg['workdir'], '%s' % cu['_id'])
 
-        # create unit workdir
-        rec_makedir(workdir)
-        self._prof.prof('unit mkdir', uid=cu['_id'])
+            cu['workdir']     = workdir
+            cu['stdout']      = ''
+            cu['stderr']      = ''
+            cu['opaque_clot'] = None
+            # TODO: See if there is a more central place to put this
+            cu['gtod']        = gtod
 
-        try:
-            for directive in cu['Agent_Input_Directives']:
+            stdout_file       = cu['description'].get('stdout')
+            stdout_file       = stdout_file if stdout_file else 'STDOUT'
+            stderr_file       = cu['description'].get('stderr')
+            stderr_file       = stderr_file if stderr_file else 'STDERR'
 
-                self._prof.prof('Agent input_staging queue', uid=cu['_id'],
-                         msg="%s -> %s" % (str(directive['source']), str(directive['target'])))
+            cu['stdout_file'] = os.path.join(workdir, stdout_file)
+            cu['stderr_file'] = os.path.join(workdir, stderr_file)
 
-                # Perform input staging
-                self._log.info("unit input staging directives %s for cu: %s to %s",
-                               directive, cu['_id'], workdir)
+            # create unit workdir
+            ops = [[cu['_id'], None, None, workdir]]
 
-                # Convert the source_url into a SAGA Url object
-                source_url = rs.Url(directive['source'])
+            try:
+                # files which the unit manager transferred in a bundle archive
+                # (see the InputFileTransferWorker) are extracted from it
+                # first, as they would be in place already without the bundle.
+                # Member names are relative to the pilot sandbox.
+                bundle = cu.get('Agent_Input_Bundle')
+                if bundle:
+                    archive = os.path.join(self._cfg['workdir'], bundle['archive'])
+                    for name, offset, size, mode in bundle['members']:
+                        ops.append([cu['_id'], EXTRACT, [archive, offset, size, mode],
+                                    os.path.join(self._cfg['workdir'], name)])
+
+                for directive in cu['Agent_Input_Directives']:
+
+                    self._prof.prof('Agent input_staging queue', uid=cu['_id'],
+                             msg="%s -> %s" % (str(directive['source']), str(directive['target'])))
+
+                    # Perform input staging
+                    self._log.info("unit input staging directives %s for cu: %s to %s",
+                                   directive, cu['_id'], workdir)
+
+                    # Convert the source_url into a SAGA Url object
+                    source_url = rs.Url(directive['source'])
+
+                    # Handle special 'staging' scheme
+                    if source_url.scheme == self._cfg['staging_scheme']:
+                        self._log.info('Operating from staging')
+                        # Remove the leading slash to get a relative path from the staging area
+                        rel2staging = source_url.path.split('/',1)[1]
+                        source = os.path.join(staging_area, rel2staging)
+                    else:
+                        self._log.info('Operating from absolute path')
+                        source = source_url.path
 
-                # Handle special 'staging' scheme
-                if source_url.scheme == self._cfg['staging_scheme']:
-                    self._log.info('Operating from staging')
-                    # Remove the leading slash to get a relative path from the staging area
-                    rel2staging = source_url.path.split('/',1)[1]
-                    source = os.path.join(staging_area, rel2staging)
-                else:
-                    self._log.info('Operating from absolute path')
-                    source = source_url.path
+                    # Get the target from the directive and convert it to the location
+                    # in the workdir
+                    target = directive['target']
+                    abs_target = os.path.join(workdir, target)
 
-                # Get the target from the directive and convert it to the location
-                # in the workdir
-                target = directive['target']
-                abs_target = os.path.join(workdir, target)
+                    if directive['action'] not in [LINK, COPY, MOVE]:
+                        # FIXME: implement TRANSFER mode
+                        raise NotImplementedError('Action %s not supported' % directive['action'])
 
-                # Create output directory in case it doesn't exist yet
-                rec_makedir(os.path.dirname(abs_target))
+                    action = directive['action']
+                    if action == COPY and self._cache_size and \
+                       CACHE in directive.get('flags', []):
+                        action = CACHED
 
-                self._log.info("Going to '%s' %s to %s", directive['action'], source, abs_target)
+                    ops.append([cu['_id'], action, source, abs_target])
 
-                if   directive['action'] == LINK: os.symlink     (source, abs_target)
-                elif directive['action'] == COPY: shutil.copyfile(source, abs_target)
-                elif directive['action'] == MOVE: shutil.move    (source, abs_target)
-                else:
-                    # FIXME: implement TRANSFER mode
-                    raise NotImplementedError('Action %s not supported' % directive['action'])
+                unit_ops.append(ops)
 
-                log_message = "%s'ed %s to %s - success" % (directive['action'], source, abs_target)
-                self._log.info(log_message)
+            except Exception as e:
+                self._log.exception("staging input failed -> unit failed")
+                failed[cu['_id']] = e
 
-        except Exception as e:
-            self._log.exception("staging input failed -> unit failed")
-            staging_ok = False
+        # stage all units of the bulk concurrently.  Directories are created
+        # once per bulk.
+        self._dirs = set()
+
+        for results in self._pool.imap_unordered(self._stage_unit, unit_ops):
 
+            for uid, action, source, target, method, size, duration, error \
+                    in results:
+
+                if error:
+                    self._log.error("staging input failed -> unit failed: %s", error)
+                    failed[uid] = error
+                    continue
+
+                if not action:
+                    self._prof.prof('unit mkdir', uid=uid)
+                    continue
+
+                self._metrics['directives']      += 1
+                self._metrics['time']            += duration
+                self._metrics['bytes']           += size
+                self._metrics['methods'][method] += 1
+
+                self._prof.prof('staged', uid=uid, msg="%s (%s, %d bytes, %.3fs)"
+                                                      % (action, method, size, duration))
+                self._log.info("%s'ed %s to %s - success", action, source, target)
+
+        self._release_bundles(units)
 
         # Agent input staging is done (or failed)
-        if staging_ok:
-          # self.advance(cu, rp.AGENT_SCHEDULING_PENDING, publish=True, push=True)
-            self.advance(cu, rp.ALLOCATING_PENDING, publish=True, push=True)
+        done = [cu for cu in units if cu['_id'] not in failed]
+        fail = [cu for cu in units if cu['_id'] in     failed]
+
+        if [op for ops in unit_ops for op in ops if op[1] == CACHED]:
+            self._evict()
+            c = self._cache_stats
+            self._prof.prof('staging_cache', msg='hits %d misses %d saved %d evicted %d'
+                            % (c['hits'], c['misses'], c['saved'], c['evicted']))
+
+        if done:
+          # self.advance(done, rp.AGENT_SCHEDULING_PENDING, publish=True, push=True)
+            self.advance(done, rp.ALLOCATING_PENDING, publish=True, push=True)
+        if fail:
+            self.advance(fail, rp.FAILED, publish=True, push=False)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _release_bundles(self, units):
+
+        # a bundle archive is shared by the units the unit manager bundled,
+        # which can arrive in different bulks and component instances.  For
+        # each archive, we append one byte per handled unit to a counter file,
+        # and whoever completes the count removes the archive.
+        counts = dict()   # archive: [handled units, bundled units]
+        for cu in units:
+            bundle = cu.get('Agent_Input_Bundle')
+            if bundle and bundle.get('units'):
+                archive = os.path.join(self._cfg['workdir'], bundle['archive'])
+                counts.setdefault(archive, [0, bundle['units']])[0] += 1
+
+        for archive, (handled, bundled) in counts.iteritems():
+            counter = '%s.count' % archive
+            try:
+                fd = os.open(counter, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0644)
+                try:
+                    os.write(fd, '.' * handled)
+                    complete = os.fstat(fd).st_size >= bundled
+                finally:
+                    os.close(fd)
+
+                if complete:
+                    self._log.info('remove bundle %s', archive)
+                    for path in [archive, counter]:
+                        if os.path.exists(path):
+                            os.unlink(path)
+
+            except OSError as e:
+                # the archive is removed with the pilot sandbox eventually
+                self._log.warn('cannot release bundle %s: %s', archive, e)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _makedir(self, path):
+
+        # create the directory, unless this bulk created it already
+        with self._dirs_lock:
+            if path in self._dirs:
+                return
+
+        rec_makedir(path)
+
+        with self._dirs_lock:
+            while path and path not in self._dirs:
+                self._dirs.add(path)
+                path = os.path.dirname(path)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _cache_copy(self, source, target):
+
+        # copy a file via the staging cache, called in the staging threads.
+        # Returns the method and the number of bytes copied.
+        if source.startswith(self._cache_dir + '/'):
+            # placed by the unit manager
+            cached = source
+            size   = os.path.getsize(source)
+            new    = False
+
         else:
-            self.advance(cu, rp.FAILED, publish=True, push=False)
+            st     = os.stat(source)
+            key    = hashlib.sha1('%s:%s:%d' % (source, st.st_mtime, st.st_size)).hexdigest()
+            cached = os.path.join(self._cache_dir, 'agent', key)
+            size   = st.st_size
+
+            with self._cache_lock:
+                entry = self._cache.pop(key, None)
+                new   = entry is None
+                if new:
+                    entry = {'size'  : size,
+                             'ready' : threading.Event()}
+                    self._cache_used += size
+                self._cache[key] = entry   # most recently used
+
+            if new:
+                # copy into the cache under a temporary name, so that other
+                # components never link a partial file
+                try:
+                    self._makedir(os.path.dirname(cached))
+                    tmp = '%s.%d.%s' % (cached, os.getpid(),
+                                           threading.current_thread().name)
+                    rpu.copy_file(source, tmp)
+                    os.rename(tmp, cached)
+                except Exception:
+                    with self._cache_lock:
+                        if self._cache.pop(key, None):
+                            self._cache_used -= size
+                    raise
+                finally:
+                    entry['ready'].set()
+            else:
+                entry['ready'].wait()
+
+        with self._cache_lock:
+            if new:
+                self._cache_stats['misses'] += 1
+            else:
+                self._cache_stats['hits']   += 1
+                self._cache_stats['saved']  += size
+
+        try:
+            os.link(cached, target)
+        except OSError:
+            # no hardlinks on this file system, or the file was evicted
+            # meanwhile (by another component)
+            return rpu.copy_file(source, target)
+
+        if new: return 'cache_miss', size
+        else  : return 'cache_hit',  0
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _evict(self):
+
+        # evict the least recently used files from the staging cache, until
+        # the cache fits its size.  Units keep their hardlinks.
+        with self._cache_lock:
+            while self._cache_used > self._cache_size and self._cache:
+                key, entry = self._cache.popitem(last=False)
+                self._cache_used -= entry['size']
+                self._cache_stats['evicted'] += 1
+                try:
+                    os.unlink(os.path.join(self._cache_dir, 'agent', key))
+                except OSError:
+                    pass
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _stage_unit(self, ops):
+
+        # perform the staging ops of a unit in order, called in the staging
+        # threads.  Later directives may depend on earlier ones, so we stop
+        # at the first failure.
+        results = list()
+        for op in ops:
+            result = self._stage(op)
+            results.append(result)
+            if result[-1]:
+                break
+
+        return results
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _stage(self, op):
+
+        # perform a single staging op, called in the staging threads.  An op
+        # without action creates a unit workdir.
+
+        uid, action, source, target = op
+
+        method = None
+        size   = 0
+        start  = time.time()
+
+        try:
+            if not action:
+                self._makedir(target)
+
+            else:
+                self._makedir(os.path.dirname(target))
+
+                if action == LINK:
+                    os.symlink(source, target)
+                    method = 'symlink'
+
+                elif action == MOVE:
+                    shutil.move(source, target)
+                    method = 'move'
+
+                elif action == COPY:
+                    method, size = rpu.copy_file(source, target, self._hardlink)
+
+                elif action == EXTRACT:
+                    archive, offset, length, mode = source
+                    method, size = rpu.copy_range(archive, offset, length, target, mode)
+
+                elif action == CACHED:
+                    method, size = self._cache_copy(source, target)
+
+        except Exception as e:
+            return uid, action, source, target, method, size, 0.0, \
+                   "%s %s to %s failed: %s" % (action, source, target, e)
+
+        return uid, action, source, target, method, size, time.time() - start, None
 
 
 # ==============================================================================
@@ -5064,6 +6246,12 @@ class AgentStagingOutputComponent(rpu.Component):
 
         self.declare_publisher('state', rp.AGENT_STATE_PUBSUB)
 
+        # max number of stdout / stderr characters to keep for a unit
+        self._io_loglength = self._cfg.get('max_io_loglength', rpu.MAX_IO_LOGLENGTH)
+
+        # max size of output files which are bundled for the unit manager
+        self._bundle_size  = self._cfg.get('staging_bundle_size', 1024 * 1024)
+
         # all components use the command channel for control messages
         self.declare_publisher ('command', rp.AGENT_COMMAND_PUBSUB)
         self.declare_subscriber('command', rp.AGENT_COMMAND_PUBSUB, self.command_cb)
@@ -5106,23 +6294,25 @@ class AgentStagingOutputComponent(rpu.Component):
         workdir = cu['workdir']
 
         ## parked from unit state checker: unit postprocessing
-        if os.path.isfile(cu['stdout_file']):
-            with open(cu['stdout_file'], 'r') as stdout_f:
-                try:
-                    txt = unicode(stdout_f.read(), "utf-8")
-                except UnicodeDecodeError:
-                    txt = "unit stdout contains binary data -- use file staging directives"
+        # we only read the tail of stdout / stderr, unless the unit asks for
+        # the complete output
+        full          = cu['description'].get('full_output')
+        cu['io_info'] = dict()
 
-                cu['stdout'] += rpu.tail(txt)
+        for io in ['stdout', 'stderr']:
 
-        if os.path.isfile(cu['stderr_file']):
-            with open(cu['stderr_file'], 'r') as stderr_f:
-                try:
-                    txt = unicode(stderr_f.read(), "utf-8")
-                except UnicodeDecodeError:
-                    txt = "unit stderr contains binary data -- use file staging directives"
+            fname = cu['%s_file' % io]
+            if not os.path.isfile(fname):
+                continue
 
-                cu['stderr'] += rpu.tail(txt)
+            try:
+                txt, size, lines = rpu.tail_file(fname, self._io_loglength, full)
+                cu['io_info'][io] = {'size'  : size,
+                                     'lines' : lines}
+            except UnicodeDecodeError:
+                txt = "unit %s contains binary data -- use file staging directives" % io
+
+            cu[io] += txt
 
         if 'RADICAL_PILOT_PROFILE' in os.environ:
             if os.path.isfile("%s/PROF" % cu['workdir']):
@@ -5197,6 +6387,26 @@ class AgentStagingOutputComponent(rpu.Component):
                 log_message = "%s'ed %s to %s - success" %(directive['action'], abs_source, target)
                 self._log.info(log_message)
 
+            # small output files which the unit manager transfers are packed
+            # into one archive, which it transfers in their place (see the
+            # OutputFileTransferWorker)
+            if self._bundle_size:
+                files = list()
+                for directive in cu.get('FTW_Output_Directives') or []:
+                    if BUNDLE not in directive['flags']:
+                        continue
+                    source     = str(directive['source'])
+                    abs_source = os.path.join(workdir, source)
+                    if os.path.isfile(abs_source) and \
+                       os.path.getsize(abs_source) <= self._bundle_size:
+                        files.append([abs_source, source])
+
+                if files:
+                    members = rpu.write_bundle(os.path.join(workdir, OUTPUT_BUNDLE), files)
+                    cu['FTW_Output_Bundle'] = {'archive' : OUTPUT_BUNDLE,
+                                               'members' : members}
+                    self._log.info("bundled %d output files for %s", len(files), cu['_id'])
+
         except Exception as e:
             self._log.exception("staging output failed -> unit failed")
             staging_ok = False
@@ -5313,6 +6523,8 @@ class AgentHeartbeatWorker(rpu.Worker):
         if not retdoc:
             return
 
+        cancel = list()   # uids of units to cancel
+
         for command in retdoc[COMMAND_FIELD]:
 
             cmd = command[COMMAND_TYPE]
@@ -5326,15 +6538,21 @@ class AgentHeartbeatWorker(rpu.Worker):
                                          'arg' : 'cancel'})
 
             elif cmd == COMMAND_CANCEL_COMPUTE_UNIT:
-                self._log.info('cancel unit cmd')
-                self.publish('command', {'cmd' : 'cancel_unit', 
-                                         'arg' : command})
+                # the argument is a unit uid, or a list of uids
+                if isinstance(arg, list): cancel.extend(arg)
+                else                    : cancel.append(arg)
 
             elif cmd == COMMAND_KEEP_ALIVE:
                 self._log.info('keepalive pilot cmd')
                 self.publish('command', {'cmd' : 'heartbeat', 
                                          'arg' : 'keepalive'})
 
+        # all units to cancel are passed on in one message
+        if cancel:
+            self._log.info('cancel unit cmd (%d units)' % len(cancel))
+            self.publish('command', {'cmd' : 'cancel_units',
+                                     'arg' : cancel})
+
 
     # --------------------------------------------------------------------------
     #
@@ -5476,6 +6694,9 @@ class AgentWorker(rpu.Worker):
         self._runtime    = self._cfg['runtime']
         self._sub_cfg    = self._cfg['agent_layout'][self.agent_name]
         self._pull_units = self._sub_cfg.get('pull_units', False)
+        self._claim_units= self._cfg.get('db_claim_units', True)
+        self._claim_limit= self._cfg.get('db_claim_limit', 1024)
+        self._claims     = 0
 
         # this better be on a shared FS!
         self._cfg['workdir'] = os.getcwd()
@@ -5499,6 +6720,10 @@ class AgentWorker(rpu.Worker):
             self._cu = mongo_db["%s.cu" % self._session_id]
             self._log.debug('connected to mongodb')
 
+            # claimed units are found by their claim token
+            if self._pull_units and self._claim_units:
+                self._cu.ensure_index([('claim', 1)], sparse=True)
+
         # first order of business: set the start time and state of the pilot
         # Only the master agent performs this action
         if self.agent_name == 'agent_0':
@@ -5558,7 +6783,7 @@ class AgentWorker(rpu.Worker):
 
         # the pulling agent registers the staging_input_queue as this is what we want to push to
         # FIXME: do a sanity check on the config that only one agent pulls, as
-        #        this is a non-atomic operation at this point
+        #        this is a non-atomic operation unless db_claim_units is set
         self._log.debug('agent will pull units: %s' % bool(self._pull_units))
         if self._pull_units:
 
@@ -5854,20 +7079,43 @@ class AgentWorker(rpu.Worker):
 
         # Check if there are compute units waiting for input staging
         # and log that we pulled it.
-        #
+        if self._claim_units: cu_list = self._claim_units_db()
+        else                : cu_list = self._find_units_db()
+
+        if not cu_list:
+            # no units whatsoever...
+            self._log.info("units pulled:    0")
+            return False
+
+        self._log.info("units pulled: %4d"   % len(cu_list))
+        self._prof.prof('get', msg="bulk size: %d" % len(cu_list), uid=self._pilot_id)
+        for cu in cu_list:
+            self._prof.prof('get', msg="bulk size: %d" % len(cu_list), uid=cu['_id'])
+
+        # now we really own the CUs, and can start working on them (ie. push
+        # them into the pipeline)
+        self.advance(cu_list, publish=True, push=True)
+
+        # indicate that we did some work (if we did...)
+        return True
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _find_units_db(self):
+
         # FIXME: Unfortunately, 'find_and_modify' is not bulkable, so we have
         # to use 'find'.  To avoid finding the same units over and over again,
         # we update the state *before* running the next find -- so we do it
         # right here...  No idea how to avoid that roundtrip...
         # This also blocks us from using multiple ingest threads, or from doing
-        # late binding by unit pull :/
+        # late binding by unit pull :/  See _claim_units_db() for the
+        # alternative.
         cu_cursor = self._cu.find(spec  = {"pilot"   : self._pilot_id,
                                            'state'   : rp.AGENT_STAGING_INPUT_PENDING, 
                                            'control' : 'umgr'})
         if not cu_cursor.count():
-            # no units whatsoever...
-            self._log.info("units pulled:    0")
-            return False
+            return list()
 
         # update the unit states to avoid pulling them again next time.
         cu_list = list(cu_cursor)
@@ -5877,17 +7125,55 @@ class AgentWorker(rpu.Worker):
                         spec     = {"_id"   : {"$in"     : cu_uids}},
                         document = {"$set"  : {"control" : 'agent'}})
 
-        self._log.info("units pulled: %4d"   % len(cu_list))
-        self._prof.prof('get', msg="bulk size: %d" % len(cu_list), uid=self._pilot_id)
-        for cu in cu_list:
-            self._prof.prof('get', msg="bulk size: %d" % len(cu_list), uid=cu['_id'])
+        return cu_list
 
-        # now we really own the CUs, and can start working on them (ie. push
-        # them into the pipeline)
-        self.advance(cu_list, publish=True, push=True)
 
-        # indicate that we did some work (if we did...)
-        return True
+    # --------------------------------------------------------------------------
+    #
+    def _claim_units_db(self):
+
+        # Claim the waiting units with a single multi-update which hands them
+        # over to the agent, and tags them with a token unique to this pull --
+        # then fetch the units carrying that token.  The update evaluates the
+        # 'control' condition per document, so concurrent ingestors (like
+        # several pulling sub-agents) never claim the same unit.  If nothing
+        # was claimed, that is the only roundtrip.
+        #
+        # With a claim limit, we first find the ids of up to that many waiting
+        # units, and only claim those -- so that a large backlog is fed into
+        # the pipeline in bulks, and is left to other ingestors in part.
+        self._claims += 1
+        token = '%s.%s.%d.%d' % (self._pilot_id, self.agent_name,
+                                 os.getpid(), self._claims)
+
+        spec  = {"pilot"   : self._pilot_id,
+                 'state'   : rp.AGENT_STAGING_INPUT_PENDING,
+                 'control' : 'umgr'}
+
+        if self._claim_limit:
+            cu_uids = [cu['_id'] for cu in self._cu.find(spec   = spec,
+                                                         fields = ['_id'],
+                                                         limit  = self._claim_limit)]
+            if not cu_uids:
+                return list()
+
+            spec = {'_id'     : {'$in' : cu_uids},
+                    'control' : 'umgr'}
+
+        ret = self._cu.update(multi    = True,
+                              spec     = spec,
+                              document = {"$set"    : {"control" : 'agent',
+                                                       "claim"   : token}})
+
+        # unacknowledged writes return None -- then we need to look
+        if ret and not ret.get('n'):
+            return list()
+
+        cu_list = list(self._cu.find(spec = {"claim" : token}))
+        for cu in cu_list:
+            del(cu['claim'])
+
+        return cu_list
 
 
 
@@ -6139,6 +7425,18 @@ def bootstrap_3():
             nodeip = LRMS.hostip(cfg.get('network_interface'))
             write_sub_configs(cfg, bridges, nodeip, log)
 
+            # offer the staging input queue and the state pubsub to the unit
+            # managers, so that they can push units to us and get state
+            # notifications without going through mongodb
+            if cfg.get('client_channel'):
+                addrs    = cfg['bridge_addresses']
+                channels = {'units'      : addrs[rp.AGENT_STAGING_INPUT_QUEUE]['sink'],
+                            'state'      : addrs[rp.AGENT_STATE_PUBSUB]['source'],
+                            'serializer' : cfg.get('serializer')}
+                mongo_p.update({"_id": pilot_id},
+                               {"$set": {"channels": channels}})
+                log.info('client channel: %s', channels)
+
             # Store some runtime information into the session
             if 'version_info' in lrms.lm_info:
                 mongo_p.update({"_id": pilot_id},
@@ -21,7 +21,6 @@ from .states             import *
 from .logentry           import *
 from .exceptions         import *
 from .utils              import logger
-from .db.database        import COMMAND_CANCEL_COMPUTE_UNIT
 from .staging_directives import expand_staging_directive
 
 # -----------------------------------------------------------------------------
@@ -55,6 +54,10 @@ class ComputeUnit(object):
         self._description = None
         self._manager = None
 
+        # the description as stored in the database, serialized once (see
+        # Session.get_compute_unit_description() in db/database.py)
+        self._description_doc = None
+
         # handle to the manager's worker
         self._worker = None
 
@@ -459,21 +462,11 @@ class ComputeUnit(object):
         if not isinstance(state, list):
             state = [state]
 
-        start_wait = time.time()
-        # the self.state property pulls the state from the back end.
-        new_state = self.state
-        while new_state not in state:
-            time.sleep(0.1)
-
-            new_state = self.state
-            # logger.debug(
-            #     "Compute unit %s in state %s" % (self._uid, new_state))
-
-            if(None != timeout) and (timeout <= (time.time() - start_wait)):
-                break
+        # the worker wakes us up on matching state transitions
+        self._worker.wait_unit_states([self.uid], state, timeout)
 
         # done waiting -- return the state
-        return new_state
+        return self.state
 
     # -------------------------------------------------------------------------
     #
@@ -489,42 +482,7 @@ class ComputeUnit(object):
         if not self._uid:
             raise BadParameter("Invalid Compute Unit instance.")
 
-        cu_json = self._worker.get_compute_unit_data(self.uid)
-        pilot_uid = cu_json['pilot']
-
-        if self.state in [DONE, FAILED, CANCELED]:
-            # nothing to do
-            logger.debug("Compute unit %s has state %s, can't cancel any longer." % (self._uid, self.state))
-
-        elif self.state in [NEW, UNSCHEDULED, PENDING_INPUT_STAGING]:
-            logger.debug("Compute unit %s has state %s, going to prevent from starting." % (self._uid, self.state))
-            self._manager._session._dbs.set_compute_unit_state(self._uid, CANCELED, ["Received Cancel"])
-
-        elif self.state == STAGING_INPUT:
-            logger.debug("Compute unit %s has state %s, will cancel the transfer." % (self._uid, self.state))
-            self._manager._session._dbs.set_compute_unit_state(self._uid, CANCELED, ["Received Cancel"])
-
-        elif self.state in [PENDING_EXECUTION, SCHEDULING]:
-            logger.debug("Compute unit %s has state %s, will abort start-up." % (self._uid, self.state))
-            self._manager._session._dbs.set_compute_unit_state(self._uid, CANCELED, ["Received Cancel"])
-
-        elif self.state == EXECUTING:
-            logger.debug("Compute unit %s has state %s, will terminate the task." % (self._uid, self.state))
-            self._manager._session._dbs.send_command_to_pilot(cmd=COMMAND_CANCEL_COMPUTE_UNIT, arg=self.uid, pilot_ids=pilot_uid)
-
-        elif self.state == PENDING_OUTPUT_STAGING:
-            logger.debug("Compute unit %s has state %s, will abort the transfer." % (self._uid, self.state))
-            self._manager._session._dbs.set_compute_unit_state(self._uid, CANCELED, ["Received Cancel"])
-
-        elif self.state == STAGING_OUTPUT:
-            logger.debug("Compute unit %s has state %s, will cancel the transfer." % (self._uid, self.state))
-            self._manager._session._dbs.set_compute_unit_state(self._uid, CANCELED, ["Received Cancel"])
-
-        else:
-            raise IncorrectState("Unknown Compute Unit state: %s, cannot cancel" % self.state)
-
-        self._session.prof.prof('advance', msg=CANCELED, uid=unit.uid, state=CANCELED)
-
-        # done canceling
-        return
+        # units in agent side states are canceled by their agent, the
+        # others in the database (see UnitManager.cancel_units())
+        self._worker.cancel_compute_units([self.uid])
 
@@ -30,6 +30,7 @@ CLEANUP                = 'cleanup'
 STDOUT                 = 'stdout'
 STDERR                 = 'stderr'
 RESTARTABLE            = 'restartable'
+FULL_OUTPUT            = 'full_output'
 
 # ------------------------------------------------------------------------------
 #
@@ -77,6 +78,14 @@ class ComputeUnitDescription(attributes.Attributes) :
 
        (`Attribute`) the name of the file to store stderr in.
 
+    .. data:: full_output
+
+       [Type: `bool`] [optional] By default, only the last characters of the
+       unit's stdout and stderr are made available via
+       :data:`radical.pilot.ComputeUnit.stdout` and
+       :data:`radical.pilot.ComputeUnit.stderr`.  If set to True, the complete
+       output is made available.  Use with care for units with large output.
+
     .. data:: input_staging
 
        (`Attribute`) The files that need to be staged before execution (`list` of `staging directives`) [`optional`].
@@ -151,6 +160,7 @@ class ComputeUnitDescription(attributes.Attributes) :
         # I/O
         self._attributes_register(STDOUT,           None, attributes.STRING, attributes.SCALAR, attributes.WRITEABLE)
         self._attributes_register(STDERR,           None, attributes.STRING, attributes.SCALAR, attributes.WRITEABLE)
+        self._attributes_register(FULL_OUTPUT,      None, attributes.BOOL,   attributes.SCALAR, attributes.WRITEABLE)
         self._attributes_register(INPUT_STAGING,    None, attributes.ANY,    attributes.VECTOR, attributes.WRITEABLE)
         self._attributes_register(OUTPUT_STAGING,   None, attributes.ANY,    attributes.VECTOR, attributes.WRITEABLE)
 
@@ -186,6 +196,7 @@ class ComputeUnitDescription(attributes.Attributes) :
         self.set_attribute (MPI,           False)
         self.set_attribute (RESTARTABLE,   False)
         self.set_attribute (CLEANUP,       False)
+        self.set_attribute (FULL_OUTPUT,   False)
 
         # apply initialization dict
         if from_dict:
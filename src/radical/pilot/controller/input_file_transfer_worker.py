@@ -1,30 +1,378 @@
-
 __copyright__ = "Copyright 2013-2015, http://radical.rutgers.edu"
 __license__ = "MIT"
 
 import os
 import time
 import saga
+import Queue
 import thread
+import hashlib
+import tempfile
 import threading
 
-from ..states             import * 
+from ..states             import *
 from ..utils              import logger
 from ..utils              import timestamp
-from ..staging_directives import CREATE_PARENTS
+from ..utils              import write_bundle
+from ..staging_directives import COPY, CREATE_PARENTS, BUNDLE, CACHE
+from ..staging_directives import CACHE_SIZE, STAGING_AREA, STAGING_CACHE
+
+IDLE_TIME    =  1.0  # seconds to sleep after idle cycles
+BULK_SIZE    =   64  # max number of units claimed per database roundtrip
+POOL_SIZE    =    8  # number of concurrent transfers per worker
+METRICS_TIME = 10.0  # seconds between metrics log messages
+
+
+# ----------------------------------------------------------------------------
+#
+class StagingEngine(object):
+    """StagingEngine executes the input transfer directives of many units
+    concurrently, over a bounded pool of threads.  Units are submitted with
+    all their directives, and are reported back by get_done() once all their
+    directives are done, or one of them failed.  Each thread keeps its own
+    cache of saga directory handles (one per target host), so that handles
+    are reused, but never shared between threads.
+    """
+
+    # ------------------------------------------------------------------------
+    #
+    def __init__(self, session=None, size=POOL_SIZE, name='StagingEngine'):
+
+        self._session  = session
+        self._name     = name
+        self._todo     = Queue.Queue()  # [uid, sandbox, directive]
+        self._done     = Queue.Queue()  # [uid, state, error]
+        self._units    = dict()         # uid: {'remaining', 'error'}
+        self._canceled = set()
+        self._lock     = threading.Lock()
+        self._local    = threading.local()
+        self._stop     = threading.Event()
+
+        self._metrics  = {'units'  : 0,
+                          'files'  : 0,
+                          'bytes'  : 0,
+                          'failed' : 0,
+                          'start'  : time.time()}
+
+        self._threads  = list()
+        for n in range(size):
+            t = threading.Thread(target=self._work, name="%s-%d" % (name, n))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+
+    # ------------------------------------------------------------------------
+    #
+    def stop(self):
+        """Stop all threads -- directives which are still queued are dropped.
+        """
+        self._stop.set()
+        for t in self._threads:
+            t.join()
+
+
+    # ------------------------------------------------------------------------
+    #
+    @property
+    def queued(self):
+        """Number of directives waiting for a thread (the queue depth).
+        """
+        return self._todo.qsize()
+
+
+    # ------------------------------------------------------------------------
+    #
+    @property
+    def active(self):
+        """Number of units which are not yet reported back.
+        """
+        with self._lock:
+            return len(self._units)
+
+
+    # ------------------------------------------------------------------------
+    #
+    @property
+    def metrics(self):
+        """Transfer counts and rates since the engine was created.
+        """
+        with self._lock:
+            m = dict(self._metrics)
+
+        elapsed         = max(time.time() - m['start'], 1e-6)
+        m['elapsed']    = elapsed
+        m['files_rate'] = m['files'] / elapsed
+        m['bytes_rate'] = m['bytes'] / elapsed
+        m['queued']     = self.queued
+        m['active']     = self.active
+
+        return m
+
+
+    # ------------------------------------------------------------------------
+    #
+    def submit(self, uid, sandbox, directives):
+        """Queue all directives of a unit.  Units without directives are
+        reported back right away.
+        """
+
+        with self._lock:
+            self._units[uid] = {'remaining' : len(directives),
+                                'error'     : None}
+
+        if not directives:
+            self._finish(uid)
+            return
+
+        for sd in directives:
+            self._todo.put([uid, sandbox, sd])
+
+
+    # ------------------------------------------------------------------------
+    #
+    def cancel(self, uids):
+        """Skip all remaining directives of the given units.  Transfers which
+        already started are completed.
+        """
+
+        with self._lock:
+            for uid in uids:
+                if uid in self._units:
+                    self._canceled.add(uid)
+
+
+    # ------------------------------------------------------------------------
+    #
+    def get_done(self, timeout=None):
+        """Return the [uid, state, error] triples for all units which finished
+        staging, where state is one of AGENT_STAGING_INPUT_PENDING, FAILED and
+        CANCELED.  Wait up to 'timeout' seconds for the first one.
+        """
+
+        done = list()
+        try:
+            if timeout: done.append(self._done.get(timeout=timeout))
+            else      : done.append(self._done.get_nowait())
+            while True:
+                done.append(self._done.get_nowait())
+        except Queue.Empty:
+            pass
+
+        return done
+
+
+    # ------------------------------------------------------------------------
+    #
+    def _finish(self, uid):
+
+        with self._lock:
+            unit = self._units.pop(uid)
+            if   uid in self._canceled: state = CANCELED
+            elif unit['error']        : state = FAILED
+            else                      : state = AGENT_STAGING_INPUT_PENDING
+            self._canceled.discard(uid)
+            self._metrics['units'] += 1
+            if state == FAILED:
+                self._metrics['failed'] += 1
+
+        self._done.put([uid, state, unit['error']])
+
+
+    # ------------------------------------------------------------------------
+    #
+    def _get_dir(self, sandbox):
+
+        # we cache saga directories for performance, to speed up sandbox
+        # creation.
+        if not hasattr(self._local, 'dirs'):
+            self._local.dirs = dict()
+
+        # keyurl and key used for cache
+        keyurl      = saga.Url(sandbox)
+        keyurl.path = '/'
+        key         = str(keyurl)
+
+        if key not in self._local.dirs:
+            logger.debug("saga.fs.Directory ('%s')" % sandbox)
+            self._local.dirs[key] = saga.filesystem.Directory(saga.Url(sandbox),
+                                        flags=saga.filesystem.CREATE_PARENTS,
+                                        session=self._session)
+
+        return self._local.dirs[key]
+
+
+    # ------------------------------------------------------------------------
+    #
+    def _work(self):
+
+        while not self._stop.is_set():
+
+            try:
+                uid, sandbox, sd = self._todo.get(timeout=IDLE_TIME)
+            except Queue.Empty:
+                continue
+
+            with self._lock:
+                skip = uid in self._canceled or self._units[uid]['error']
+
+            size = 0
+            err  = None
+            if not skip:
+                try:
+                    size = self._transfer(sandbox, sd)
+                except Exception as e:
+                    logger.exception("transfer failed for %s" % uid)
+                    err = "copy failed(%s)" % e
+
+            with self._lock:
+                unit = self._units[uid]
+                unit['remaining'] -= 1
+                if err and not unit['error']:
+                    unit['error'] = err
+                if not skip and not err:
+                    self._metrics['files'] += 1
+                    self._metrics['bytes'] += size
+                last = (unit['remaining'] == 0)
+
+            if last:
+                self._finish(uid)
+
+
+    # ------------------------------------------------------------------------
+    #
+    def _transfer(self, sandbox, sd):
+
+        saga_dir = self._get_dir(sandbox)
+
+        abs_src = os.path.abspath(sd['source'])
+        input_file_url = saga.Url("file://localhost%s" % abs_src)
+        if not sd['target']:
+            target = '%s/%s' % (sandbox, os.path.basename(abs_src))
+        else:
+            target = "%s/%s" % (sandbox, sd['target'])
+
+        logger.debug("Transferring input file %s -> %s" % (input_file_url, target))
+
+        # Execute the transfer.
+        if CREATE_PARENTS in sd['flags']:
+            copy_flags = saga.filesystem.CREATE_PARENTS
+        else:
+            copy_flags = 0
+
+        saga_dir.copy(input_file_url, target, flags=copy_flags)
+
+        try:
+            return os.path.getsize(abs_src)
+        except OSError:
+            return 0
+
+
+# ----------------------------------------------------------------------------
+#
+class StagingCache(object):
+    """StagingCache keeps track of the files which the input transfer workers
+    of a unit manager placed in the staging caches of its pilots.  Files are
+    keyed by their local path, mtime and size.  Each distinct file is
+    transferred once per pilot, and units get it from the staging cache via
+    an agent side copy directive.  The cache is shared by all workers of the
+    unit manager -- a unit may wait for a file which another worker is still
+    transferring.  At most 'size' bytes are cached per pilot, further files
+    are transferred per unit.
+    """
+
+    # ------------------------------------------------------------------------
+    #
+    def __init__(self, size=CACHE_SIZE):
+
+        self._size    = size
+        self._lock    = threading.Lock()
+        self._files   = dict()   # (pilot sandbox, key): transfer
+        self._used    = dict()   # pilot sandbox: bytes
+        self._count   = 0
+        self._metrics = {'hits'   : 0,
+                         'misses' : 0,
+                         'saved'  : 0}   # bytes not transferred
+
+
+    # ------------------------------------------------------------------------
+    #
+    @property
+    def metrics(self):
+        """Cache hits, misses and saved bytes since the cache was created.
+        """
+        with self._lock:
+            return dict(self._metrics)
+
+
+    # ------------------------------------------------------------------------
+    #
+    def lookup(self, pilot_sandbox, source):
+        """Return the transfer which places the local file 'source' in the
+        staging cache of the pilot, and whether the transfer is new, ie.
+        whether the caller needs to perform it.  Returns [None, False] if the
+        pilot's cache is full.
+        """
+
+        st  = os.stat(source)
+        key = hashlib.sha1("%s:%s:%d" % (source, st.st_mtime, st.st_size)).hexdigest()
+
+        with self._lock:
+
+            transfer = self._files.get((pilot_sandbox, key))
+
+            # a failed transfer is tried again
+            if transfer and transfer['state'] not in [None, AGENT_STAGING_INPUT_PENDING]:
+                self._used[pilot_sandbox] -= transfer['size']
+                transfer = None
+
+            if transfer:
+                self._metrics['hits']  += 1
+                self._metrics['saved'] += st.st_size
+                return transfer, False
+
+            used = self._used.get(pilot_sandbox, 0)
+            if used + st.st_size > self._size:
+                return None, False
+
+            self._count += 1
+            transfer = {'uid'       : 'cache.%06d' % self._count,
+                        'name'      : '%s/umgr/%s' % (STAGING_CACHE, key),
+                        'size'      : st.st_size,
+                        'sandbox'   : pilot_sandbox,
+                        'directive' : {'source' : source,
+                                       'target' : '%s/%s/umgr/%s' % (STAGING_AREA,
+                                                                     STAGING_CACHE, key),
+                                       'flags'  : [CREATE_PARENTS]},
+                        'state'     : None,
+                        'error'     : None}
+
+            self._files[(pilot_sandbox, key)] = transfer
+            self._used[pilot_sandbox]         = used + st.st_size
+            self._metrics['misses']          += 1
+
+        return transfer, True
 
-IDLE_TIME  = 1.0  # seconds to sleep after idle cycles
 
 # ----------------------------------------------------------------------------
 #
 class InputFileTransferWorker(threading.Thread):
     """InputFileTransferWorker handles the staging of input files
-    for a UnitManagerController.
+    for a UnitManagerController.  It claims units in bulks, and hands their
+    transfer directives to a StagingEngine, which transfers files of many
+    units concurrently.  Finished units are pushed to the agent in bulks, too.
+
+    Some transfers are shared by several units: files of directives flagged
+    with CACHE are transferred once per pilot into its staging cache (see
+    StagingCache), and files of directives flagged with BUNDLE are packed into
+    one archive per bulk and pilot sandbox.  The agent copies or extracts them
+    into the unit sandboxes.  Units are only pushed once their shared
+    transfers are done.
     """
 
     # ------------------------------------------------------------------------
     #
-    def __init__(self, session, unit_manager_id, number=None):
+    def __init__(self, session, unit_manager_id, number=None, cache=None):
 
         self._session = session
 
@@ -37,9 +385,16 @@ class InputFileTransferWorker(threading.Thread):
         self._worker_number = number
         self.name = "InputFileTransferWorker-%s" % str(self._worker_number)
 
-        # we cache saga directories for performance, to speed up sandbox
-        # creation.
-        self._saga_dirs = dict()
+        # claimed units are tagged with a unique token, so that concurrent
+        # workers never claim the same unit
+        self._claims = 0
+
+        # the staging cache is shared by the workers of a unit manager
+        self._cache = cache if cache else StagingCache()
+
+        # shared transfers in flight, and the units which wait for them
+        self._shared = dict()   # transfer id: transfer
+        self._held   = dict()   # uid: hold (see _hold())
 
         # Stop event can be set to terminate the main loop
         self._stop = threading.Event()
@@ -57,12 +412,305 @@ class InputFileTransferWorker(threading.Thread):
         logger.debug("itransfer %s stopped" % (self.name))
 
 
+    # ------------------------------------------------------------------------
+    #
+    def _claim(self, um_col, size):
+        """Move up to 'size' units from PENDING_INPUT_STAGING to STAGING_INPUT,
+        and return their documents.
+        """
+
+        docs = um_col.find({"unitmanager": self.unit_manager_id,
+                            "state"      : PENDING_INPUT_STAGING},
+                           fields=["_id"], limit=size)
+        uids = [doc["_id"] for doc in docs]
+        if not uids:
+            return list()
+
+        self._claims += 1
+        token = "%s.%s.%d.%d" % (self.unit_manager_id, self.name,
+                                 os.getpid(), self._claims)
+        ts    = timestamp()
+
+        um_col.update({"_id"  : {"$in": uids},
+                       "state": PENDING_INPUT_STAGING},
+                      {"$set" : {"state": STAGING_INPUT, "claim": token},
+                       "$push": {"statehistory": {"state": STAGING_INPUT, "timestamp": ts}}},
+                      multi=True)
+
+        return list(um_col.find({"claim": token}))
+
+
+    # ------------------------------------------------------------------------
+    #
+    def _hold(self, uid):
+        """Return the hold of a unit (create as needed), which keeps the unit
+        back until the shared transfers it depends on are done, and collects
+        the fields the unit gets from them.
+        """
+
+        if uid not in self._held:
+            self._held[uid] = {'deps'       : list(),  # shared transfers
+                               'done'       : None,    # [state, error] of the unit
+                               'bundle'     : None,    # 'Agent_Input_Bundle'
+                               'directives' : list()}  # 'Agent_Input_Directives'
+        return self._held[uid]
+
+
+    # ------------------------------------------------------------------------
+    #
+    def _cache_files(self, units):
+        """Replace the cached directives of the given units with agent side
+        copies from the staging cache of their pilot.  Returns the transfers
+        of the files which are new in the cache.
+        """
+
+        transfers = list()
+        for cu in units:
+
+            directives = cu.get("FTW_Input_Directives") or []
+            cached     = [sd for sd in directives
+                             if CACHE in sd['flags']
+                             and os.path.isfile(sd['source'])]
+            if not cached or not cu.get("pilot_sandbox"):
+                continue
+
+            uid = str(cu["_id"])
+            for sd in cached:
+
+                source = os.path.abspath(sd['source'])
+                transfer, new = self._cache.lookup(cu["pilot_sandbox"], source)
+                if not transfer:
+                    continue   # the cache is full
+
+                if new:
+                    transfers.append(transfer)
+                else:
+                    self._session.prof.prof('staging_cache', uid=uid,
+                            msg="hit %s (%d bytes)" % (source, transfer['size']))
+
+                directives.remove(sd)
+                hold = self._hold(uid)
+                hold['deps'].append(transfer)
+                hold['directives'].append({
+                    'action'   : COPY,
+                    'source'   : 'staging:///%s' % transfer['name'],
+                    'target'   : sd['target'] or os.path.basename(source),
+                    'flags'    : [CACHE],
+                    'priority' : sd.get('priority', 0),
+                    'state'    : PENDING})
+
+        return transfers
+
+
+    # ------------------------------------------------------------------------
+    #
+    def _bundle(self, units):
+        """Pack the files of the bundled directives of the given units into one
+        archive per pilot sandbox, and remove those directives from the units.
+        Returns the transfers of the new bundles.  Units with a sandbox outside
+        of their pilot sandbox keep their directives.
+        """
+
+        groups = dict()   # pilot sandbox: [[cu, directives, prefix], ...]
+        for cu in units:
+
+            directives = cu.get("FTW_Input_Directives") or []
+            bundled    = [sd for sd in directives
+                             if BUNDLE in sd['flags']
+                             and os.path.isfile(sd['source'])]
+            if not bundled or not cu.get("pilot_sandbox"):
+                continue
+
+            pilot_path = saga.Url(cu["pilot_sandbox"]).path.rstrip('/')
+            unit_path  = saga.Url(cu["sandbox"]).path.rstrip('/')
+            if not unit_path.startswith(pilot_path + '/'):
+                continue
+
+            cu["FTW_Input_Directives"] = [sd for sd in directives
+                                             if sd not in bundled]
+            groups.setdefault(cu["pilot_sandbox"], list()).append(
+                    [cu, bundled, unit_path[len(pilot_path) + 1:]])
+
+        bundles = list()
+        for pilot_sandbox, entries in groups.iteritems():
+
+            bid   = "bundle.%s.%d" % (entries[0][0]["claim"], len(bundles))
+            path  = os.path.join(tempfile.gettempdir(), "%s.tar" % bid)
+            files = list()
+            for cu, bundled, prefix in entries:
+                for sd in bundled:
+                    target = sd['target'] or os.path.basename(sd['source'])
+                    files.append([sd['source'], "%s/%s" % (prefix, target)])
+
+            try:
+                index = write_bundle(path, files)
+            except Exception as e:
+                # transfer the files one by one after all
+                logger.exception("bundling failed for %s" % bid)
+                if os.path.exists(path):
+                    os.unlink(path)
+                for cu, bundled, prefix in entries:
+                    cu["FTW_Input_Directives"].extend(bundled)
+                continue
+
+            bundle = {'uid'       : bid,
+                      'path'      : path,
+                      'sandbox'   : pilot_sandbox,
+                      'directive' : {'source' : path,
+                                     'target' : os.path.basename(path),
+                                     'flags'  : [CREATE_PARENTS]},
+                      'state'     : None,
+                      'error'     : None}
+
+            for cu, bundled, prefix in entries:
+                hold = self._hold(str(cu["_id"]))
+                hold['deps'].append(bundle)
+                hold['bundle'] = {'archive' : os.path.basename(path),
+                                  'members' : index[:len(bundled)],
+                                  'units'   : len(entries)}
+                index = index[len(bundled):]
+
+            logger.debug("%s: %d files of %d units" % (bid, len(files), len(entries)))
+            bundles.append(bundle)
+
+        return bundles
+
+
+    # ------------------------------------------------------------------------
+    #
+    def _collect(self, done):
+        """Sort the units reported back by the engine: units which wait for
+        shared transfers are held back until those are done, and fail if one
+        of them failed.  Returns the [uid, state, error] triples of the units
+        which can be pushed, and the holds of those which were held back.
+        """
+
+        ready = list()
+        holds = dict()
+
+        for uid, state, error in done:
+
+            if uid in self._shared:
+                transfer = self._shared.pop(uid)
+                transfer['error'] = error
+                transfer['state'] = state
+                if 'path' in transfer and os.path.exists(transfer['path']):
+                    os.unlink(transfer['path'])
+
+            elif uid in self._held:
+                self._held[uid]['done'] = [state, error]
+
+            else:
+                ready.append([uid, state, error])
+
+        # the transfers a unit waits for may also be performed by other
+        # workers (cache files), so we check all held units
+        for uid, hold in self._held.items():
+
+            if not hold['done'] or None in [t['state'] for t in hold['deps']]:
+                continue
+
+            del(self._held[uid])
+
+            state, error = hold['done']
+            failed = [t for t in hold['deps'] if t['state'] != AGENT_STAGING_INPUT_PENDING]
+            if state == AGENT_STAGING_INPUT_PENDING:
+                if failed:
+                    state = FAILED
+                    error = "transfer %s failed (%s)" % (failed[0]['uid'], failed[0]['error'])
+                else:
+                    holds[uid] = hold
+            ready.append([uid, state, error])
+
+        return ready, holds
+
+
+    # ------------------------------------------------------------------------
+    #
+    def _push(self, um_col, done, holds=None):
+        """Push the states of finished units to the database, in one bulk.
+        Units which got files from shared transfers also get the agent side
+        fields collected in their 'holds'.
+        """
+
+        ts   = timestamp()
+        bulk = um_col.initialize_unordered_bulk_op()
+        ops  = 0
+
+        for uid, state, error in done:
+
+            self._session.prof.prof('advance', uid=uid, msg=state, state=state)
+
+            if state == CANCELED:
+                logger.info("Compute Unit %s Canceled, interrupted input file transfers." % uid)
+                continue
+
+            if state == FAILED:
+                logentry = {'message': "Input transfer failed: %s" % error,
+                            'timestamp': ts}
+                bulk.find({'_id': uid}) \
+                    .update({'$set': {'state': FAILED},
+                             '$push': {
+                                 'statehistory': {'state': FAILED, 'timestamp': ts},
+                                 'log': logentry
+                             }})
+                logger.error(str(logentry))
+
+            else:
+                # All IFTW staging done for this CU.  Push it out, by
+                # setting the state as 'AGENT_ATGING_INPUT_PENDING and
+                # sending it to mongodb.  We mark the CU under 'umgr'
+                # control -- once the agent picks it up, it will be
+                # marked as under 'agent' control, before the
+                # agent_stging_output_component passes control back in
+                # a similar manner.
+                update = {'$set': {'state'  : AGENT_STAGING_INPUT_PENDING,
+                                   'control': 'umgr'},
+                          '$push': {
+                              'statehistory': {
+                                  'state': AGENT_STAGING_INPUT_PENDING,
+                                  'timestamp': ts},
+                              'log': {
+                                  'timestamp': ts,
+                                  'message': 'push unit to agent after ftw staging'
+                          }}}
+                hold = holds.get(uid) if holds else None
+                if hold and hold['bundle']:
+                    update['$set']['Agent_Input_Bundle'] = hold['bundle']
+                if hold and hold['directives']:
+                    update['$push']['Agent_Input_Directives'] = {'$each': hold['directives']}
+                bulk.find({'_id': uid}).update(update)
+                logger.debug("InputStagingController: %s : push to agent" % uid)
+            ops += 1
+
+        if ops:
+            bulk.execute()
+
+
+    # ------------------------------------------------------------------------
+    #
+    def _log_metrics(self, engine):
+
+        m = engine.metrics
+        logger.info("%s: %d units (%d failed), %d files, %.1f files/s, "
+                    "%.1f kB/s, queue depth %d, active units %d"
+                    % (self.name, m['units'], m['failed'], m['files'],
+                       m['files_rate'], m['bytes_rate'] / 1024,
+                       m['queued'], m['active']))
+
+        c = self._cache.metrics
+        logger.info("%s: staging cache %d hits, %d misses, %d bytes saved"
+                    % (self.name, c['hits'], c['misses'], c['saved']))
+
+
     # ------------------------------------------------------------------------
     #
     def run(self):
         """Starts the process when Process.start() is called.
         """
 
+        engine = None
+
         # make sure to catch sys.exit (which raises SystemExit)
         try :
 
@@ -78,162 +726,72 @@ class InputFileTransferWorker(threading.Thread):
                 logger.exception("Connection error: %s" % e)
                 raise
 
+            engine       = StagingEngine(self._session, POOL_SIZE, self.name)
+            active       = set()   # uids of units handed to the engine
+            last_cancel  = 0.0
+            last_metrics = time.time()
+
             while not self._stop.is_set() and \
                   not self._session._terminate.is_set():
 
-                # See if we can find a ComputeUnit that is waiting for
-                # input file transfer.
-                ts = timestamp()
-                compute_unit = um_col.find_and_modify(
-                    query={"unitmanager": self.unit_manager_id,
-                           "state"      : PENDING_INPUT_STAGING,
-                           },
-                    update={"$set" : {"state": STAGING_INPUT},
-                            "$push": {"statehistory": {"state": STAGING_INPUT, "timestamp": ts}}}
-                )
-
-                if compute_unit is None:
-                    # Sleep a bit if no new units are available.
-                    time.sleep(IDLE_TIME)
-
-                else:
-                    compute_unit_id = None
-                    state = STAGING_INPUT
-
-                    try:
-                        log_messages = []
-
-                        # We have found a new CU. Now we can process the transfer
-                        # directive(s) wit SAGA.
-                        compute_unit_id = str(compute_unit["_id"])
-
-                        logger.debug ("InputStagingController: unit found: %s" % compute_unit_id)
-                        self._session.prof.prof('advance', uid=compute_unit_id,
-                                msg=state, state=state)
-
-                        remote_sandbox = compute_unit["sandbox"]
-                        input_staging = compute_unit.get("FTW_Input_Directives", [])
-
-
-                        # if we do staging, create the CU's directory in case it doesn't exist yet.
-                        if input_staging:
-                            log_msg = "InputStagingController: Creating ComputeUnit sandbox directory %s." % remote_sandbox
-                            log_messages.append(log_msg)
-                            logger.info(log_msg)
-
-                            # Creating/initialising the sandbox directory.
-                            try:
-                                logger.debug ("saga.fs.Directory ('%s')" % remote_sandbox)
-
-                                # url used for saga
-                                remote_sandbox_url = saga.Url(remote_sandbox)
-
-                                # keyurl and key used for cache
-                                remote_sandbox_keyurl = saga.Url(remote_sandbox)
-                                remote_sandbox_keyurl.path = '/'
-                                remote_sandbox_key = str(remote_sandbox_keyurl)
-
-                                if  remote_sandbox_key not in self._saga_dirs :
-                                    self._saga_dirs[remote_sandbox_key] = \
-                                            saga.filesystem.Directory(remote_sandbox_url,
-                                                    flags=saga.filesystem.CREATE_PARENTS,
-                                                    session=self._session)
-
-                                saga_dir = self._saga_dirs[remote_sandbox_key]
-                            except Exception as e :
-                                logger.exception('Error: %s' % e)
-                                raise
-
-                            logger.info("InputStagingController: Processing input file transfers for ComputeUnit %s" % compute_unit_id)
-
-
-                        # Loop over all transfer directives and execute them.
-                        for sd in input_staging:
-
-                            logger.debug("InputStagingController: sd: %s : %s" % (compute_unit_id, sd))
-
-                            # Check if there was a cancel request
-                            state_doc = um_col.find_one(
-                                {"_id": compute_unit_id},
-                                fields=["state"]
-                            )
-                            if state_doc['state'] == CANCELED:
-                                self._session.prof.prof('advance', uid=compute_unit_id, 
-                                        msg=CANCELED, state=CANCELED)
-                                logger.info("Compute Unit Canceled, interrupting input file transfers.")
-                                state = CANCELED
-                                # Break out of the loop for this CU's SD's
-                                break
-
-                            abs_src = os.path.abspath(sd['source'])
-                            input_file_url = saga.Url("file://localhost%s" % abs_src)
-                            if not sd['target']:
-                                target = '%s/%s' % (remote_sandbox, os.path.basename(abs_src))
-                            else:
-                                target = "%s/%s" % (remote_sandbox, sd['target'])
-
-                            log_msg = "Transferring input file %s -> %s" % (input_file_url, target)
-                            log_messages.append(log_msg)
-                            logger.debug(log_msg)
-
-                            # Execute the transfer.
-                            if CREATE_PARENTS in sd['flags']:
-                                copy_flags = saga.filesystem.CREATE_PARENTS
-                            else:
-                                copy_flags = 0
-
-                            try:
-                                saga_dir.copy(input_file_url, target, flags=copy_flags)
-                            except Exception as e:
-                                logger.exception(e)
-                                raise Exception("copy failed(%s)" % e.message)
-
-                        # If this CU was canceled we can skip the remainder of this loop,
-                        # to process more CUs.
-                        if state == CANCELED:
-                            continue
-
-                        # All IFTW staging done for this CU.  Push it out, by
-                        # setting the state as 'AGENT_ATGING_INPUT_PENDING and
-                        # sending it to mongodb.  We mark the CU under 'umgr'
-                        # control -- once the agent picks it up, it will be
-                        # marked as under 'agent' control, before the
-                        # agent_stging_output_component passes control back in
-                        # a similar manner.
-                        um_col.update({'_id': compute_unit_id},
-                                      {'$set': {'state'  : AGENT_STAGING_INPUT_PENDING, 
-                                                'control': 'umgr'},
-                                       '$push': {
-                                           'statehistory': {
-                                               'state': AGENT_STAGING_INPUT_PENDING,
-                                               'timestamp': ts},
-                                           'log': {
-                                               'timestamp': timestamp(),
-                                               'message': 'push unit to agent after ftw staging'
-                                       }}})
-                        logger.debug("InputStagingController: %s : push to agent" % compute_unit_id)
-                        self._session.prof.prof('advance', uid=compute_unit_id, 
-                                msg=AGENT_STAGING_INPUT_PENDING, state=AGENT_STAGING_INPUT_PENDING)
-
-                    except Exception as e :
-
-                        # Update the CU's state to 'FAILED'.
-                        ts = timestamp()
-                        logentry = {'message': "Input transfer failed: %s" % e,
-                                    'timestamp': ts}
-
-                        um_col.update({'_id': compute_unit_id},
-                                      {'$set': {'state': FAILED},
-                                       '$push': {
-                                           'statehistory': {'state': FAILED, 'timestamp': ts},
-                                           'log': logentry
-                                       }})
-                        self._session.prof.prof('advance', uid=compute_unit_id, 
-                                msg=FAILED, state=FAILED)
-
-                        logger.exception(str(logentry))
-                        raise
+                # claim a new bulk of units once the engine runs low on
+                # directives, so that transfers and claims overlap
+                units = list()
+                if engine.queued < POOL_SIZE:
+                    units = self._claim(um_col, BULK_SIZE)
+
+                # shared transfers (cache files and bundles) are performed
+                # like units, before the units which wait for them
+                for transfer in self._cache_files(units) + self._bundle(units):
+                    self._shared[transfer['uid']] = transfer
+                    engine.submit(transfer['uid'], transfer['sandbox'],
+                                  [transfer['directive']])
+
+                for cu in units:
+
+                    compute_unit_id = str(cu["_id"])
+                    logger.debug ("InputStagingController: unit found: %s" % compute_unit_id)
+                    self._session.prof.prof('advance', uid=compute_unit_id,
+                            msg=STAGING_INPUT, state=STAGING_INPUT)
+
+                    active.add(compute_unit_id)
+                    engine.submit(compute_unit_id, cu["sandbox"],
+                                  cu.get("FTW_Input_Directives") or [])
+
+                # Check if there was a cancel request -- once per bulk, and
+                # not more often than once per IDLE_TIME
+                now = time.time()
+                if active and (units or now - last_cancel > IDLE_TIME):
+                    docs = um_col.find({"_id"  : {"$in": list(active)},
+                                        "state": CANCELED},
+                                       fields=["_id"])
+                    engine.cancel([doc["_id"] for doc in docs])
+                    last_cancel = now
+
+                # collect finished units, and push them out.  Sleep a bit if
+                # no new units are available.
+                if units: done = engine.get_done()
+                else    : done = engine.get_done(timeout=IDLE_TIME)
+
+                active.difference_update([uid for uid, _, _ in done])
+                done, holds = self._collect(done)
+                if done:
+                    self._push(um_col, done, holds)
+
+                if now - last_metrics > METRICS_TIME:
+                    self._log_metrics(engine)
+                    last_metrics = now
 
         except SystemExit as e :
             logger.debug("input file transfer thread caught system exit -- forcing application shutdown")
             thread.interrupt_main ()
+
+        finally:
+            if engine:
+                engine.stop()
+                self._log_metrics(engine)
+
+            for transfer in self._shared.values():
+                if 'path' in transfer and os.path.exists(transfer['path']):
+                    os.unlink(transfer['path'])
+
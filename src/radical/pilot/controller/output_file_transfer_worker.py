@@ -6,11 +6,13 @@ import os
 import time
 import saga
 import thread
+import tempfile
 import threading
 
 from ..states import * 
 from ..utils  import logger
 from ..utils  import timestamp
+from ..utils  import copy_range
 from ..staging_directives import CREATE_PARENTS
 
 IDLE_TIME  = 1.0  # seconds to sleep after idle cycles
@@ -98,6 +100,7 @@ class OutputFileTransferWorker(threading.Thread):
                     logger.info("OFTW CU found, progressing ...")
                     state = STAGING_OUTPUT
                     compute_unit_id = None
+                    archive = None
                     try:
                         log_messages = []
 
@@ -113,6 +116,23 @@ class OutputFileTransferWorker(threading.Thread):
                         output_staging = compute_unit.get("FTW_Output_Directives", [])
 
                         logger.info("OutputStagingController: Processing output file transfers for ComputeUnit %s" % compute_unit_id)
+
+                        # Small files were packed into a bundle by the agent.
+                        # We transfer the bundle once, and extract the files
+                        # from it.
+                        bundle  = compute_unit.get("FTW_Output_Bundle")
+                        members = dict()
+                        if bundle:
+                            archive = os.path.join(tempfile.gettempdir(), "%s.%s"
+                                                   % (compute_unit_id, bundle['archive']))
+                            bundle_file = saga.filesystem.File(
+                                    saga.Url("%s/%s" % (remote_sandbox, bundle['archive'])),
+                                    session=self._session)
+                            bundle_file.copy(saga.Url("file://localhost%s" % archive))
+                            bundle_file.close()
+                            for name, offset, size, mode in bundle['members']:
+                                members[name] = [offset, size, mode]
+
                         # Loop over all staging directives and execute them.
                         for sd in output_staging:
 
@@ -139,6 +159,18 @@ class OutputFileTransferWorker(threading.Thread):
                             else:
                                 abs_target = "file://localhost%s" % os.path.abspath(sd['target'])
 
+                            if sd['source'] in members:
+                                target_path = saga.Url(abs_target).path
+                                log_msg = "Extracting output file %s -> %s" % (sd['source'], target_path)
+                                log_messages.append(log_msg)
+                                logger.debug(log_msg)
+                                if CREATE_PARENTS in sd['flags'] and \
+                                   not os.path.isdir(os.path.dirname(target_path)):
+                                    os.makedirs(os.path.dirname(target_path))
+                                offset, size, mode = members[sd['source']]
+                                copy_range(archive, offset, size, target_path, mode)
+                                continue
+
                             log_msg = "Transferring output file %s -> %s" % (abs_src, abs_target)
                             log_messages.append(log_msg)
                             logger.debug(log_msg)
@@ -191,6 +223,10 @@ class OutputFileTransferWorker(threading.Thread):
                                 msg=FAILED, state=FAILED)
                         raise
 
+                    finally:
+                        if archive and os.path.exists(archive):
+                            os.unlink(archive)
+
         except SystemExit as e :
             logger.exception("output file transfer thread caught system exit -- forcing application shutdown")
             thread.interrupt_main()
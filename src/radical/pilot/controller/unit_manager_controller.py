@@ -7,6 +7,7 @@ __copyright__ = "Copyright 2013-2014, http://radical.rutgers.edu"
 __license__ = "MIT"
 
 import os
+import re
 import time
 import Queue
 import weakref
@@ -16,17 +17,64 @@ from multiprocessing import Pool
 
 import radical.utils as ru
 
+from ..                   import utils as rpu
 from ..types              import *
 from ..states             import *
+from ..constants          import AGENT_STAGING_INPUT_QUEUE, AGENT_STATE_PUBSUB
 from ..utils              import logger
 from ..utils              import timestamp
-from ..staging_directives import TRANSFER, LINK, COPY, MOVE
+from ..db.database        import COMMAND_CANCEL_COMPUTE_UNIT
+from ..staging_directives import TRANSFER, LINK, COPY, MOVE, BUNDLE, BUNDLE_SIZE
 
-from .input_file_transfer_worker  import InputFileTransferWorker
+from .input_file_transfer_worker  import InputFileTransferWorker, StagingCache
 from .output_file_transfer_worker import OutputFileTransferWorker
 
 
-IDLE_TIME = 1.0  # seconds to sleep between activities
+IDLE_TIME      =  1.0  # seconds to sleep between activities
+STATE_FEED_LAG = 10.0  # overlap of state delta queries, to cover clock skew
+FULL_SYNC_TIME = 60.0  # seconds between full state resyncs
+
+# The state delta queries compare the statehistory timestamps of the units,
+# which are taken on the hosts which advance the units (agent, transfer
+# workers), against the local clock.  They assume that those clocks are at most
+# STATE_FEED_LAG seconds behind ours.  State changes from hosts with a larger
+# skew are not lost, but are only picked up by the next full resync, ie. with
+# up to FULL_SYNC_TIME seconds delay.
+PUSH_TIMEOUT   = 60.0  # seconds until unacknowledged pushed units are pulled
+
+# unit states in the order they are passed -- used to discard database states
+# which arrive after the agent already pushed a later state
+UNIT_STATE_ORDER = [NEW, SCHEDULING, UNSCHEDULED,
+                    PENDING_INPUT_STAGING, STAGING_INPUT,
+                    AGENT_STAGING_INPUT_PENDING, AGENT_STAGING_INPUT,
+                    ALLOCATING_PENDING, ALLOCATING,
+                    EXECUTING_PENDING, EXECUTING,
+                    AGENT_STAGING_OUTPUT_PENDING, AGENT_STAGING_OUTPUT,
+                    PENDING_OUTPUT_STAGING, STAGING_OUTPUT]
+UNIT_STATE_RANK  = dict([[state, rank] for rank, state in enumerate(UNIT_STATE_ORDER)])
+UNIT_STATE_RANK.update(dict([[state, len(UNIT_STATE_ORDER)]
+                             for state in [DONE, FAILED, CANCELED]]))
+PUSH_ACK_RANK    = UNIT_STATE_RANK[AGENT_STAGING_INPUT_PENDING]
+
+# units in these states are canceled in the database -- units in all other
+# (non-final) states are canceled by their agent
+UMGR_CANCEL_STATES = [NEW, UNSCHEDULED, SCHEDULING, PENDING_EXECUTION,
+                      PENDING_INPUT_STAGING, STAGING_INPUT,
+                      PENDING_OUTPUT_STAGING, STAGING_OUTPUT]
+CANCEL_BULK_SIZE   = 100000  # max number of units per cancel command
+
+# the scheme of a staging URL -- cheaper than parsing every URL with ru.Url
+URL_SCHEME = re.compile(r'^([a-zA-Z][a-zA-Z0-9+.-]*):')
+
+
+# ----------------------------------------------------------------------------
+#
+def _url_scheme(url):
+
+    match = URL_SCHEME.match(url)
+    if match:
+        return match.group(1).lower()
+    return ''
 
 # ----------------------------------------------------------------------------
 #
@@ -68,6 +116,46 @@ class UnitManagerController(threading.Thread):
         self._shared_data = dict()
         self._shared_data_lock = threading.Lock()
 
+        # Waiters block on unit state transitions (see wait_unit_states()).
+        # They are indexed by unit uid, so that the state loop only needs to
+        # look at the waiters of units which actually changed state:
+        #
+        # { unit1_uid: [waiter1, waiter2, ...],
+        #   ...
+        # }
+        #
+        self._waiters     = dict()
+        self._waiter_lock = threading.Lock()
+
+        # unit state updates arrive from the database poll in the run loop,
+        # and from the agent's state channels (see _get_channel())
+        self._update_lock = threading.RLock()
+
+        # agents can offer a direct channel for unit submission and state
+        # notifications (the 'client_channel' setting in the agent config).
+        # Units pushed over that channel are recorded in the database
+        # asynchronously, by the db writer thread.
+        #
+        # { pilot1_uid: {'units' : queue, 'state' : pubsub, 'thread' : thread},
+        #   ...
+        # }
+        #
+        self._channels     = dict()
+        self._channel_lock = threading.Lock()
+
+        # Pushed units are acknowledged by the first state the agent reports
+        # beyond AGENT_STAGING_INPUT_PENDING.  Units which are not acknowledged
+        # within PUSH_TIMEOUT are handed back to the agent's database pull.
+        # Guarded by the _update_lock.
+        #
+        # { unit1_uid: push time, ... }
+        #
+        self._unacked      = dict()
+        self._db_queue     = Queue.Queue()
+        self._db_writer    = threading.Thread(target=self._write_db)
+        self._db_writer.daemon = True
+        self._db_writer.start()
+
         # The manager-level list.
         #
         self._manager_callbacks = dict()
@@ -82,13 +170,16 @@ class UnitManagerController(threading.Thread):
         self._num_output_transfer_workers = output_transfer_workers
 
         # The INPUT transfer worker(s) are autonomous processes that
-        # execute input file transfer requests concurrently.
+        # execute input file transfer requests concurrently.  They share
+        # the staging cache.
+        self._staging_cache = StagingCache()
         self._input_file_transfer_worker_pool = []
         for worker_number in range(1, self._num_input_transfer_workers+1):
             worker = InputFileTransferWorker(
                 session=self._session,
                 unit_manager_id=self.uid,
-                number=worker_number
+                number=worker_number,
+                cache=self._staging_cache
             )
             self._input_file_transfer_worker_pool.append(worker)
             worker.start()
@@ -136,6 +227,17 @@ class UnitManagerController(threading.Thread):
         logger.debug("uworker  %s stopping" % (self.name))
         self._stop.set()
         self.join()
+
+        # flush the pending database writes, and close the agent channels
+        self._db_queue.put(None)
+        self._db_writer.join()
+
+        with self._channel_lock:
+            for channel in self._channels.values():
+                channel['thread'].join()
+                channel['units'].close()
+                channel['state'].close()
+
         logger.debug("uworker  %s stopped" % (self.name))
       # logger.debug("Worker thread (ID: %s[%s]) for UnitManager %s stopped." %
       #             (self.name, self.ident, self.uid))
@@ -207,6 +309,150 @@ class UnitManagerController(threading.Thread):
             self._dbs.publish_compute_unit_callback_history (unit_id, self._callback_histories[unit_id])
 
 
+    # ------------------------------------------------------------------------
+    #
+    def _update_units(self, unit_list):
+        """Merge the given unit documents into the shared data, and call the
+        state callbacks for all units which changed state.  Returns True if
+        any unit changed state.
+        """
+
+        action = False
+
+        with self._update_lock:
+
+            for unit in unit_list:
+                unit_id = str(unit["_id"])
+
+                new_state = unit["state"]
+                if unit_id in self._shared_data:
+                    old_state = self._shared_data[unit_id]["data"]["state"]
+
+                    # units pushed to the agent get their states from the
+                    # agent and from the database -- the database lags
+                    # behind, so we ignore any state it reports late.
+                    if self._shared_data[unit_id].get('pushed') and \
+                       UNIT_STATE_RANK.get(new_state, -1) < UNIT_STATE_RANK.get(old_state, -1):
+                        continue
+                else:
+                    old_state = None
+                    self._shared_data_lock.acquire()
+                    self._shared_data[unit_id] = {
+                        'data':          unit,
+                        'callbacks':     [],
+                        'facade_object': None
+                    }
+                    self._shared_data_lock.release()
+
+                self._shared_data_lock.acquire()
+                self._shared_data[unit_id]["data"] = unit
+                self._shared_data_lock.release()
+
+                if unit_id in self._unacked and \
+                   UNIT_STATE_RANK.get(new_state, -1) > PUSH_ACK_RANK:
+                    del(self._unacked[unit_id])
+
+                if new_state != old_state:
+                    # The state of the unit has changed, We call all
+                    # unit-level callbacks to propagate this.
+                    self.call_unit_state_callbacks(unit_id, new_state)
+                    self._notify_waiters(unit_id, new_state)
+
+                    action = True
+
+        return action
+
+    # ------------------------------------------------------------------------
+    #
+    def _notify_waiters(self, unit_id, new_state):
+        """Wake up all waiters which wait for the given unit to reach the new
+        state, and drop them from the unit's waiter list.
+        """
+
+        with self._waiter_lock:
+
+            waiters = self._waiters.get(unit_id)
+            if not waiters:
+                return
+
+            remaining = list()
+            for waiter in waiters:
+                if new_state in waiter['states']:
+                    waiter['pending'].discard(unit_id)
+                    waiter['matched'].append(unit_id)
+                    waiter['cond'].notify()
+                else:
+                    remaining.append(waiter)
+
+            if remaining: self._waiters[unit_id] = remaining
+            else        : del(self._waiters[unit_id])
+
+    # ------------------------------------------------------------------------
+    #
+    def wait_unit_states(self, unit_ids, states, timeout=None, cb=None):
+        """Block until all given units have reached one of the given states,
+        or until the timeout (in seconds) expires.  If a callback is given, it
+        is invoked once per unit with the unit uid as argument, as soon as the
+        unit is found in a matching state.  Returns the set of uids which did
+        not (yet) reach any of the given states.
+        """
+
+        # Wait for the initialized event to assert proper operation.
+        self._initialized.wait()
+
+        waiter = {'states'  : set(states),
+                  'pending' : set(),
+                  'matched' : list(),
+                  'cond'    : threading.Condition(self._waiter_lock)}
+
+        start = time.time()
+
+        with self._waiter_lock:
+
+            for unit_id in unit_ids:
+                unit = self._shared_data.get(unit_id)
+                if unit and unit['data']['state'] in waiter['states']:
+                    waiter['matched'].append(unit_id)
+                else:
+                    waiter['pending'].add(unit_id)
+                    self._waiters.setdefault(unit_id, list()).append(waiter)
+
+            try:
+                while True:
+
+                    if cb:
+                        for unit_id in waiter['matched']:
+                            cb(unit_id)
+                    waiter['matched'] = list()
+
+                    if not waiter['pending']:
+                        break
+
+                    if self._stop.is_set() or \
+                       self._session._terminate.is_set():
+                        break
+
+                    # we wait in slices, to not miss the termination events
+                    # above.
+                    wait = IDLE_TIME
+                    if timeout is not None:
+                        wait = min(wait, timeout - (time.time() - start))
+                        if wait <= 0:
+                            break
+
+                    waiter['cond'].wait(wait)
+
+            finally:
+                # deregister from the units we did not see yet
+                for unit_id in waiter['pending']:
+                    waiters = self._waiters.get(unit_id, list())
+                    if waiter in waiters:
+                        waiters.remove(waiter)
+                    if not waiters and unit_id in self._waiters:
+                        del(self._waiters[unit_id])
+
+        return waiter['pending']
+
     # ------------------------------------------------------------------------
     #
     def run(self):
@@ -224,43 +470,34 @@ class UnitManagerController(threading.Thread):
             # asynchronous transfer operations.
             transfer_results = list()
 
+            # The state feed only pulls units which changed since the last
+            # pull (keyed on their statehistory timestamps).  Those timestamps
+            # are created on different hosts, so we overlap the queries by
+            # STATE_FEED_LAG seconds, and once in a while pull the complete
+            # unit list to catch anything the delta queries may have missed.
+            since     = None
+            last_sync = 0.0
+
             while not self._stop.is_set() and \
                   not self._session._terminate.is_set():
 
                 # =================================================================
                 #
-                # Check and update units. This needs to be optimized at
-                # some point, i.e., state pulling should be conditional
-                # or triggered by a tailable MongoDB cursor, etc.
-                unit_list = self._dbs.get_compute_units(unit_manager_id=self.uid)
-                action    = False
-
-                for unit in unit_list:
-                    unit_id = str(unit["_id"])
-
-                    new_state = unit["state"]
-                    if unit_id in self._shared_data:
-                        old_state = self._shared_data[unit_id]["data"]["state"]
-                    else:
-                        old_state = None
-                        self._shared_data_lock.acquire()
-                        self._shared_data[unit_id] = {
-                            'data':          unit,
-                            'callbacks':     [],
-                            'facade_object': None
-                        }
-                        self._shared_data_lock.release()
+                # Check and update units.
+                now = time.time()
 
-                    self._shared_data_lock.acquire()
-                    self._shared_data[unit_id]["data"] = unit
-                    self._shared_data_lock.release()
+                if since is None or (now - last_sync) > FULL_SYNC_TIME:
+                    unit_list = self._dbs.get_compute_units(unit_manager_id=self.uid)
+                    last_sync = now
+                else:
+                    unit_list = self._dbs.get_updated_compute_units(
+                            unit_manager_id=self.uid,
+                            since=since - STATE_FEED_LAG)
 
-                    if new_state != old_state:
-                        # The state of the unit has changed, We call all
-                        # unit-level callbacks to propagate this.
-                        self.call_unit_state_callbacks(unit_id, new_state)
+                since  = now
+                action = self._update_units(unit_list)
 
-                        action = True
+                self._release_unacked(now)
 
                 # After the first iteration, we are officially initialized!
                 if not self._initialized.is_set():
@@ -284,6 +521,11 @@ class UnitManagerController(threading.Thread):
                 worker.stop ()
                 logger.debug("uworker %s stopped itransfer %s" % (self.name, worker.name))
 
+            m = self._staging_cache.metrics
+            self._session.prof.prof('staging_cache', uid=self.uid,
+                    msg="hits %d misses %d saved %d bytes"
+                        % (m['hits'], m['misses'], m['saved']))
+
             for worker in self._output_file_transfer_worker_pool:
                 logger.debug("uworker %s stops   otransfer %s" % (self.name, worker.name))
                 worker.stop ()
@@ -367,6 +609,51 @@ class UnitManagerController(threading.Thread):
         """
         return self._dbs.unit_manager_list_compute_units(self.uid)
 
+    # ------------------------------------------------------------------------
+    #
+    def cancel_compute_units(self, unit_uids):
+        """Cancel one or more ComputeUnits.  Units which are handled by the
+        unit manager are canceled with a single database update, and each
+        pilot gets a single cancel command for all of its units.
+        """
+
+        # Wait for the initialized event to assert proper operation.
+        self._initialized.wait()
+
+        local  = list()
+        remote = dict()   # pilot uid: [unit uids]
+
+        for uid in unit_uids:
+
+            if uid not in self._shared_data:
+                continue
+
+            data  = self._shared_data[uid]['data']
+            state = data['state']
+
+            if state in [DONE, FAILED, CANCELED]:
+                logger.debug("Compute unit %s has state %s, can't cancel any longer." % (uid, state))
+
+            elif state in UMGR_CANCEL_STATES or not data.get('pilot'):
+                local.append(uid)
+
+            else:
+                remote.setdefault(data['pilot'], list()).append(uid)
+
+        if local:
+            logger.debug("canceling %d units in the database" % len(local))
+            self._dbs.set_compute_unit_state(local, CANCELED, ["Received Cancel"])
+            for uid in local:
+                self._session.prof.prof('advance', msg=CANCELED, uid=uid, state=CANCELED)
+
+        for pilot_uid, uids in remote.iteritems():
+            logger.debug("sending cancel command for %d units to pilot %s" % (len(uids), pilot_uid))
+            for start in range(0, len(uids), CANCEL_BULK_SIZE):
+                self._dbs.send_command_to_pilot(cmd=COMMAND_CANCEL_COMPUTE_UNIT,
+                        arg=uids[start:start + CANCEL_BULK_SIZE], pilot_ids=pilot_uid)
+            for uid in uids:
+                self._session.prof.prof('cancel', msg=pilot_uid, uid=uid)
+
     # ------------------------------------------------------------------------
     #
     def get_compute_unit_states(self, unit_uids=None):
@@ -410,8 +697,13 @@ class UnitManagerController(threading.Thread):
 
     # ------------------------------------------------------------------------
     #
-    def publish_compute_units(self, units):
-        """register the unscheduled units in the database"""
+    def publish_compute_units(self, units, pilot_uid=None, pilot_sandbox=None,
+                              state=None, log=None, control=None):
+        """register the units in the database -- unscheduled, or (if
+           pilot_uid is given) assigned to that pilot and advanced to 'state'
+           in the same write (see Session.insert_compute_units()).  Units
+           which are published already are skipped.
+        """
 
       # # units are UNSCHEDULED on publishing
       # # FIXME: wtf, units are not even statefulll Bah!
@@ -420,18 +712,36 @@ class UnitManagerController(threading.Thread):
       #     self._session.prof.prof('advance', uid=unit.uid, 
       #                 msg=UNSCHEDULED, state=UNSCHEDULED)
 
+        units = [unit for unit in units if unit.uid not in self._shared_data]
+        if not units:
+            return
+
         # Add all units to the database.
         results = self._dbs.insert_compute_units(umgr_uid=self.uid,
                 units=units,
-                unit_log=[])
+                unit_log=[],
+                pilot_uid=pilot_uid,
+                pilot_sandbox=pilot_sandbox,
+                state=state,
+                log=log,
+                control=control)
 
         assert len(units) == len(results)
 
         # Match results with units.
         for unit in units:
+
+            data = results[unit.uid]
+            if state:
+                # we keep the local state here, so that the state feed (or
+                # the push to the agent) triggers the state callbacks for the
+                # new state, as it does for units published unscheduled.
+                data = dict(data)
+                data['state'] = unit._local_state
+
             # Create a shared data store entry
             self._shared_data[unit.uid] = {
-                'data':          results[unit.uid],
+                'data':          data,
                 'callbacks':     [],
                 'facade_object': unit # weakref.ref(unit)
             }
@@ -439,9 +749,164 @@ class UnitManagerController(threading.Thread):
 
     # ------------------------------------------------------------------------
     #
-    def schedule_compute_units(self, pilot_uid, units):
+    def _write_db(self):
+        """Run the database writes queued for units which were pushed to an
+        agent, until None is queued.
+        """
+
+        while True:
+
+            request = self._db_queue.get()
+            if request is None:
+                break
+
+            method, args = request
+            try:
+                method(*args)
+            except Exception as e:
+                logger.exception("database write failed: %s" % e)
+
+    # ------------------------------------------------------------------------
+    #
+    def _get_channel(self, pilot_doc):
+        """Returns the channel to the agent of the given pilot, or None if the
+        agent does not offer one (yet).  The channel consists of an input
+        endpoint to the agent's staging input queue, and a subscriber to the
+        agent's state notifications, which is served by a separate thread.
+        """
+
+        pilot_uid = pilot_doc['_id']
+        addresses = pilot_doc.get('channels')
+
+        with self._channel_lock:
+
+            if pilot_uid in self._channels:
+                return self._channels[pilot_uid]
+
+            if not addresses:
+                return None
+
+            codec = addresses.get('serializer')
+            units = rpu.Queue.create(rpu.QUEUE_ZMQ, AGENT_STAGING_INPUT_QUEUE,
+                                     rpu.QUEUE_INPUT, addresses['units'],
+                                     serializer=codec)
+            state = rpu.Pubsub.create(rpu.PUBSUB_ZMQ, AGENT_STATE_PUBSUB,
+                                      rpu.PUBSUB_SUB, addresses['state'],
+                                      serializer=codec)
+            state.subscribe('state')
+
+            thread = threading.Thread(target=self._listen_state,
+                                      args=[pilot_uid, state])
+            thread.daemon = True
+            thread.start()
+
+            logger.info("using channel to pilot %s: %s" % (pilot_uid, addresses))
+
+            self._channels[pilot_uid] = {'units'  : units,
+                                         'state'  : state,
+                                         'thread' : thread}
+            return self._channels[pilot_uid]
+
+    # ------------------------------------------------------------------------
+    #
+    def _release_unacked(self, now):
+        """Hand pushed units back to the agent's database pull if the agent
+        did not acknowledge them within PUSH_TIMEOUT -- their push may have
+        been lost.  The agent stages units only once, should the push arrive
+        after all.
+        """
+
+        with self._update_lock:
+
+            if not self._unacked:
+                return
+
+            uids = [uid for uid, pushed in self._unacked.iteritems()
+                        if now - pushed > PUSH_TIMEOUT]
+            for uid in uids:
+                del(self._unacked[uid])
+
+        if uids:
+            logger.warn("%d pushed units not acknowledged, use db" % len(uids))
+            # queued behind the database write of the push
+            self._db_queue.put([self._dbs.release_pushed_compute_units, [uids]])
+
+    # ------------------------------------------------------------------------
+    #
+    def _listen_state(self, pilot_uid, state):
+        """Feed the state notifications of an agent into the shared data.  The
+        agent publishes notifications for all units it handles, we only pick
+        those for units we pushed to it.
+        """
+
+        timeout = int(IDLE_TIME * 1000)  # ms
+
+        try:
+            while not self._stop.is_set() and \
+                  not self._session._terminate.is_set():
+
+                topic, unit = state.get_nowait(timeout=timeout)
+
+                if not unit or 'update' in unit or not unit.get('state'):
+                    continue
+
+                entry = self._shared_data.get(unit['_id'])
+                if entry and entry.get('pushed'):
+                    self._update_units([unit])
+
+        except Exception as e:
+            logger.exception("state channel to pilot %s failed: %s" % (pilot_uid, e))
+
+    # ------------------------------------------------------------------------
+    #
+    def _push_compute_units(self, channel, pilot_uid, pilot_sandbox, units,
+                            recorded=False):
+        """Push the given units to the agent's staging input queue, in the
+        same form the agent would pull them from the database, and queue the
+        respective database update -- unless the units were 'recorded' in
+        the database as pushed already.
+        """
+
+        ts   = timestamp()
+        docs = list()
+
+        for unit in units:
+
+            doc = dict(self._shared_data[unit.uid]['data'])
+            doc.update(self._dbs.get_compute_unit_assignment(unit, pilot_uid, pilot_sandbox))
+            doc['state']           = AGENT_STAGING_INPUT_PENDING
+            doc['state_timestamp'] = ts
+            doc['control']         = 'agent'
+            docs.append(doc)
+
+            self._shared_data_lock.acquire()
+            self._shared_data[unit.uid]['pushed'] = True
+            self._shared_data_lock.release()
+
+        with self._update_lock:
+            now = time.time()
+            for doc in docs:
+                self._unacked[doc['_id']] = now
+
+        for doc in docs:
+            channel['units'].put(doc)
+            self._session.prof.prof('advance', uid=doc['_id'],
+                    msg=AGENT_STAGING_INPUT_PENDING, state=AGENT_STAGING_INPUT_PENDING)
+
+        if not recorded:
+            self._db_queue.put([self._dbs.assign_pushed_compute_units,
+                                [units, pilot_uid, pilot_sandbox, ts]])
+
+        self._update_units(docs)
+
+        logger.info("Pushed ComputeUnits %s to ComputePilot '%s'." % (units, pilot_uid))
+
+    # ------------------------------------------------------------------------
+    #
+    def schedule_compute_units(self, pilot_uid, units, publish=False):
         """Request the scheduling of one or more ComputeUnits on a
-           ComputePilot.
+           ComputePilot.  If 'publish' is set, the units are not in the
+           database yet, and are inserted as scheduled right away.
         """
 
         try:
@@ -481,12 +946,12 @@ class UnitManagerController(threading.Thread):
 
                 for input_sd_entry in input_sds:
                     action = input_sd_entry['action']
-                    source = ru.Url(input_sd_entry['source'])
-                    target = ru.Url(input_sd_entry['target'])
+                    source = str(input_sd_entry['source'])
+                    target = str(input_sd_entry['target'])
 
                     new_sd = {'action':   action,
-                              'source':   str(source),
-                              'target':   str(target),
+                              'source':   source,
+                              'target':   target,
                               'flags':    input_sd_entry['flags'],
                               'priority': input_sd_entry['priority'],
                               'state':    PENDING
@@ -496,13 +961,21 @@ class UnitManagerController(threading.Thread):
                         unit.Agent_Input_Directives.append(new_sd)
                         unit.Agent_Input_Status = PENDING
                     elif action in [TRANSFER]:
-                        if source.scheme and source.scheme != 'file':
+                        scheme = _url_scheme(source)
+                        if scheme and scheme != 'file':
                             # If there is a scheme and it is different than "file",
                             # assume a remote pull from the agent
                             unit.Agent_Input_Directives.append(new_sd)
                             unit.Agent_Input_Status = PENDING
                         else:
-                            # Transfer from local to sandbox
+                            # Transfer from local to sandbox.  Small files
+                            # are bundled with others for the same pilot.
+                            if BUNDLE_SIZE and BUNDLE not in new_sd['flags']:
+                                try:
+                                    if os.path.getsize(new_sd['source']) <= BUNDLE_SIZE:
+                                        new_sd['flags'] = new_sd['flags'] + [BUNDLE]
+                                except OSError:
+                                    pass
                             unit.FTW_Input_Directives.append(new_sd)
                             unit.FTW_Input_Status = PENDING
                     else:
@@ -520,12 +993,12 @@ class UnitManagerController(threading.Thread):
 
                 for output_sds_entry in output_sds:
                     action = output_sds_entry['action']
-                    source = ru.Url(output_sds_entry['source'])
-                    target = ru.Url(output_sds_entry['target'])
+                    source = str(output_sds_entry['source'])
+                    target = str(output_sds_entry['target'])
 
                     new_sd = {'action':   action,
-                              'source':   str(source),
-                              'target':   str(target),
+                              'source':   source,
+                              'target':   target,
                               'flags':    output_sds_entry['flags'],
                               'priority': output_sds_entry['priority'],
                               'state':    PENDING
@@ -535,30 +1008,59 @@ class UnitManagerController(threading.Thread):
                         unit.Agent_Output_Directives.append(new_sd)
                         unit.Agent_Output_Status = NEW
                     elif action == TRANSFER:
-                        if target.scheme and target.scheme != 'file':
+                        scheme = _url_scheme(target)
+                        if scheme and scheme != 'file':
                             # If there is a scheme and it is different than "file",
                             # assume a remote push from the agent
                             unit.Agent_Output_Directives.append(new_sd)
                             unit.Agent_Output_Status = NEW
                         else:
-                            # Transfer from sandbox back to local
+                            # Transfer from sandbox back to local.  The agent
+                            # bundles the small files (see BUNDLE_SIZE).
+                            if BUNDLE_SIZE and BUNDLE not in new_sd['flags']:
+                                new_sd['flags'] = new_sd['flags'] + [BUNDLE]
                             unit.FTW_Output_Directives.append(new_sd)
                             unit.FTW_Output_Status = NEW
                     else:
                         logger.warn('Not sure if action %s makes sense for output staging' % action)
 
-            # Bulk-add all units
-            self._dbs.assign_compute_units_to_pilot(
-                units=units,
-                pilot_uid=pilot_uid,
-                pilot_sandbox=pilot_sandbox
-            )
+            # Units which need no input staging by the transfer workers are
+            # pushed to the agent directly -- if the agent offers a channel.
+            channel = self._get_channel(pilot_info[0])
+            if channel:
+                pushed = [unit for unit in units if not unit.FTW_Input_Directives]
+                units  = [unit for unit in units if     unit.FTW_Input_Directives]
+                if pushed:
+                    if publish:
+                        # the units need to be in the database before the
+                        # agent reports their states
+                        self.publish_compute_units(pushed, pilot_uid, pilot_sandbox,
+                                state=AGENT_STAGING_INPUT_PENDING,
+                                log="pushed unit to agent", control='agent')
+                    self._push_compute_units(channel, pilot_uid, pilot_sandbox,
+                                             pushed, recorded=publish)
+
+            log = "Scheduled for data transfer to ComputePilot %s." % pilot_uid
+
+            if publish:
+                # insert, assign and advance the units in one write
+                self.publish_compute_units(units, pilot_uid, pilot_sandbox,
+                                           state=PENDING_INPUT_STAGING, log=log)
+
+            elif units:
+                # Bulk-add all units
+                self._dbs.assign_compute_units_to_pilot(
+                    units=units,
+                    pilot_uid=pilot_uid,
+                    pilot_sandbox=pilot_sandbox
+                )
 
-            for unit in units:
                 # DON'T set state before pilot is assigned -- otherwise units
                 # are picked up by the FTW
-                log = "Scheduled for data transfer to ComputePilot %s." % pilot_uid
-                self._dbs.set_compute_unit_state(unit.uid, PENDING_INPUT_STAGING, log)
+                self._dbs.set_compute_unit_state([unit.uid for unit in units],
+                                                 PENDING_INPUT_STAGING, log)
+
+            for unit in units:
                 self._session.prof.prof('advance', uid=unit.uid, 
                         msg=PENDING_INPUT_STAGING, state=PENDING_INPUT_STAGING)
 
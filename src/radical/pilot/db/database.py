@@ -29,6 +29,9 @@ COMMAND_TYPE                = "type"
 COMMAND_ARG                 = "arg"
 COMMAND_TIME                = "time"
 
+# number of unit documents inserted with one (unordered) bulk operation
+INSERT_BULK_SIZE            = 10000
+
 
 #-----------------------------------------------------------------------------
 #
@@ -81,6 +84,12 @@ class Session():
         self._w  = self._db["%s.cu" % sid]
         self._um = self._db["%s.um" % sid] 
 
+        # the unit manager controller pulls state deltas based on the
+        # statehistory timestamps (see get_updated_compute_units()), so we
+        # make sure that query is backed by an index.
+        self._w.ensure_index([("unitmanager",            ASCENDING),
+                              ("statehistory.timestamp", ASCENDING)])
+
         self._p  = self._db["%s.p"  % sid]
         self._pm = self._db["%s.pm" % sid] 
 
@@ -149,6 +158,11 @@ class Session():
 
         self._closed = timestamp()
 
+        # mark the session doc as closed, so that the session cache knows
+        # that no further updates can arrive (see update_session_cache())
+        self._s.update({"_id"  : self._session_id},
+                       {"$set" : {"closed" : self._closed}})
+
     #--------------------------------------------------------------------------
     #
     def delete(self):
@@ -432,6 +446,28 @@ class Session():
 
         return units_json.values()
 
+    #--------------------------------------------------------------------------
+    #
+    def get_updated_compute_units(self, unit_manager_id, since):
+        """ Get all compute units of the given unit manager which had a state
+            transition after the given timestamp.  All state changes push an
+            entry to the unit's statehistory, so the state history timestamps
+            are used as update counter.
+        """
+        if self._s is None:
+            raise Exception("No active session.")
+
+        cursor = self._w.find(
+            {"unitmanager"           : unit_manager_id,
+             "statehistory.timestamp": {"$gt": since}}
+        )
+
+        units_json = dict()
+        for obj in cursor:
+            units_json[obj['_id']] = obj
+
+        return units_json.values()
+
     #--------------------------------------------------------------------------
     #
     def change_compute_units (self, filter_dict, set_dict, push_dict):
@@ -474,17 +510,19 @@ class Session():
 
         for uid in unit_ids :
 
+            # NOTE: both entries need to go into the same '$push' -- the
+            #       statehistory is what the unit manager's state feed keys on.
             if src_states :
                 bulk.find   ({"_id"     : uid, 
                               "state"   : {"$in"  : src_states} }) \
                     .update ({"$set"    : {"state": state},
-                              "$push"   : {"statehistory": {"state": state, "timestamp": ts}},
-                              "$push"   : {"log"  : {"message": log, "timestamp": ts}}})
+                              "$push"   : {"statehistory": {"state": state, "timestamp": ts},
+                                           "log"         : {"message": log, "timestamp": ts}}})
             else :
                 bulk.find   ({"_id"     : uid}) \
                     .update ({"$set"    : {"state": state},
-                              "$push"   : {"statehistory": {"state": state, "timestamp": ts}},
-                              "$push"   : {"log"  : {"message": log, "timestamp": ts}}})
+                              "$push"   : {"statehistory": {"state": state, "timestamp": ts},
+                                           "log"         : {"message": log, "timestamp": ts}}})
 
         result = bulk.execute()
 
@@ -677,6 +715,41 @@ class Session():
             unit_ids.append(str(obj['_id']))
         return unit_ids
 
+    #--------------------------------------------------------------------------
+    #
+    def get_compute_unit_description(self, unit):
+        """Returns the description of a compute unit as stored in the database.
+           The description is serialized only once per unit -- whoever changes
+           the description after that needs to reset unit._description_doc.
+        """
+
+        if  unit._description_doc is None:
+            unit._description_doc = unit.description.as_dict()
+
+        return unit._description_doc
+
+
+    #--------------------------------------------------------------------------
+    #
+    def get_compute_unit_assignment(self, unit, pilot_uid, pilot_sandbox):
+        """Returns the fields which assign a compute unit to a pilot.
+        """
+
+        return {"description"   : self.get_compute_unit_description(unit),
+                "pilot"         : pilot_uid,
+                "pilot_sandbox" : pilot_sandbox,
+                "sandbox"       : unit.sandbox,
+                "FTW_Input_Status": unit.FTW_Input_Status,
+                "FTW_Input_Directives": unit.FTW_Input_Directives,
+                "Agent_Input_Status": unit.Agent_Input_Status,
+                "Agent_Input_Directives": unit.Agent_Input_Directives,
+                "FTW_Output_Status": unit.FTW_Output_Status,
+                "FTW_Output_Directives": unit.FTW_Output_Directives,
+                "Agent_Output_Status": unit.Agent_Output_Status,
+                "Agent_Output_Directives": unit.Agent_Output_Directives
+               }
+
+
     #--------------------------------------------------------------------------
     #
     def assign_compute_units_to_pilot(self, units, pilot_uid, pilot_sandbox):
@@ -698,25 +771,74 @@ class Session():
         for unit in units :
 
             bulk.find   ({"_id" : unit.uid}) \
-                .update ({"$set": {"description"   : unit.description.as_dict(),
-                                   "pilot"         : pilot_uid,
-                                   "pilot_sandbox" : pilot_sandbox,
-                                   "sandbox"       : unit.sandbox,
-                                   "FTW_Input_Status": unit.FTW_Input_Status,
-                                   "FTW_Input_Directives": unit.FTW_Input_Directives,
-                                   "Agent_Input_Status": unit.Agent_Input_Status,
-                                   "Agent_Input_Directives": unit.Agent_Input_Directives,
-                                   "FTW_Output_Status": unit.FTW_Output_Status,
-                                   "FTW_Output_Directives": unit.FTW_Output_Directives,
-                                   "Agent_Output_Status": unit.Agent_Output_Status,
-                                   "Agent_Output_Directives": unit.Agent_Output_Directives
-                        }})
+                .update ({"$set": self.get_compute_unit_assignment(
+                                        unit, pilot_uid, pilot_sandbox)})
         result = bulk.execute()
 
         # TODO: log result.
         # WHY DON'T WE HAVE A LOGGER HERE?
 
 
+    #--------------------------------------------------------------------------
+    #
+    def assign_pushed_compute_units(self, units, pilot_uid, pilot_sandbox, ts):
+        """Records compute units which were pushed to the agent of a pilot
+           directly: they are assigned to the pilot, marked as under agent
+           control (so that the agent does not pull them again), and advanced
+           to AGENT_STAGING_INPUT_PENDING at time 'ts' -- unless the agent
+           already reported a later state.
+        """
+
+        if  not units :
+            return
+
+        if  self._s is None:
+            raise RuntimeError("No active session.")
+
+        # Make sure we work on a list.
+        if not isinstance(units, list):
+            units = [units]
+
+        bulk  = self._w.initialize_ordered_bulk_op ()
+        state = AGENT_STAGING_INPUT_PENDING
+
+        for unit in units :
+
+            assignment = self.get_compute_unit_assignment(unit, pilot_uid, pilot_sandbox)
+            assignment["control"] = "agent"
+
+            bulk.find   ({"_id" : unit.uid}) \
+                .update ({"$set": assignment})
+            bulk.find   ({"_id"     : unit.uid,
+                          "state"   : {"$in" : [NEW, SCHEDULING, UNSCHEDULED]}}) \
+                .update ({"$set"    : {"state": state},
+                          "$push"   : {"statehistory": {"state": state, "timestamp": ts},
+                                       "log"         : {"message": "pushed unit to agent",
+                                                        "timestamp": ts}}})
+        result = bulk.execute()
+
+
+    #--------------------------------------------------------------------------
+    #
+    def release_pushed_compute_units(self, unit_ids):
+        """Hands compute units which were pushed to the agent of a pilot, but
+           not acknowledged by it, back to the agent's database pull -- unless
+           the agent reported a later state meanwhile.
+        """
+
+        if  not unit_ids :
+            return
+
+        if  self._s is None:
+            raise RuntimeError("No active session.")
+
+        self._w.update({"_id"     : {"$in" : unit_ids},
+                        "control" : "agent",
+                        "state"   : AGENT_STAGING_INPUT_PENDING},
+                       {"$set"    : {"control" : "umgr"}},
+                       multi=True)
+
+
     #--------------------------------------------------------------------------
     #
     def publish_compute_unit_callback_history(self, unit_uid, callback_history):
@@ -729,9 +851,19 @@ class Session():
 
     #--------------------------------------------------------------------------
     #
-    def insert_compute_units(self, umgr_uid, units, unit_log):
-        """ Adds one or more compute units to the database and sets their state
-            to 'PENDING'.
+    def insert_compute_units(self, umgr_uid, units, unit_log,
+                             pilot_uid=None, pilot_sandbox=None,
+                             state=None, log=None, control=None):
+        """ Adds one or more compute units to the database, in their local
+            state.
+
+            If a pilot_uid is given, the units are inserted as assigned to
+            that pilot, and advanced to 'state' right away (with 'log' as log
+            message, and under the given 'control') -- this fuses the
+            insertion with assign_compute_units_to_pilot() and
+            set_compute_unit_state() into one write.
+
+            Units are inserted in unordered bulks of INSERT_BULK_SIZE.
         """
         if self._s is None:
             raise RuntimeError("No active session.")
@@ -743,13 +875,13 @@ class Session():
         unit_docs = list()
         results = dict()
 
-        for unit in units:
+        ts = timestamp()
 
-            ts = timestamp()
+        for unit in units:
 
             unit_json = {
                 "_id":           unit.uid,
-                "description":   unit.description.as_dict(),
+                "description":   self.get_compute_unit_description(unit),
                 "restartable":   unit.description.restartable,
                 "unitmanager":   umgr_uid,
                 "pilot":         None,
@@ -764,7 +896,7 @@ class Session():
                 "sandbox":       None,
                 "stdout":        None,
                 "stderr":        None,
-                "log":           unit_log,
+                "log":           list(unit_log),
                 "FTW_Input_Status":        None,
                 "FTW_Input_Directives":    None,
                 "Agent_Input_Status":      None,
@@ -774,12 +906,33 @@ class Session():
                 "Agent_Output_Status":     None,
                 "Agent_Output_Directives": None
             }
+
+            if  pilot_uid:
+                unit_json.update(self.get_compute_unit_assignment(
+                                        unit, pilot_uid, pilot_sandbox))
+                if  control:
+                    unit_json["control"] = control
+
+            if  state:
+                unit_json["state"] = state
+                unit_json["statehistory"].append({"state": state, "timestamp": ts})
+                unit_json["log"].append({"message": log, "timestamp": ts})
+
             unit_docs.append(unit_json)
             results[unit.uid] = unit_json
 
-        unit_uids = self._w.insert(unit_docs)
+        for start in range(0, len(unit_docs), INSERT_BULK_SIZE):
+
+            chunk = unit_docs[start:start+INSERT_BULK_SIZE]
+            bulk  = self._w.initialize_unordered_bulk_op ()
+
+            for unit_json in chunk:
+                bulk.insert(unit_json)
+
+            result = bulk.execute()
+
+            assert result['nInserted'] == len(chunk)
 
-        assert len(unit_docs) == len(unit_uids)
-        assert len(results) == len(unit_uids)
+        assert len(results) == len(unit_docs)
 
         return results
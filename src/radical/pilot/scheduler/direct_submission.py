@@ -58,6 +58,14 @@ class DirectSubmissionScheduler(Scheduler):
         del self.pilots[pid]
 
 
+    # -------------------------------------------------------------------------
+    #
+    @property
+    def upfront(self):
+
+        return True
+
+
     # -------------------------------------------------------------------------
     #
     def schedule(self, units):
@@ -54,6 +54,16 @@ class Scheduler(object):
 
         logger.warn ("scheduler %s does not implement 'unschedule()'" % self.name)
 
+    # -------------------------------------------------------------------------
+    # 
+    @property
+    def upfront(self):
+        """True if the scheduler assigns units to pilots as they are submitted,
+        without looking at their state.  The unit manager then schedules
+        units before they are published, and inserts them into the database
+        as scheduled."""
+        return False
+
     # -------------------------------------------------------------------------
     # 
     @property
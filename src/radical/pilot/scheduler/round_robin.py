@@ -59,6 +59,14 @@ class RoundRobinScheduler(Scheduler):
         del self.pilots[pid]
 
 
+    # -------------------------------------------------------------------------
+    #
+    @property
+    def upfront(self):
+
+        return True
+
+
     # -------------------------------------------------------------------------
     #
     def schedule(self, units):
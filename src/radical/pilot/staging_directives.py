@@ -27,6 +27,8 @@ TRANSFER = 'Transfer' # saga remote transfer TODO: This might just be a special
 #
 CREATE_PARENTS = 'CreateParents'  # Create parent directories while writing file
 SKIP_FAILED    = 'SkipFailed'     # Don't stage out files if tasks failed
+BUNDLE         = 'Bundle'         # Transfer file in an archive with other small files
+CACHE          = 'Cache'          # Stage file once per pilot, via the staging cache
 
 #
 # Defaults
@@ -35,6 +37,16 @@ DEFAULT_ACTION   = TRANSFER
 DEFAULT_PRIORITY = 0
 DEFAULT_FLAGS    = [CREATE_PARENTS, SKIP_FAILED]
 STAGING_AREA     = 'staging_area'
+STAGING_CACHE    = 'cache'        # staging cache, relative to STAGING_AREA
+
+# Local input files up to this size (in bytes) are transferred in bundles, and
+# so are output files, up to the agent's 'staging_bundle_size'.  0 disables
+# bundling, unless directives are flagged with BUNDLE explicitly.
+BUNDLE_SIZE      = int(os.environ.get('RADICAL_PILOT_BUNDLE_SIZE', 0))
+
+# Max number of bytes a unit manager transfers into the staging cache of
+# a pilot.  Files flagged with CACHE beyond that are transferred per unit.
+CACHE_SIZE       = int(os.environ.get('RADICAL_PILOT_CACHE_SIZE', 1024 * 1024 * 1024))
 
 #-----------------------------------------------------------------------------
 #
@@ -101,6 +113,14 @@ def expand_staging_directive(staging_directive):
             else:
                 flags = DEFAULT_FLAGS
 
+            # a single flag can be given as string
+            if not flags:
+                flags = []
+            elif isinstance(flags, basestring):
+                flags = [flags]
+            else:
+                flags = list(flags)
+
             if 'priority' in sd:
                 priority = sd['priority']
             else:
@@ -136,8 +156,8 @@ def expand_staging_directive(staging_directive):
                 new_sd = {'source':   source,
                           'target':   target,
                           'action':   action,
-                          'flags':    DEFAULT_FLAGS,
-                          'priority': DEFAULT_PRIORITY
+                          'flags':    flags,
+                          'priority': priority
                 }
                 new_staging_directive.append(new_sd)
                 logger.debug("Completing entry '%s'" % new_sd)
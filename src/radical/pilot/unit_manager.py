@@ -26,6 +26,8 @@ from .compute_unit import ComputeUnit
 from .controller   import UnitManagerController
 from .scheduler    import get_scheduler, SCHED_DEFAULT
 
+PROGRESS_STEP = 100  # report submission progress every so many units
+
 # -----------------------------------------------------------------------------
 #
 class UnitManager(object):
@@ -441,11 +443,21 @@ class UnitManager(object):
                 import radical.utils as ru
                 ru.write_json(ud.as_dict(), "%s/%s.batch.%03d.json" \
                         % (self._session._rec, u.uid, self._rec_id))
+
+            if not len(units) % PROGRESS_STEP:
+                logger.report.progress()
+        if len(units) % PROGRESS_STEP:
             logger.report.progress()
         if self._session._rec:
             self._rec_id += 1
 
-        self._worker.publish_compute_units (units=units)
+        # if the scheduler knows the schedule up front, the units are
+        # published as scheduled (one write per pilot), otherwise they are
+        # published first, and scheduled later.
+        upfront = self._scheduler.upfront
+
+        if not upfront:
+            self._worker.publish_compute_units (units=units)
 
         schedule = None
         try:
@@ -453,9 +465,19 @@ class UnitManager(object):
        
         except Exception as e:
             logger.exception ("Internal error - unit scheduler failed")
+            if upfront:
+                self._worker.publish_compute_units (units=units)
             raise 
 
-        self.handle_schedule (schedule)
+        try:
+            self.handle_schedule (schedule, publish=upfront)
+
+        except Exception as e:
+            if upfront:
+                # publish the units which did not get published along with
+                # their schedule (the others are skipped)
+                self._worker.publish_compute_units (units=units)
+            raise
 
         logger.report.ok('>>ok\n')
 
@@ -467,11 +489,15 @@ class UnitManager(object):
 
     # -------------------------------------------------------------------------
     #
-    def handle_schedule (self, schedule) :
+    def handle_schedule (self, schedule, publish=False) :
 
         # we want to use bulk submission to the pilots, so we collect all units
         # assigned to the same set of pilots.  At the same time, we select
         # unscheduled units for later insertion into the wait queue.
+        #
+        # If 'publish' is set, the units are not yet in the database: they
+        # are published along with their pilot assignment, or, if they don't
+        # get one, before their state changes.
         
         if  not schedule :
             logger.debug ('skipping empty unit schedule')
@@ -517,6 +543,8 @@ class UnitManager(object):
                     # lost pilot, do not schedule unit
                     self._session.prof.prof('unschedule', uid=unit.uid)
                     logger.warn ("unschedule unit %s, lost pilot %s" % (unit.uid, pid))
+                    if  publish :
+                        self._worker.publish_compute_units (units=[unit])
                     continue
 
                 unit.sandbox = schedule['pilots'][pid]['sandbox'] + "/" + str(unit.uid)
@@ -532,6 +560,8 @@ class UnitManager(object):
                               "compute unit descriptions -- install " \
                               "radical.ensemblemd.mdkernels!")
                         # FIXME: unit needs a '_set_state() method or something!
+                        if  publish :
+                            self._worker.publish_compute_units (units=[unit])
                         self._session._dbs.set_compute_unit_state (unit._uid, FAILED, 
                                 ["kernel expansion failed"])
                         continue
@@ -546,12 +576,16 @@ class UnitManager(object):
                     ud.executable  = mdtd_bound.executable
                     ud.mpi         = mdtd_bound.mpi
 
+                    # the description needs to be serialized again
+                    unit._description_doc = None
+
 
                 units_to_schedule.append (unit)
 
             if  len(units_to_schedule) :
                 self._worker.schedule_compute_units (pilot_uid=pid,
-                                                     units=units_to_schedule)
+                                                     units=units_to_schedule,
+                                                     publish=publish)
 
 
         # report any change in wait_queue_size
@@ -563,6 +597,8 @@ class UnitManager(object):
                                                 self.wait_queue_size)
 
         if  len(unscheduled) :
+            if  publish :
+                self._worker.publish_compute_units (units=unscheduled)
             self._worker.unschedule_compute_units (units=unscheduled)
 
         logger.info ('%s units remain unscheduled' % len(unscheduled))
@@ -656,54 +692,34 @@ class UnitManager(object):
 
 
         units  = self.get_units(unit_ids)
-        start  = time.time()
 
         logger.report.info('<<wait for %d unit(s)\n\t' % len(units))
 
-        # We don't want to iterate over all units again and again, as that would
-        # duplicate checks on units which were found in matching states.  So we
-        # create a dict and record units we have checked already.
-        checked_units = {unit: False for unit in units}
-
-        # Initially we need to check all units
-        to_check = units
-
+        # ----------------------------------------------------------------------
+        def _report(uid):
+            unit_state = self._worker.get_compute_unit_data(uid)['state']
+            if unit_state in [FAILED]:
+                logger.report.idle(color='error', c='-')
+            elif unit_state in [CANCELED]:
+                logger.report.idle(color='warn', c='*')
+            else:
+                logger.report.idle(color='ok', c='+')
+        # ----------------------------------------------------------------------
+
+        # The worker wakes us up whenever units reach one of the requested
+        # states, so we never iterate over all units again and again.
         logger.report.idle(mode='start')
-        while to_check and not self._session._terminate.is_set():
-
-            logger.report.idle()
-
-            for unit in to_check:
-                if unit.state in state:
-                    # stop watching this unit
-                    checked_units[unit] = True
-                    if unit.state in [FAILED]:
-                        logger.report.idle(color='error', c='-')
-                    elif unit.state in [CANCELED]:
-                        logger.report.idle(color='warn', c='*')
-                    else:
-                        logger.report.idle(color='ok', c='+')
-
-            # check if units remain to be waited for.
-            to_check = [unit for unit in checked_units if not checked_units[unit]]
-
-            # check timeout
-            if  (None != timeout) and (timeout <= (time.time() - start)):
-                if  to_check :
-                    logger.debug ("wait timed out")
-                break
-
-            # if units remain to be watched and we have still time
-            if to_check:
-                time.sleep (0.5)
-
+        to_check = self._worker.wait_unit_states([unit.uid for unit in units],
+                                                 state, timeout, cb=_report)
+        if to_check:
+            logger.debug ("wait timed out")
         logger.report.idle(mode='stop')
 
         if not to_check: logger.report.ok(  '>>ok\n')
         else           : logger.report.warn('>>timeout\n')
 
         # grab the current states to return
-        states = [unit.state for unit in checked_units]
+        states = [unit.state for unit in units]
 
         # done waiting
         if  return_list_type :
@@ -729,12 +745,15 @@ class UnitManager(object):
         if not self._valid:
             raise RuntimeError("instance is already closed")
 
-        if (not isinstance(unit_ids, list)) and (unit_ids is not None):
+        if unit_ids is None:
+            unit_ids = self.list_units()
+
+        elif not isinstance(unit_ids, list):
             unit_ids = [unit_ids]
 
-        cus = self.get_units(unit_ids)
-        for cu in cus:
-            cu.cancel()
+        # units are canceled in bulk: one database update, and one cancel
+        # command per pilot
+        self._worker.cancel_compute_units(unit_ids)
 
 
     # -------------------------------------------------------------------------
@@ -14,6 +14,8 @@ logger.info('radical.pilot        version: %s' % version_detail)
 from db_utils           import *
 from prof_utils         import *
 from misc               import *
+from staging            import *
+from serializer         import *
 from queue              import *
 from pubsub             import *
 from analysis           import *
@@ -87,7 +87,6 @@ _info_entries = [
 
 # ------------------------------------------------------------------------------
 #
-tmp = None
 def add_concurrency (frame, tgt, spec):
     """
     add a column 'tgt' which is a cumulative sum of conditionals of another row.
@@ -128,76 +127,53 @@ def add_concurrency (frame, tgt, spec):
     """
     
     import numpy as np
+    import pandas as pd
 
-    # create a temporary row over which we can do the commulative sum
-    # --------------------------------------------------------------------------
-    def _conc (row, spec):
-
-        # row must match any filter dict in 'spec[in/out]' 
-        # for any filter dict it must match all col/pat pairs
-
-        # for each in filter
-        for f in spec['in']:
-            match = 1 
-            # for each col/val in that filter
-            for col, pat in f.iteritems():
-                if row[col] != pat:
-                    match = 0
-                    break
-            if match:
-                # one filter matched!
-              # print " + : %-20s : %.2f : %-20s : %s " % (row['uid'], row['time'], row['event'], row['message'])
-                return 1
+    # +1 for rows matching any 'in' filter, -1 for rows matching any 'out'
+    # filter ('in' takes precedence), NaN otherwise.  The cumsum skips (and
+    # keeps) the NaNs.
+    m_in  = _match(frame, spec['in'])
+    m_out = _match(frame, spec['out'])
+    steps = np.where(m_in, 1.0, np.where(m_out, -1.0, np.NaN))
+    conc  = pd.Series(steps, index=frame.index).cumsum()
 
-        # for each out filter
-        for f in spec['out']:
-            match = 1 
-            # for each col/val in that filter
-            for col, pat in f.iteritems():
-                if row[col] != pat:
-                    match = 0
-                    break
-            if match:
-                # one filter matched!
-              # print " - : %-20s : %.2f : %-20s : %s " % (row['uid'], row['time'], row['event'], row['message'])
-                return -1
-
-        # no filter matched
-      # print "   : %-20s : %.2f : %-20s : %s " % (row['uid'], row['time'], row['event'], row['message'])
-        return  np.NaN
-    # --------------------------------------------------------------------------
+    # sanitize concurrency: negative values indicate incorrect event ordering,
+    # so we set the repesctive values to NaN
+    conc[conc < 0] = np.NaN
 
     # we only want to later look at changes of the concurrency -- leading or trailing 
     # idle times are to be ignored.  We thus set repeating values of the cumsum to NaN, 
     # so that they can be filtered out when ploting: df.dropna().plot(...).  
     # That specifically will limit the plotted time range to the area of activity. 
     # The full time range can still be plotted when ommitting the dropna() call.
-    # --------------------------------------------------------------------------
-    def _time (x):
-        global tmp
-        if     x != tmp: tmp = x
-        else           : x   = np.NaN
-        return x
+    # A value repeats if it equals the value in the previous row (NaN never
+    # does).
+    conc[conc.diff() == 0] = np.NaN
 
-
-    # --------------------------------------------------------------------------
-    # sanitize concurrency: negative values indicate incorrect event ordering,
-    # so we set the repesctive values to 0
-    # --------------------------------------------------------------------------
-    def _abs (x):
-        if x < 0:
-            return np.NaN
-        return x
-    # --------------------------------------------------------------------------
-    
-    frame[tgt] = frame.apply(lambda row: _conc(row, spec), axis=1).cumsum()
-    frame[tgt] = frame.apply(lambda row: _abs (row[tgt]),  axis=1)
-    frame[tgt] = frame.apply(lambda row: _time(row[tgt]),  axis=1)
-  # print frame[[tgt, 'time']]
+    frame[tgt] = conc
 
     return frame
 
 
+# ------------------------------------------------------------------------------
+#
+def _match(frame, filters):
+    """
+    return a boolean array which marks the rows of 'frame' which match any of
+    the given filter dicts, ie. which match all col/pat pairs of that dict.
+    """
+
+    import numpy as np
+
+    mask = np.zeros(len(frame), dtype=bool)
+    for f in filters:
+        fmask = np.ones(len(frame), dtype=bool)
+        for col, pat in f.iteritems():
+            fmask &= (frame[col] == pat).values
+        mask |= fmask
+
+    return mask
+
 
 # ------------------------------------------------------------------------------
 #
@@ -214,19 +190,23 @@ def add_frequency(frame, tgt, window, spec):
     The method looks backwards, so the resulting frequency column contains the
     frequency which applied *up to* that point in time.
     """
-    
-    # --------------------------------------------------------------------------
-    def _freq(t, _tmp, _window):
-        # get sequence of frame which falls within the time window, and return
-        # length of that sequence
-        return len(_tmp.uid[(_tmp.time > t-_window) & (_tmp.time <= t)])
-    # --------------------------------------------------------------------------
-    
+
+    import numpy as np
+    import pandas as pd
+
     # filter the frame by the given spec
     tmp = frame
     for key,val in spec.iteritems():
         tmp = tmp[tmp[key].isin([val])]
-    frame[tgt] = tmp.time.apply(_freq, args=[tmp, window])
+
+    # count the events in (t-window, t] for each event time t, by bisecting
+    # the sorted event times
+    times  = tmp.time.values.astype(float)
+    events = np.sort(times[~np.isnan(times)])
+    counts = np.searchsorted(events, times,          side='right') \
+           - np.searchsorted(events, times - window, side='right')
+
+    frame[tgt] = pd.Series(counts, index=tmp.index)
 
     return frame
 
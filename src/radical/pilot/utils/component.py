@@ -10,7 +10,7 @@ import radical.utils   as ru
 
 from ..states    import *
 
-from .prof_utils import Profiler, clone_units, drop_units
+from .prof_utils import Profiler, clone_units, drop_units, timestamp
 
 from .queue      import Queue        as rpu_Queue
 from .queue      import QUEUE_ZMQ    as rpu_QUEUE_ZMQ
@@ -22,6 +22,19 @@ from .pubsub     import PUBSUB_ZMQ   as rpu_PUBSUB_ZMQ
 from .pubsub     import PUBSUB_PUB   as rpu_PUBSUB_PUB
 from .pubsub     import PUBSUB_SUB   as rpu_PUBSUB_SUB
 
+# max number of units handed to a bulk worker at once (see declare_worker()).
+# A bulk is taken from the input queue with one request, so large bulks starve
+# other instances of the same component.
+BULK_SIZE     = 64
+
+# max time (seconds) the main loop blocks on inputs when idle.  That bounds the
+# time it takes to notice shutdown.
+_POLL_TIMEOUT = 1.0
+
+# min time (seconds) between invocations of an idle callback which did not
+# find anything to do
+_IDLE_RETRY   = 0.1
+
 # TODO:
 #   - add PENDING states
 #   - for notifications, change msg from [topic, unit] to [topic, msg]
@@ -89,6 +102,10 @@ class Component(mp.Process):
 
         work(self, unit)
 
+    or, for workers declared with 'bulk=True':
+
+        work(self, units)
+
     The method is expected to change the unit state.  Units will not be pushed
     to outgoing channels automatically -- to do so, the work method has to call 
 
@@ -148,6 +165,7 @@ class Component(mp.Process):
         self._publishers    = dict()      # channels to send notifications to
         self._subscribers   = dict()      # callbacks for received notifications
         self._workers       = dict()      # where units get worked upon
+        self._bulk          = dict()      # bulk sizes for bulk workers
         self._idlers        = list()      # idle_callback registry
         self._threads       = list()      # subscriber threads
         self._terminate     = mt.Event()  # signal for thread termination
@@ -394,7 +412,8 @@ class Component(mp.Process):
         addr = self._addr_map[input]['source']
         self._log.debug("using addr %s for input %s" % (addr, input))
 
-        q = rpu_Queue.create(rpu_QUEUE_ZMQ, input, rpu_QUEUE_OUTPUT, addr)
+        q = rpu_Queue.create(rpu_QUEUE_ZMQ, input, rpu_QUEUE_OUTPUT, addr,
+                             serializer=self._cfg.get('serializer'))
         self._inputs.append([q, states])
 
         for state in states:
@@ -438,7 +457,8 @@ class Component(mp.Process):
                 self._log.debug("using addr %s for output %s" % (addr, output))
 
                 # non-final state, ie. we want a queue to push to
-                q = rpu_Queue.create(rpu_QUEUE_ZMQ, output, rpu_QUEUE_INPUT, addr)
+                q = rpu_Queue.create(rpu_QUEUE_ZMQ, output, rpu_QUEUE_INPUT, addr,
+                                     serializer=self._cfg.get('serializer'))
                 self._outputs[state] = q
 
                 self._log.debug('declared output    : %s : %s : %s' \
@@ -447,7 +467,7 @@ class Component(mp.Process):
 
     # --------------------------------------------------------------------------
     #
-    def declare_worker(self, states, worker):
+    def declare_worker(self, states, worker, bulk=False):
         """
         This method will associate a unit state with a specific worker.  Upon
         unit arrival, the unit state will be used to lookup the respective
@@ -459,6 +479,13 @@ class Component(mp.Process):
 
         Worker invokation is synchronous, ie. the main event loop will only
         check for the next unit once the worker method returns.
+
+        If 'bulk' is set, the worker is called with a list of units instead of
+        a single unit.  'bulk' can be an integer to limit the list size, or
+        'True' for at most as many units as configured for the component type
+        in 'component_bulk_size' (default: BULK_SIZE).  Inputs for which all
+        states are handled by bulk workers are then drained in bulks, ie. with
+        one request per list of units.
         """
 
         if not isinstance(states, list):
@@ -472,8 +499,14 @@ class Component(mp.Process):
                         % (self._cname, state, self._workers[state]))
             self._workers[state] = worker
 
-            self._log.debug('declared worker    : %s : %s' \
-                    % (state, worker.__name__))
+            if bulk is True:
+                self._bulk[state] = int(self._cfg.get('component_bulk_size', {})
+                                                 .get(self._ctype, BULK_SIZE))
+            else:
+                self._bulk[state] = int(bulk)
+
+            self._log.debug('declared worker    : %s : %s : %s' \
+                    % (state, worker.__name__, self._bulk[state]))
 
 
 
@@ -488,6 +521,7 @@ class Component(mp.Process):
         self._idlers.append({
             'cb'      : cb,       # call this whenever we are idle
             'last'    : 0.0,      # was never called before
+            'checked' : 0.0,      # was never called before
             'timeout' : timeout}) # call no more often than this many seconds
 
         self._log.debug('declared idler     : %s : %s' % (cb.__name__, timeout))
@@ -512,7 +546,8 @@ class Component(mp.Process):
         addr = self._addr_map[pubsub]['sink']
         self._log.debug("using addr %s for pubsub %s" % (addr, pubsub))
 
-        q = rpu_Pubsub.create(rpu_PUBSUB_ZMQ, pubsub, rpu_PUBSUB_PUB, addr)
+        q = rpu_Pubsub.create(rpu_PUBSUB_ZMQ, pubsub, rpu_PUBSUB_PUB, addr,
+                              serializer=self._cfg.get('serializer'))
         self._publishers[topic].append(q)
 
         self._log.debug('declared publisher : %s : %s : %s' \
@@ -560,7 +595,8 @@ class Component(mp.Process):
         self._log.debug("using addr %s for pubsub %s" % (addr, pubsub))
 
         # create a pubsub subscriber, and subscribe to the given topic
-        q = rpu_Pubsub.create(rpu_PUBSUB_ZMQ, pubsub, rpu_PUBSUB_SUB, addr)
+        q = rpu_Pubsub.create(rpu_PUBSUB_ZMQ, pubsub, rpu_PUBSUB_SUB, addr,
+                              serializer=self._cfg.get('serializer'))
         q.subscribe(topic)
 
         t = mt.Thread(target=_subscriber, args=[q,cb],
@@ -627,79 +663,47 @@ class Component(mp.Process):
                                         % self._cname, state)
 
 
+            # inputs for which all states are handled by bulk workers are
+            # drained in bulks
+            inputs = list()
+            for input, states in self._inputs:
+                bulk = min([self._bulk[state] for state in states])
+                inputs.append([input, states, bulk])
+
             # The main event loop will repeatedly iterate over all input
             # channels, probing 
+            idle = False
             while not self._terminate.is_set():
 
                 # if no ation occurs in this iteration, invoke idle callbacks
                 active = False 
 
-                # FIXME: for the default case where we have only one input
-                #        channel, we can probably use a more efficient method to
-                #        pull for units -- such as blocking recv() (with some
-                #        timeout for eventual shutdown)
-                # FIXME: a simple, 1-unit caching mechanism would likely remove
-                #        the req/res overhead completely (for any non-trivial
-                #        worker).
-                for input, states in self._inputs:
-
-                    # FIXME: the timeouts have a large effect on throughput, but
-                    #        I am not yet sure how best to set them...
-                    unit = input.get_nowait(1000) # timeout in microseconds
-                    if not unit:
-                        continue
+                # If the last iteration was idle, we block on the inputs
+                # instead of spinning -- but only until the next idle callback
+                # is due, and at most for _POLL_TIMEOUT, to notice shutdown.
+                if idle: timeout = self._idle_timeout()
+                else   : timeout = 0.0
 
-                    state = unit['state']
-                    uid   = unit['_id']
+                if not inputs:
+                    time.sleep(timeout)
+                else:
+                    # timeout per input, in ms
+                    timeout = int(timeout * 1000 / len(inputs))
 
-                    # assert that the unit is in an expected state
-                    if state not in states:
-                        self.advance(unit, FAILED, publish=True, push=False)
-                        self._prof.prof(event='failed', msg="unexpected state %s" % state,
-                                uid=unit['_id'], state=unit['state'], logger=self._log.error)
-                        continue
+                for input, states, bulk in inputs:
 
-                    # depending on the queue we got the unit from, we can either
-                    # drop units or clone them to inject new ones
-                    unit = drop_units(self._cfg, unit, self.ctype, 'input', logger=self._log)
-                    if not unit:
-                        self._prof.prof(event='drop', state=state,
-                                uid=uid, msg=input.name)
-                        continue
-
-                    units = clone_units(self._cfg, unit, self.ctype, 'input', logger=self._log)
+                    if bulk:
+                        units = input.get_bulk(bulk, timeout)
+                    else:
+                        unit  = input.get_nowait(timeout)
+                        if unit: units = [unit]
+                        else   : units = None
 
-                    for _unit in units:
+                    if not units:
+                        continue
 
-                        uid = _unit['_id']
+                    if self._handle_units(input, states, bulk, units):
                         active = True
-                        self._prof.prof(event='get', state=state, uid=uid, msg=input.name)
-
-
-                        # check if we have a suitable worker (this should always be
-                        # the case, as per the assertion done before we started the
-                        # main loop.  But, hey... :P
-                        if not state in self._workers:
-                            self._log.error("%s cannot handle state %s: %s" \
-                                    % (self._cname, state, _unit))
-                            continue
-
-                        # we have an acceptable state and a matching worker -- hand
-                        # it over, wait for completion, and then pull for the next
-                        # unit
-                        try:
-                            self._prof.prof(event='work start', state=state, uid=uid)
-                            with self._cb_lock:
-                                self._workers[state](_unit)
-                            self._prof.prof(event='work done ', state=state, uid=uid)
-
-                        except Exception as e:
-                            self.advance(_unit, FAILED, publish=True, push=False)
-                            self._prof.prof(event='failed', msg=str(e), uid=uid, state=state)
-                            self._log.exception("unit %s failed" % uid)
-
-                            if self._exit_on_error:
-                                raise
 
 
                 # if nothing happened, we can call the idle callbacks.  Don't
@@ -711,9 +715,11 @@ class Component(mp.Process):
 
                     for idler in self._idlers:
 
-                        if (now - idler['last']) > idler['timeout']:
+                        if  (now - idler['last'])    > idler['timeout'] \
+                        and (now - idler['checked']) > _IDLE_RETRY:
                         
                             try:
+                                idler['checked'] = now
                                 with self._cb_lock:
                                     if idler['cb']():
                                         # something happend!
@@ -724,9 +730,7 @@ class Component(mp.Process):
                                 if self._exit_on_error:
                                     raise
 
-                if not active:
-                    # FIXME: make configurable
-                    time.sleep(0.1)
+                idle = not active
 
 
         except Exception as e:
@@ -747,6 +751,120 @@ class Component(mp.Process):
             self.stop()
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _idle_timeout(self):
+        """
+        Return the time (in seconds) until the next idle callback is due, but
+        at most _POLL_TIMEOUT.
+        """
+
+        now     = time.time()
+        timeout = _POLL_TIMEOUT
+
+        for idler in self._idlers:
+            due     = max(idler['last']    + idler['timeout'],
+                          idler['checked'] + _IDLE_RETRY)
+            timeout = min(timeout, due - now)
+
+        return max(timeout, 0.0)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _handle_units(self, input, states, bulk, units):
+        """
+        Check, drop and clone the units received from an input, and hand them
+        over to the respective workers -- for bulk inputs as one list of units
+        per state.  Returns True if any unit was handed to a worker.
+        """
+
+        active = False
+        todo   = dict()   # units per state, for bulk workers
+        order  = list()   # order in which states appeared
+
+        for unit in units:
+
+            state = unit['state']
+            uid   = unit['_id']
+
+            # assert that the unit is in an expected state
+            if state not in states:
+                self.advance(unit, FAILED, publish=True, push=False)
+                self._prof.prof(event='failed', msg="unexpected state %s" % state,
+                        uid=unit['_id'], state=unit['state'], logger=self._log.error)
+                continue
+
+            # depending on the queue we got the unit from, we can either
+            # drop units or clone them to inject new ones
+            unit = drop_units(self._cfg, unit, self.ctype, 'input', logger=self._log)
+            if not unit:
+                self._prof.prof(event='drop', state=state,
+                        uid=uid, msg=input.name)
+                continue
+
+            for _unit in clone_units(self._cfg, unit, self.ctype, 'input', logger=self._log):
+
+                uid = _unit['_id']
+                active = True
+                self._prof.prof(event='get', state=state, uid=uid, msg=input.name)
+
+                # check if we have a suitable worker (this should always be
+                # the case, as per the assertion done before we started the
+                # main loop.  But, hey... :P
+                if not state in self._workers:
+                    self._log.error("%s cannot handle state %s: %s" \
+                            % (self._cname, state, _unit))
+                    continue
+
+                if not bulk:
+                    self._work(state, [_unit], bulk)
+                    continue
+
+                if state not in todo:
+                    todo[state] = list()
+                    order.append(state)
+                todo[state].append(_unit)
+
+        for state in order:
+            self._work(state, todo[state], bulk)
+
+        return active
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _work(self, state, units, bulk):
+        """
+        we have an acceptable state and a matching worker -- hand the unit(s)
+        over, and wait for completion
+        """
+
+        if self._prof.enabled:
+            for unit in units:
+                self._prof.prof(event='work start', state=state, uid=unit['_id'])
+
+        try:
+            with self._cb_lock:
+                if bulk: self._workers[state](units)
+                else   : self._workers[state](units[0])
+
+            if self._prof.enabled:
+                for unit in units:
+                    self._prof.prof(event='work done ', state=state, uid=unit['_id'])
+
+        except Exception as e:
+            # we don't know how far the worker got with a bulk, so we fail
+            # all units
+            for unit in units:
+                self.advance(unit, FAILED, publish=True, push=False)
+                self._prof.prof(event='failed', msg=str(e), uid=unit['_id'], state=state)
+                self._log.exception("unit %s failed" % unit['_id'])
+
+            if self._exit_on_error:
+                raise
+
+
     # --------------------------------------------------------------------------
     #
     def advance(self, units, state=None, publish=True, push=False):
@@ -770,7 +888,8 @@ class Component(mp.Process):
             uid = unit['_id']
 
             if state:
-                unit['state'] = state
+                unit['state']           = state
+                unit['state_timestamp'] = timestamp()
                 self._prof.prof('advance', uid=unit['_id'], state=state)
             else:
                 state = unit['state']
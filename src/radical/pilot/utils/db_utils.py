@@ -2,6 +2,7 @@
 import os
 import sys
 import time
+import itertools
 import datetime
 import pymongo
 
@@ -61,67 +62,280 @@ def get_last_session (db) :
 
 
 # ------------------------------------------------------------------------------
-def get_session_docs (db, sid, cache=None, cachedir=None) :
+#
+# The session cache lives in <cachedir>/<sid>/, with one gzipped json file per
+# collection.  Units are stored in chunks of _CACHE_CHUNK docs
+# (unit.<n>.json.gz), in the order they were first seen.  unit.index.json.gz
+# lists [uid, pilot, chunk] for all units in the same order, and meta.json
+# holds the high-water mark: the latest statehistory timestamp seen on any
+# unit.  As all state changes push an entry to the unit's statehistory (see
+# get_updated_compute_units()), a refresh only needs to fetch units with later
+# timestamps.  Once the session is closed, the cache is not refreshed anymore.
+#
+_CACHE_VERSION = 1
+_CACHE_CHUNK   = 10000   # unit docs per chunk file
+_CACHE_MARGIN  = 60.0    # overlap of refreshes, to cover clock skew [s]
+_CACHE_COLLS   = {'session' : '%s',
+                  'pmgr'    : '%s.pm',
+                  'pilot'   : '%s.p',
+                  'umgr'    : '%s.um'}
+
+
+# ------------------------------------------------------------------------------
+#
+def _read_gz (fname) :
+
+    import gzip
+    import json
+
+    with gzip.open (fname, 'rb') as f :
+        return json.loads (f.read ())
+
+
+# ------------------------------------------------------------------------------
+#
+def _write_gz (data, fname) :
+
+    import gzip
+    import json
+
+    # write to a temp file first, so that readers never see partial files
+    tmp = '%s.%d.tmp' % (fname, os.getpid ())
+    with gzip.open (tmp, 'wb', 1) as f :
+        f.write (json.dumps (data))
+    os.rename (tmp, fname)
+
+
+# ------------------------------------------------------------------------------
+#
+def _last_state_time (doc) :
+
+    ret = None
+    for entry in doc.get ('statehistory') or [] :
+        if ret is None or entry['timestamp'] > ret :
+            ret = entry['timestamp']
+    return ret
+
+
+# ------------------------------------------------------------------------------
+#
+def update_session_cache (db, sid, cachedir=None) :
+    """
+    Bring the cache of session 'sid' in 'cachedir' (default: /tmp/rp_cache_<uid>/)
+    up to date, and return its location.  Only units which changed since the
+    last refresh are fetched from the db.  If 'db' is None, the cache is used
+    as is.
+    """
 
-    # session docs may have been cached in /tmp/rp_cache_<uid>/<sid>.json -- in that
-    # case we pull it from there instead of the database, which will be much
-    # quicker.  Also, we do cache any retrieved docs to that place, for later
-    # use.  An optional cachdir parameter changes that default location for
-    # lookup and storage.
     if  not cachedir :
         cachedir = _CACHE_BASEDIR
 
-    if  not cache :
-        cache = "%s/%s.json" % (cachedir, sid)
+    cache = "%s/%s" % (cachedir, sid)
+    mfile = "%s/meta.json" % cache
+    ifile = "%s/unit.index.json.gz" % cache
+
+    meta  = None
+    if  os.path.isfile (mfile) :
+        meta = ru.read_json (mfile)
+        if  meta.get ('version') != _CACHE_VERSION :
+            meta = None
+
+    if  meta and (meta['closed'] or db is None) :
+        return cache
+
+    if  db is None :
+        raise ValueError ('no cache for session %s' % sid)
+
+    if  not os.path.isdir (cache) :
+        os.makedirs (cache)
+
+    cached = bool(meta)
+    if  not meta :
+        meta = {'version' : _CACHE_VERSION,
+                'closed'  : False,
+                'hwm'     : None,
+                'chunks'  : 0}
+
+    # the small collections are fetched as a whole
+    docs = dict()
+    for name, coll in _CACHE_COLLS.iteritems () :
+        docs[name] = bson2json (list(db[coll % sid].find ()))
+
+    if  len(docs['session']) == 0 :
+        if  cached :
+            # the session is gone from the db -- the cache is all we have
+            return cache
+        raise ValueError ('no such session %s' % sid)
+
+    # units are fetched incrementally, and added to the chunks
+    if  meta['hwm'] is None :
+        query = dict()
+    else :
+        query = {'statehistory.timestamp' : {'$gt' : meta['hwm'] - _CACHE_MARGIN}}
+
+    if  os.path.isfile (ifile) : index = _read_gz (ifile)
+    else                       : index = list()
+
+    positions = dict()  # uid -> position in index
+    for pos, entry in enumerate (index) :
+        positions[entry[0]] = pos
+
+    updates = dict()    # chunk -> {uid : doc}
+    new     = list()    # docs for new chunks
+    changed = False     # index changed
+    hwm     = meta['hwm']
+    n_last  = len(index) - (meta['chunks'] - 1) * _CACHE_CHUNK
+
+    # ----------------------------------------------------------------------
+    def _flush_new () :
+        # write out the new units which make up a complete chunk
+        if  new :
+            _write_gz (new, "%s/unit.%05d.json.gz" % (cache, meta['chunks']))
+            meta['chunks'] += 1
+            del(new[:])
+    # ----------------------------------------------------------------------
+
+    # fill up the last existing chunk first
+    if  meta['chunks'] and n_last < _CACHE_CHUNK :
+        meta['chunks'] -= 1
+        new.extend (_read_gz ("%s/unit.%05d.json.gz" % (cache, meta['chunks'])))
+
+    cursor = db["%s.cu" % sid].find (query)
+    while True :
+
+        batch = list(itertools.islice (cursor, _CACHE_CHUNK))
+        if  not batch :
+            break
+
+        changed = True
+        for doc in bson2json (batch) :
+
+            uid  = str(doc['_id'])
+            last = _last_state_time (doc)
+            if  last is not None and (hwm is None or last > hwm) :
+                hwm = last
+
+            pos = positions.get (uid)
+            if  pos is None :
+                # new unit
+                positions[uid] = len(index)
+                index.append ([uid, doc.get ('pilot'), meta['chunks']])
+                new.append (doc)
+                if  len(new) >= _CACHE_CHUNK :
+                    _flush_new ()
+
+            else :
+                index[pos][1] = doc.get ('pilot')
+                chunk         = index[pos][2]
+                if  chunk == meta['chunks'] :
+                    # still in the list of new units
+                    new[pos - chunk * _CACHE_CHUNK] = doc
+                else :
+                    updates.setdefault (chunk, dict())[uid] = doc
+
+    _flush_new ()
+
+    # apply updates to existing chunks
+    for chunk, chunk_docs in updates.iteritems () :
+        cfile = "%s/unit.%05d.json.gz" % (cache, chunk)
+        units = _read_gz (cfile)
+        for idx, doc in enumerate (units) :
+            if  str(doc['_id']) in chunk_docs :
+                units[idx] = chunk_docs[str(doc['_id'])]
+        _write_gz (units, cfile)
+
+    for name in docs :
+        _write_gz (docs[name], "%s/%s.json.gz" % (cache, name))
+
+    if  changed :
+        _write_gz (index, ifile)
+
+    # the session doc gets 'closed' set when the session is closed -- any
+    # refresh after that is final
+    meta['closed'] = bool(docs['session'][0].get ('closed'))
+    meta['hwm']    = hwm
+    ru.write_json (meta, mfile)
+
+    return cache
 
-    try :
-        if  os.path.isfile (cache) :
-            return ru.read_json (cache)
-    except Exception as e :
-        # continue w/o cache
-        sys.stderr.write ("warning: cannot read session cache at %s (%s)\n" % (cache, e))
 
+# ------------------------------------------------------------------------------
+#
+def iter_session_units (sid, cachedir=None) :
+    """
+    Lazily iterate over the unit docs in the cache of session 'sid' (see
+    update_session_cache()), one chunk file at a time.
+    """
 
-    # cache not used or not found -- go to db
-    json_data = dict()
+    if  not cachedir :
+        cachedir = _CACHE_BASEDIR
 
-    # convert bson to json, i.e. serialize the ObjectIDs into strings.
-    json_data['session'] = bson2json (list(db["%s"    % sid].find ()))
-    json_data['pmgr'   ] = bson2json (list(db["%s.pm" % sid].find ()))
-    json_data['pilot'  ] = bson2json (list(db["%s.p"  % sid].find ()))
-    json_data['umgr'   ] = bson2json (list(db["%s.um" % sid].find ()))
-    json_data['unit'   ] = bson2json (list(db["%s.cu" % sid].find ()))
+    cache = "%s/%s" % (cachedir, sid)
+    meta  = ru.read_json ("%s/meta.json" % cache)
 
-    if  len(json_data['session']) == 0 :
-        raise ValueError ('no such session %s' % sid)
+    for chunk in range (meta['chunks']) :
+        for doc in _read_gz ("%s/unit.%05d.json.gz" % (cache, chunk)) :
+            yield doc
 
-  # if  len(json_data['session']) > 1 :
-  #     print 'more than one session document -- picking first one'
+
+# ------------------------------------------------------------------------------
+#
+def open_session_docs (db, sid, cache=None, cachedir=None) :
+    """
+    Like get_session_docs(), but returns a tuple (docs, units), where 'docs'
+    contains all but the unit docs, and 'units' lazily iterates over those.
+    """
+
+    # an explicitly given cache file is read as a whole (as written by
+    # fetch_json())
+    if  cache and os.path.isfile (cache) :
+        docs = ru.read_json (cache)
+        return docs, iter(docs.pop ('unit'))
+
+    if  not cachedir :
+        cachedir = _CACHE_BASEDIR
+
+    try :
+        location = update_session_cache (db, sid, cachedir)
+    except ValueError :
+        raise
+    except Exception as e :
+        # continue with whatever is cached
+        sys.stderr.write ("warning: cannot update session cache for %s (%s)\n" % (sid, e))
+        location = update_session_cache (None, sid, cachedir)
+
+    docs = dict()
+    for name in _CACHE_COLLS :
+        docs[name] = _read_gz ("%s/%s.json.gz" % (location, name))
 
     # there can only be one session, not a list of one
-    json_data['session'] = json_data['session'][0]
+    docs['session'] = docs['session'][0]
 
     # we want to add a list of handled units to each pilot doc
-    for pilot in json_data['pilot'] :
+    unit_ids = dict()
+    for uid, pid, _ in _read_gz ("%s/unit.index.json.gz" % location) :
+        unit_ids.setdefault (pid, list()).append (uid)
 
-        pilot['unit_ids'] = list()
+    for pilot in docs['pilot'] :
+        pilot['unit_ids'] = unit_ids.get (str(pilot['_id']), list())
 
-        for unit in json_data['unit'] :
+    return docs, iter_session_units (sid, cachedir)
 
-            if  unit['pilot'] == str(pilot['_id']) :
-                pilot['unit_ids'].append (str(unit['_id']))
 
-    # if we got here, we did not find a cached version -- thus add this dataset
-    # to the cache
-    try :
-        os.system ('mkdir -p %s' % cachedir)
-        ru.write_json (json_data, "%s/%s.json" % (cachedir, sid))
-    except Exception as e :
-        # we can live without cache, no problem...
-        pass
+# ------------------------------------------------------------------------------
+def get_session_docs (db, sid, cache=None, cachedir=None) :
+
+    # session docs are cached in /tmp/rp_cache_<uid>/<sid>/ (see
+    # update_session_cache()), and are pulled from there instead of the
+    # database, which will be much quicker.  Only units which changed since
+    # are fetched from the db.  An optional cachdir parameter changes that
+    # default location for lookup and storage, an optional cache parameter
+    # names a json file to use instead.
 
-    return json_data
+    docs, units = open_session_docs (db, sid, cache, cachedir)
+    docs['unit'] = list(units)
 
+    return docs
 
 
 # ------------------------------------------------------------------------------
@@ -135,9 +349,10 @@ def get_session_slothist (db, sid, cache=None, cachedir=None) :
       tuple (string  , list (tuple (string  , int    ) ), list (tuple (string   , datetime ) ) )
     """
 
-    docs = get_session_docs (db, sid, cache, cachedir)
+    docs, units = open_session_docs (db, sid, cache, cachedir)
 
-    ret = dict()
+    ret   = dict()
+    slots = dict()  # pilot id -> [slot_infos, slot_started]
 
     for pilot_doc in docs['pilot'] :
 
@@ -160,30 +375,45 @@ def get_session_slothist (db, sid, cache=None, cachedir=None) :
                 slot_infos  [slot_name] = list()
                 slot_started[slot_name] = sys.maxint
 
-        for unit_doc in docs['unit'] :
-            if unit_doc['pilot'] == pilot_doc['_id'] :
-
-                started  = None
-                finished = None
-                for event in sorted (unit_doc['statehistory'], 
-                                     key=lambda x: x['timestamp']) :
-                    if started :
-                        finished = event['timestamp']
-                        break
-                    if event['state'] == EXECUTING :
-                        started = event['timestamp']
-
-                if not started or not finished :
-                  # print "no start/finish for cu %s - ignored" % unit_doc['_id']
-                    continue
-
-                for slot_id in unit_doc['slots'] :
-                    if slot_id not in slot_infos :
-                      # print "slot %s for pilot %s unknown - ignored" % (slot_id, pilot_id)
-                        continue
-                    
-                    slot_infos[slot_id].append([started, finished])
-                    slot_started[slot_id] = min(started, slot_started[slot_id])
+        slots[pilot_id] = [slot_infos, slot_started]
+
+        ret[pilot_id] = dict()
+        ret[pilot_id]['started']    = pilot_doc['started']
+        ret[pilot_id]['finished']   = pilot_doc['finished']
+        ret[pilot_id]['slots']      = slot_names
+        ret[pilot_id]['slot_infos'] = slot_infos
+
+    # a single pass over all units, which get assigned to their pilots
+    for unit_doc in units :
+
+        if unit_doc['pilot'] not in slots :
+            continue
+
+        slot_infos, slot_started = slots[unit_doc['pilot']]
+
+        started  = None
+        finished = None
+        for event in sorted (unit_doc['statehistory'], 
+                             key=lambda x: x['timestamp']) :
+            if started :
+                finished = event['timestamp']
+                break
+            if event['state'] == EXECUTING :
+                started = event['timestamp']
+
+        if not started or not finished :
+          # print "no start/finish for cu %s - ignored" % unit_doc['_id']
+            continue
+
+        for slot_id in unit_doc['slots'] :
+            if slot_id not in slot_infos :
+              # print "slot %s for pilot %s unknown - ignored" % (slot_id, pilot_id)
+                continue
+            
+            slot_infos[slot_id].append([started, finished])
+            slot_started[slot_id] = min(started, slot_started[slot_id])
+
+    for pilot_id, [slot_infos, slot_started] in slots.iteritems () :
 
         for slot_id in slot_infos :
             slot_infos[slot_id].sort(key=lambda x: float(x[0]))
@@ -191,13 +421,7 @@ def get_session_slothist (db, sid, cache=None, cachedir=None) :
         # we use the startup time to sort the slot names, as that gives a nicer
         # representation when plotting.  That sorting should probably move to
         # the plotting tools though... (FIXME)
-        slot_names.sort (key=lambda x: slot_started[x])
-
-        ret[pilot_id] = dict()
-        ret[pilot_id]['started']    = pilot_doc['started']
-        ret[pilot_id]['finished']   = pilot_doc['finished']
-        ret[pilot_id]['slots']      = slot_names
-        ret[pilot_id]['slot_infos'] = slot_infos
+        ret[pilot_id]['slots'].sort (key=lambda x: slot_started[x])
 
     return ret
 
@@ -213,7 +437,7 @@ def get_session_events (db, sid, cache=None, cachedir=None) :
       
     """
 
-    docs = get_session_docs (db, sid, cache, cachedir)
+    docs, units = open_session_docs (db, sid, cache, cachedir)
 
     ret = list()
 
@@ -246,7 +470,7 @@ def get_session_events (db, sid, cache=None, cachedir=None) :
                 ret.append (['callback',  otype, oid, oid, event['timestamp'], event['state'], odoc])
 
 
-    for doc in docs['unit'] :
+    for doc in units :
         odoc  = dict()
         otype = 'unit'
         oid   = str(doc['_id'])
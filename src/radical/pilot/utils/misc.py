@@ -30,6 +30,53 @@ def tail(txt, maxlen=MAX_IO_LOGLENGTH):
         return txt
 
 
+# ------------------------------------------------------------------------------
+#
+def tail_file(fname, maxlen=MAX_IO_LOGLENGTH, full=False):
+    """
+    Return a tuple of (text, size, lines) for the given utf-8 encoded file:
+    its content shortened as by tail(), its size in bytes, and its number of
+    lines.  Only the end of the file is decoded (and kept in memory), unless
+    'full' is set, in which case the complete content is returned unshortened.
+    Raises UnicodeDecodeError on binary content.
+    """
+
+    chunk = 1024 * 1024
+
+    with open(fname, 'rb') as f:
+
+        if full:
+            data = f.read()
+            return unicode(data, 'utf-8'), len(data), data.count('\n')
+
+        # a utf-8 character has at most 4 bytes, and we may need to skip up to
+        # 3 bytes of a partial character at the start
+        size   = os.fstat(f.fileno()).st_size
+        nbytes = min(size, 4 * maxlen + 3)
+
+        lines  = 0
+        while True:
+            data = f.read(chunk)
+            if not data:
+                break
+            lines += data.count('\n')
+
+        f.seek(size - nbytes)
+        data = f.read(nbytes)
+
+    if nbytes == size:
+        return tail(unicode(data, 'utf-8'), maxlen), size, lines
+
+    # don't start decoding in the middle of a character (the file has more
+    # than maxlen characters, so it is shortened in any case)
+    start = 0
+    while start < 3 and (ord(data[start]) & 0xC0) == 0x80:
+        start += 1
+
+    txt = unicode(data[start:], 'utf-8')
+    return "[... CONTENT SHORTENED ...]\n%s" % txt[-maxlen:], size, lines
+
+
 # ------------------------------------------------------------------------------
 #
 def get_rusage():
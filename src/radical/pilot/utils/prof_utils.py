@@ -1,13 +1,61 @@
 import os
 import csv
 import copy
+import json
 import time
+import heapq
+import struct
+import cPickle
+import tempfile
+import itertools
 import threading
+import collections
 
 
 # ------------------------------------------------------------------------------
 #
 _prof_fields  = ['time', 'name', 'uid', 'state', 'event', 'msg']
+
+
+# ------------------------------------------------------------------------------
+#
+# binary profile format (RADICAL_PILOT_PROFILE_FORMAT=binary)
+#
+# A binary profile starts with a magic string and a NAME record (the profiler
+# name), followed by DEF and EVENT records.  DEF records bind a string to an
+# integer id, EVENT records refer to those ids for thread name, uid, state,
+# event and message, and to id 0 for empty fields.  A DEF record always
+# precedes the first EVENT record using its id.  When a profile is appended to,
+# a new magic string and NAME record start a new id table.
+#
+# As the id tables are per process, a binary profile is never shared between
+# processes: a process which opens a profile name that was opened before fork
+# (by its parent) writes to '<name>.<pid>.prof' instead.
+#
+#   NAME  : tag, 0,  len, <len bytes>
+#   DEF   : tag, id, len, <len bytes>
+#   EVENT : tag, time, tid, uid, state, event, msg
+#
+PROF_FORMAT_CSV    = 'csv'
+PROF_FORMAT_BINARY = 'binary'
+
+_BIN_MAGIC     = 'RPPROF\x00\x01'
+_BIN_DEF       = struct.Struct('<BIH')
+_BIN_EVENT     = struct.Struct('<BdIIIII')
+_BIN_TAG_NAME  = 0
+_BIN_TAG_DEF   = 1
+_BIN_TAG_EVENT = 2
+
+_BIN_BUFSIZE   = 1024 * 1024   # size of the record buffer
+_BIN_STRINGS   = 64 * 1024     # strings to intern before the table is reset
+_BIN_BACKLOG   = 256 * 1024    # queued events which trigger an inline flush
+_BIN_FLUSH     = 1.0           # interval of the background flusher
+
+_MERGE_CHUNK   = 64 * 1024     # rows per chunk when spilling / writing columns
+
+_bin_owners    = dict()        # binary profile name : pid of the writer
+
+
 # ------------------------------------------------------------------------------
 #
 # profile class
@@ -18,6 +66,14 @@ class Profiler (object):
     (prof()) of writing lines with timestamp and events to that file.  Any
     profiling intelligence is applied when reading and evaluating the created
     profiles.
+
+    If RADICAL_PILOT_PROFILE_FORMAT is set to 'binary', prof() only queues the
+    event.  A background thread packs the queued events once per second into
+    fixed size records in a preallocated buffer, with all strings interned to
+    integer ids, and writes them out (the calling thread does so if the queue
+    grows too long).  Use convert_profile() or radicalpilot-prof2csv to turn
+    such profiles into the CSV format -- read_profile() and combine_profiles()
+    understand both formats.
     """
 
     # --------------------------------------------------------------------------
@@ -38,7 +94,20 @@ class Profiler (object):
 
         self._ts_zero, self._ts_abs, self._ts_mode = self._timestamp_init()
 
-        self._name  = name
+        self._name   = name
+        self._format = os.environ.get('RADICAL_PILOT_PROFILE_FORMAT',
+                                      PROF_FORMAT_CSV)
+
+        sync_msg = "%s:%s:%s:%s" % (time.time(), self._ts_zero,
+                                    self._ts_abs, self._ts_mode)
+
+        if self._format == PROF_FORMAT_BINARY:
+            self._init_binary(sync_msg)
+            return
+
+        if self._format != PROF_FORMAT_CSV:
+            raise ValueError('invalid profile format %s' % self._format)
+
         self._handle = open("%s.prof"  % self._name, 'a')
 
         # write header and time normalization info
@@ -46,9 +115,7 @@ class Profiler (object):
         #       and downstream analysis tools too!
         self._handle.write("#time,name,uid,state,event,msg\n")
         self._handle.write("%.4f,%s:%s,%s,%s,%s,%s\n" % \
-                           (0.0, self._name, "", "", "", 'sync abs',
-                            "%s:%s:%s:%s" % (time.time(), self._ts_zero, 
-                                             self._ts_abs, self._ts_mode)))
+                           (0.0, self._name, "", "", "", 'sync abs', sync_msg))
 
 
     # ------------------------------------------------------------------------------
@@ -64,6 +131,8 @@ class Profiler (object):
     def flush(self):
 
         if self._enabled:
+            if self._format == PROF_FORMAT_BINARY:
+                self._flush_binary()
             self._handle.flush()
 
 
@@ -102,6 +171,171 @@ class Profiler (object):
                 % (timestamp, self._name, tid, uid, state, event, msg))
 
 
+    # --------------------------------------------------------------------------
+    #
+    def _init_binary(self, sync_msg):
+
+        self._queue   = collections.deque()  # events not yet packed
+        self._local   = threading.local()    # caches the thread names
+        self._io_lock = threading.Lock()     # guards buffer, ids and handle
+        self._buf     = bytearray(_BIN_BUFSIZE)
+        self._ids     = {'' : 0, None : 0}
+        self._next    = 1
+
+        # the parent keeps the profile it opened before fork (see above)
+        pid = os.getpid()
+        if _bin_owners.setdefault(self._name, pid) == pid:
+            fname = "%s.prof" % self._name
+        else:
+            fname = "%s.%d.prof" % (self._name, pid)
+
+        self._handle  = open(fname, 'ab')
+        self._handle.write(_BIN_MAGIC)
+        self._handle.write(_BIN_DEF.pack(_BIN_TAG_NAME, 0, len(self._name)))
+        self._handle.write(self._name)
+
+        self._queue.append((0.0, '', '', '', 'sync abs', sync_msg))
+        self._flush_binary()
+        self._handle.flush()
+
+        # prof() now queues events instead of writing lines
+        self.prof = self._prof_binary
+
+        self._flusher = threading.Thread(target=self._flusher_binary,
+                                         name='%s.prof' % self._name)
+        self._flusher.daemon = True
+        self._flusher.start()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _prof_binary(self, event, uid=None, state=None, msg=None,
+                     timestamp=None, logger=None):
+
+        # This only timestamps the event and queues it (deque.append is thread
+        # safe) -- interning and packing is left to the flusher thread.
+
+        if logger:
+            logger("%s (%10s%s) : %s", event, uid, state, msg)
+
+        if timestamp != None:
+            if timestamp > (100 * 1000 * 1000):
+                # absolute timestamp (see prof())
+                timestamp = timestamp - self._ts_zero
+        else:
+            timestamp = time.time() - self._ts_zero
+
+        try:
+            tid = self._local.tid
+        except AttributeError:
+            tid = self._local.tid = threading.current_thread().name
+
+        self._queue.append((timestamp, tid, uid, state, event, msg))
+
+        # don't let the queue grow unbounded if the flusher falls behind
+        if len(self._queue) > _BIN_BACKLOG:
+            self._flush_binary()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _flush_binary(self):
+
+        # pack all queued events into the record buffer, and write it out
+        # whenever it fills up, and at the end.
+
+        with self._io_lock:
+
+            queue  = self._queue
+            buf    = self._buf
+            pos    = 0
+            pack   = _BIN_EVENT.pack_into
+            n_evt  = _BIN_EVENT.size
+            limit  = _BIN_BUFSIZE - n_evt - 5 * (_BIN_DEF.size + 0xffff)
+
+            # only consume what is queued right now
+            for _ in xrange(len(queue)):
+
+                rec = queue.popleft()
+                ids = self._ids
+
+                try:
+                    pack(buf, pos, _BIN_TAG_EVENT, rec[0], ids[rec[1]],
+                         ids[rec[2]], ids[rec[3]], ids[rec[4]], ids[rec[5]])
+                except (KeyError, TypeError):
+                    # some strings are new: intern them first
+                    rids = list()
+                    for val in rec[1:]:
+                        sid, pos = self._intern(val, pos)
+                        rids.append(sid)
+                    pack(buf, pos, _BIN_TAG_EVENT, rec[0], *rids)
+
+                pos += n_evt
+
+                # leave enough room for the next event and its definitions
+                if pos > limit:
+                    self._handle.write(buffer(buf, 0, pos))
+                    pos = 0
+
+            if pos:
+                self._handle.write(buffer(buf, 0, pos))
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _intern(self, val, pos):
+
+        # return the id for val, and the new buffer position.  A new id gets
+        # a DEF record at pos.  Called with self._io_lock held.
+
+        if not val:
+            return 0, pos
+
+        try:
+            sid = self._ids.get(val)
+        except TypeError:
+            # unhashable message
+            val = str(val)
+            sid = self._ids.get(val)
+
+        if sid is not None:
+            return sid, pos
+
+        if isinstance(val, unicode): data = val.encode('utf-8')
+        else                       : data = str(val)
+        data = data[:0xffff]
+
+        # to keep the table bounded (uids don't repeat much), it is reset
+        # when full.  Ids are never reused, so older records remain valid.
+        if len(self._ids) >= _BIN_STRINGS:
+            self._ids = {'' : 0, None : 0}
+
+        sid             = self._next
+        self._next      = sid + 1
+        self._ids[val]  = sid
+
+        _BIN_DEF.pack_into(self._buf, pos, _BIN_TAG_DEF, sid, len(data))
+        pos += _BIN_DEF.size
+        self._buf[pos:pos + len(data)] = data
+
+        return sid, pos + len(data)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _flusher_binary(self):
+
+        try:
+            while True:
+                time.sleep(_BIN_FLUSH)
+                self._flush_binary()
+                self._handle.flush()
+
+        except Exception:
+            # the handle got closed, or the interpreter shuts down
+            pass
+
+
     # --------------------------------------------------------------------------
     #
     def _timestamp_init(self):
@@ -137,6 +371,154 @@ class Profiler (object):
         return float(time.time()) - self._ts_zero
 
 
+# ------------------------------------------------------------------------------
+#
+def _iter_binary(fname):
+
+    # lazily parse a binary profile (see Profiler) into row tuples
+    # (time, name, uid, state, event, msg).  None is yielded where a new
+    # header starts.
+
+    n_def = _BIN_DEF.size
+    n_evt = _BIN_EVENT.size
+    n_mag = len(_BIN_MAGIC)
+
+    strs  = {0 : ''}
+    name  = ''
+
+    with open(fname, 'rb') as f:
+
+        data = ''
+        pos  = 0
+
+        while True:
+
+            # make sure that any complete record at pos is in data
+            if len(data) - pos < n_def + 0xffff:
+                data = data[pos:] + f.read(_BIN_BUFSIZE)
+                pos  = 0
+                if not data:
+                    break
+
+            end = len(data)
+            tag = ord(data[pos])
+
+            if tag == _BIN_TAG_EVENT:
+                if pos + n_evt > end:
+                    break  # truncated
+                _, t, tid, uid, state, event, msg = _BIN_EVENT.unpack_from(data, pos)
+                pos += n_evt
+                yield (t, '%s:%s' % (name, strs[tid]), strs[uid], strs[state],
+                       strs[event], strs[msg])
+
+            elif tag in [_BIN_TAG_DEF, _BIN_TAG_NAME]:
+                if pos + n_def > end:
+                    break
+                _, sid, size = _BIN_DEF.unpack_from(data, pos)
+                if pos + n_def + size > end:
+                    break
+                string = data[pos + n_def:pos + n_def + size]
+                pos   += n_def + size
+                if tag == _BIN_TAG_NAME: name      = string
+                else                   : strs[sid] = string
+
+            elif data.startswith(_BIN_MAGIC, pos):
+                # the profile was re-opened: start a new id table
+                strs = {0 : ''}
+                pos += n_mag
+                yield None
+
+            else:
+                raise ValueError('%s: invalid record' % fname)
+
+
+# ------------------------------------------------------------------------------
+#
+def _iter_csv(fname):
+
+    # lazily parse a CSV profile into row tuples, like _iter_binary.
+
+    n = len(_prof_fields)
+    with open(fname, 'r') as csvfile:
+        for row in csv.reader(csvfile):
+            if not row:
+                continue
+            if row[0].startswith('#'):
+                yield None
+                continue
+            if len(row) < n:
+                row += [None] * (n - len(row))
+            row[0] = float(row[0])
+            yield tuple(row[:n])
+
+
+# ------------------------------------------------------------------------------
+#
+def is_binary_profile(fname):
+    """
+    Check if the given profile was written in the binary format.
+    """
+
+    with open(fname, 'rb') as f:
+        return f.read(len(_BIN_MAGIC)) == _BIN_MAGIC
+
+
+# ------------------------------------------------------------------------------
+#
+def _iter_rows(fname):
+
+    if is_binary_profile(fname): return _iter_binary(fname)
+    else                       : return _iter_csv(fname)
+
+
+# ------------------------------------------------------------------------------
+#
+def read_profile(fname):
+    """
+    Read a profile in CSV or binary format, and return a list of dicts with the
+    fields 'time' (as float), 'name', 'uid', 'state', 'event' and 'msg'.
+    Header lines are skipped.
+    """
+
+    return [dict(zip(_prof_fields, row)) for row in _iter_rows(fname) if row]
+
+
+# ------------------------------------------------------------------------------
+#
+def convert_profile(src, tgt=None):
+    """
+    Convert a binary profile into the CSV format written by the Profiler by
+    default.  If 'tgt' is not given, the profile is converted in place.
+    Returns False if 'src' is not a binary profile (which is then left alone),
+    True otherwise.
+    """
+
+    if not is_binary_profile(src):
+        return False
+
+    if not tgt:
+        tgt = src
+
+    tmp = '%s.%d.tmp' % (tgt, os.getpid())
+    with open(tmp, 'w') as out:
+        _write_csv(src, out)
+
+    os.rename(tmp, tgt)
+    return True
+
+
+# ------------------------------------------------------------------------------
+#
+def _write_csv(src, out):
+
+    # write the binary profile 'src' as CSV to the file object 'out'
+    for row in _iter_binary(src):
+        if not row:
+            out.write("#time,name,uid,state,event,msg\n")
+            continue
+        out.write("%.4f,%s,%s,%s,%s,%s\n" % row)
+
+
 # --------------------------------------------------------------------------
 #
 def timestamp():
@@ -147,14 +529,18 @@ def timestamp():
 #
 def prof2frame(prof):
     """
-    expect a profile, ie. a list of profile rows which are dicts.  
-    Write that profile to a temp csv and let pandas parse it into a frame.
+    expect a profile, ie. a list of profile rows which are dicts, or the name
+    of a directory written by write_profile_columns(), and let pandas parse it
+    into a frame.
     """
 
     import pandas as pd
 
-    # create data frame from profile dicts
-    frame = pd.DataFrame(prof)
+    # create data frame from profile dicts or columns
+    if isinstance(prof, basestring):
+        frame = read_profile_columns(prof)
+    else:
+        frame = pd.DataFrame(prof)
 
     # --------------------------------------------------------------------------
     # add a flag to indicate entity type
@@ -238,19 +624,280 @@ def get_experiment_frames(experiments, datadir=None):
             import glob
             for prof in glob.glob ("%s/%s-pilot.*.prof" % (datadir, sid)):
                 print "     - %s" % prof
-                frame = pd.read_csv(prof)
+                if is_binary_profile(prof):
+                    import StringIO
+                    buf = StringIO.StringIO()
+                    _write_csv(prof, buf)
+                    buf.seek(0)
+                    frame = pd.read_csv(buf)
+                else:
+                    frame = pd.read_csv(prof)
                 exp_frames[exp].append ([frame, label])
                 
     return exp_frames
 
 
+# ------------------------------------------------------------------------------
+#
+def _scan_profiles(profiles):
+
+    # First pass over all profiles, without keeping any rows: find the time
+    # offset (relative to epoch) of each profile from its sync events (see
+    # combine_profiles()), and count rows and check ordering on the way.
+    # Returns a dict of {prof : [offset, t_min, n_rows, is_sorted]} for all
+    # profiles which can be synced.
+
+    info   = dict()
+    rd_abs = dict()  # prof : [t_rel, t_stamp, t_zero, t_abs, ...]
+    rd_rel = dict()  # prof : [t_rel, msg]
+    refs   = dict()  # msg  : [prof, time] of 'sync ref' events
+
+    for prof in profiles:
+
+        tref   = None
+        n      = 0
+        t_min  = None
+        t_last = None
+        srt    = True
+
+        for row in _iter_rows(prof):
+
+            if not row:
+                continue
+
+            t  = row[0]
+            n += 1
+
+            if t_last is not None and t < t_last:
+                srt = False
+            if t_min is None or t < t_min:
+                t_min = t
+            t_last = t
+
+            event = row[4]
+
+            # find first tref
+            if not tref:
+                if event == 'sync rel':
+                    tref = 'rel'
+                    rd_rel[prof] = [t, row[5]]
+                elif event == 'sync abs':
+                    tref = 'abs'
+                    rd_abs[prof] = [t] + row[5].split(':')
+
+            if event == 'sync ref' and row[5] not in refs:
+                refs[row[5]] = [prof, t]
+
+        if tref:
+            info[prof] = [None, t_min, n, srt]
+        elif n:
+            print 'WARNING: skipping profile %s (no sync)' % prof
+
+    # the profile created an entry t_rel at t_abs.  The offset is thus
+    # t_abs - t_rel, and all timestamps in the profile need to be corrected by
+    # that to get absolute time
+    for prof, ref in rd_abs.iteritems():
+        info[prof][0] = float(ref[3]) - float(ref[0])
+
+    # a 'sync rel' message was created at time t_rel, at the same time as the
+    # referenced 'sync ref' event in an absolute profile, so all timestamps
+    # in the profile need to be corrected by (t_ref - t_rel)
+    for prof, ref in rd_rel.iteritems():
+
+        t_rel, t_msg = ref
+        t_ref        = None
+
+        if t_msg in refs:
+            ref_prof, ref_t = refs[t_msg]
+            if ref_prof in rd_abs:
+                t_ref = ref_t + info[ref_prof][0]
+
+        if t_ref is None:
+            print "WARNING: 'sync rel' reference not found %s" % prof
+            del(info[prof])
+            continue
+
+        info[prof][0] = t_ref - t_rel
+
+    return info
+
+
+# ------------------------------------------------------------------------------
+#
+def _iter_shifted(prof, t_off, t_min, srt):
+
+    # yield the rows of the given profile in time order, with all timestamps
+    # corrected by t_off, and made relative to t_min.  Unsorted profiles are
+    # sorted in memory, one at a time, and spilled to a temporary file, so
+    # that at most one of them is held in memory.
+
+    if srt:
+        for row in _iter_rows(prof):
+            if row:
+                yield (row[0] + t_off - t_min,) + row[1:]
+        return
+
+    rows = [row for row in _iter_rows(prof) if row]
+    rows.sort(key=lambda row: row[0])
+
+    spill = tempfile.TemporaryFile()
+    for start in xrange(0, len(rows), _MERGE_CHUNK):
+        cPickle.dump(rows[start:start + _MERGE_CHUNK], spill, 2)
+    del(rows)
+
+    spill.seek(0)
+    try:
+        while True:
+            try:
+                chunk = cPickle.load(spill)
+            except EOFError:
+                break
+            for row in chunk:
+                yield (row[0] + t_off - t_min,) + row[1:]
+    finally:
+        spill.close()
+
+
+# ------------------------------------------------------------------------------
+#
+def _merge_profiles(profiles):
+
+    # return the number of rows and an iterator over the time ordered rows
+    # (as tuples) of all given profiles -- see iter_profiles().
+
+    info = _scan_profiles(profiles)
+
+    if not info:
+        return 0, iter([])
+
+    # find the smallest time over all profiles
+    t_min = min([i[0] + i[1] for i in info.itervalues()])
+    n     = sum([i[2]        for i in info.itervalues()])
+
+    streams = [_iter_shifted(prof, i[0], t_min, i[3])
+               for prof, i in info.iteritems()]
+
+    return n, heapq.merge(*streams)
+
+
+# ------------------------------------------------------------------------------
+#
+def iter_profiles(profiles):
+    """
+    This is the streaming version of combine_profiles(): it yields the same
+    rows, in time order, but never holds more than one profile in memory.
+    Profiles are parsed lazily, with the sync offset applied on the fly, and
+    merged with a k-way heap merge.  Profiles which are not time ordered
+    (events may be recorded with earlier timestamps) are sorted and spilled to
+    a temporary file first.
+    """
+
+    n, rows = _merge_profiles(profiles)
+    for row in rows:
+        yield dict(zip(_prof_fields, row))
+
+
+# ------------------------------------------------------------------------------
+#
+def write_profile_columns(profiles, target):
+    """
+    Combine the given profiles like iter_profiles(), and write the result into
+    the directory 'target', in columnar form: the 'time' column as float64
+    numpy array, all other columns as int32 numpy arrays of codes into a list
+    of categories (stored in 'columns.json').  All arrays are written through
+    memory maps, and are read back by read_profile_columns() and prof2frame().
+    Returns the number of rows written.
+    """
+
+    import numpy as np
+
+    n, rows = _merge_profiles(profiles)
+
+    if not os.path.isdir(target):
+        os.makedirs(target)
+
+    cols = [np.lib.format.open_memmap('%s/%s.npy' % (target, field), mode='w+',
+                                      dtype=np.float64 if field == 'time'
+                                                       else np.int32,
+                                      shape=(n,))
+            for field in _prof_fields]
+
+    cats = [dict() for _ in _prof_fields]
+    idx  = 0
+
+    while True:
+
+        chunk = list(itertools.islice(rows, _MERGE_CHUNK))
+        if not chunk:
+            break
+
+        end = idx + len(chunk)
+        cols[0][idx:end] = [row[0] for row in chunk]
+
+        for c in range(1, len(_prof_fields)):
+            codes = cats[c]
+            vals  = list()
+            for row in chunk:
+                val  = row[c] or ''
+                code = codes.get(val)
+                if code is None:
+                    code = codes[val] = len(codes)
+                vals.append(code)
+            cols[c][idx:end] = vals
+
+        idx = end
+
+    for col in cols:
+        col.flush()
+
+    meta = {'rows'       : idx,
+            'categories' : dict()}
+    for c in range(1, len(_prof_fields)):
+        names = [None] * len(cats[c])
+        for val, code in cats[c].iteritems():
+            names[code] = val
+        meta['categories'][_prof_fields[c]] = names
+
+    with open('%s/columns.json' % target, 'w') as f:
+        json.dump(meta, f)
+
+    return idx
+
+
+# ------------------------------------------------------------------------------
+#
+def read_profile_columns(source):
+    """
+    Create a data frame from a profile directory written by
+    write_profile_columns().  The column arrays are memory mapped, and the
+    string columns become categoricals.
+    """
+
+    import numpy  as np
+    import pandas as pd
+
+    with open('%s/columns.json' % source, 'r') as f:
+        meta = json.load(f)
+
+    data = dict()
+    for field in _prof_fields:
+        col = np.load('%s/%s.npy' % (source, field), mmap_mode='r')
+        if field == 'time':
+            data[field] = col
+        else:
+            data[field] = pd.Categorical.from_codes(col,
+                                          meta['categories'][field])
+
+    return pd.DataFrame(data, columns=_prof_fields)
+
+
 # ------------------------------------------------------------------------------
 #
 def combine_profiles(profiles):
     """
-    We first read all profiles as CSV files and parse them.  For each profile,
-    we back-calculate global time (epoch) from the synch timestamps.  Then all
-    profiles are merged (time sorted).
+    We first read all profiles (CSV or binary) and parse them.  For each
+    profile, we back-calculate global time (epoch) from the synch timestamps.
+    Then all profiles are merged (time sorted).
 
     This routine expectes all profiles to have a synchronization time stamp.
     Two kinds of sync timestamps are supported: absolute and relative.  'sync
@@ -261,113 +908,11 @@ def combine_profiles(profiles):
     abs'ed, then the first profile will be normalized based on the synchronizity
     of the 'sync rel' and 'sync ref' events.
 
-    This method is somewhat convoluted -- I would not be surprised if it can be
-    written much shorter and clearer with some python or pandas magic...
+    All rows are returned in one list -- see iter_profiles() and
+    write_profile_columns() for large sessions.
     """
-    rd_abs = dict() # dict of absolute time refs
-    rd_rel = dict() # dict of relative time refs
-    pd_abs = dict() # profiles which have absolute time refs
-    pd_rel = dict() # profiles which have relative time refs
 
-    for prof in profiles:
-        p     = list()
-        tref  = None
-        with open(prof, 'r') as csvfile:
-            reader = csv.DictReader(csvfile, fieldnames=_prof_fields)
-            empty  = True
-            for row in reader:
-
-                # skip header
-                if row['time'].startswith('#'):
-                    continue
-    
-                empty = False
-                row['time'] = float(row['time'])
-    
-                # find first tref
-                if not tref:
-                    if row['event'] == 'sync rel' : 
-                        tref = 'rel'
-                        rd_rel[prof] = [row['time'], row['msg']]
-                    if row['event'] == 'sync abs' : 
-                        tref = 'abs'
-                        rd_abs[prof] = [row['time']] + row['msg'].split(':')
-
-                # store row in profile
-                p.append(row)
-    
-        if   tref == 'abs': pd_abs[prof] = p
-        elif tref == 'rel': pd_rel[prof] = p
-        elif not empty    : print 'WARNING: skipping profile %s (no sync)' % prof
-    
-    # make all timestamps absolute for pd_abs profiles
-    for prof, p in pd_abs.iteritems():
-    
-        # the profile created an entry t_rel at t_abs.  
-        # The offset is thus t_abs - t_rel, and all timestamps 
-        # in the profile need to be corrected by that to get absolute time
-        t_rel   = float(rd_abs[prof][0])
-        t_stamp = float(rd_abs[prof][1])
-        t_zero  = float(rd_abs[prof][2])
-        t_abs   = float(rd_abs[prof][3])
-        t_off   = t_abs - t_rel
-    
-        for row in p:
-            row['time'] = row['time'] + t_off
-    
-    # combine the abs profiles into a global one.  We will add rel rpfiles as
-    # they are corrected.
-    p_glob = list()
-    for prof, p in pd_abs.iteritems():
-        p_glob += p
-
-    
-    # reference relative profiles
-    for prof, p in pd_rel.iteritems():
-    
-        # a sync message was created at time t_rel
-        t_rel = rd_rel[prof][0]
-        t_msg = rd_rel[prof][1]
-    
-        # now find the referenced sync point in other, absolute profiles
-        t_ref = None
-        for _prof, _p in pd_abs.iteritems():
-            if not t_ref:
-                for _row in _p:
-                    if  _row['event'] == 'sync ref' and \
-                        _row['msg']   == t_msg:
-                        t_ref = _row['time'] # referenced timestamp
-                        break
-    
-        if t_ref == None:
-            print "WARNING: 'sync rel' reference not found %s" % prof
-            continue
-    
-        # the profile's sync reference t_rel was created at the t_abs of the
-        # referenced point (t_ref), so all timestamps in the profile need to be
-        # corrected by (t_ref - t_rel)
-        t_off = t_ref - t_rel
-    
-        for row in p:
-            row['time'] = row['time'] + t_off
-            p_glob.append(row)
-
-    # we now have all profiles combined into one large profile, and can make
-    # timestamps relative to its smallest timestamp again
-    
-    # find the smallest time over all profiles
-    t_min = 9999999999.9 # future...
-    for row in p_glob:
-        t_min = min(t_min, row['time'])
-    
-    # make times relative to t_min again
-    for row in p_glob:
-        row['time'] -= t_min
-    
-    # sort by time and return
-    p_glob = sorted(p_glob[:], key=lambda k: k['time']) 
-
-    return p_glob
+    return list(iter_profiles(profiles))
 
 
 # ------------------------------------------------------------------------------
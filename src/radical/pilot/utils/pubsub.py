@@ -1,7 +1,6 @@
 
 import os
 import zmq
-import json
 import time
 import errno
 import pprint
@@ -9,6 +8,9 @@ import Queue           as pyq
 import multiprocessing as mp
 import radical.utils   as ru
 
+from .serializer import serialize, deserialize, check_serializer
+from .serializer import SERIALIZER_DEFAULT
+
 # --------------------------------------------------------------------------
 # defines for pubsub roles
 PUBSUB_PUB    = 'pub'
@@ -20,7 +22,6 @@ PUBSUB_ROLES  = [PUBSUB_PUB, PUBSUB_SUB, PUBSUB_BRIDGE]
 PUBSUB_ZMQ    = 'zmq'
 PUBSUB_TYPES  = [PUBSUB_ZMQ]
 
-_USE_MULTIPART  = False # send [topic, data] as multipart message
 _BRIDGE_TIMEOUT = 5.0   # how long to wait for bridge startup
 
 
@@ -57,12 +58,15 @@ def _uninterruptible(f, *args, **kwargs):
 # have different scope (bound to the channel name).  Only one specific topic is
 # predefined: 'state' will be used for unit state updates.
 #
+# Messages are sent as multipart messages [topic, frames...], where the frames
+# are the message encoded with the given 'serializer' (see serializer.py).
+#
 class Pubsub(object):
     """
     This is a factory for pubsub endpoints.
     """
 
-    def __init__(self, flavor, channel, role, address=None):
+    def __init__(self, flavor, channel, role, address=None, serializer=None):
         """
         Addresses are of the form 'tcp://host:port'.  Both 'host' and 'port' can
         be wildcards for BRIDGE roles -- the bridge will report the in and out
@@ -74,6 +78,7 @@ class Pubsub(object):
         self._role       = role
         self._addr       = address
         self._debug      = False
+        self._codec      = serializer
         self._log        = ru.get_logger('rp.bridges')
         self._name       = "pubsub.%s.%s" % (self._channel, self._role)
         self._bridge_in  = None           # bridge input  addr
@@ -82,6 +87,10 @@ class Pubsub(object):
         if not self._addr:
             self._addr = 'tcp://*:*'
 
+        if not self._codec:
+            self._codec = SERIALIZER_DEFAULT
+        check_serializer(self._codec)
+
         self._log.info("create %s - %s - %s", self._channel, self._role, self._addr)
 
     @property
@@ -106,7 +115,7 @@ class Pubsub(object):
     # This class-method creates the appropriate sub-class for the Pubsub.
     #
     @classmethod
-    def create(cls, flavor, channel, role, address=None):
+    def create(cls, flavor, channel, role, address=None, serializer=None):
 
         # Make sure that we are the base-class!
         if cls != Pubsub:
@@ -117,7 +126,7 @@ class Pubsub(object):
                 PUBSUB_ZMQ     : PubsubZMQ,
             }[flavor]
           # print 'instantiating %s' % impl
-            return impl(flavor, channel, role, address)
+            return impl(flavor, channel, role, address, serializer)
         except KeyError:
             raise RuntimeError("Pubsub type '%s' unknown!" % flavor)
 
@@ -188,19 +197,26 @@ class Pubsub(object):
         raise NotImplementedError('stop() is not implemented')
 
 
+    # --------------------------------------------------------------------------
+    #
+    def close(self):
+        raise NotImplementedError('close() is not implemented')
+
+
 # ==============================================================================
 #
 class PubsubZMQ(Pubsub):
 
-    def __init__(self, flavor, channel, role, address=None):
+    def __init__(self, flavor, channel, role, address=None, serializer=None):
         """
         This PubSub implementation is built upon, as you may have guessed
         already, the ZMQ pubsub communication pattern.
         """
 
         self._p = None  # the bridge process
+        self._q = None  # the zmq socket
 
-        Pubsub.__init__(self, flavor, channel, role, address)
+        Pubsub.__init__(self, flavor, channel, role, address, serializer)
 
 
         # ----------------------------------------------------------------------
@@ -260,22 +276,14 @@ class PubsubZMQ(Pubsub):
                         _socks = dict(_uninterruptible(_poll.poll, timeout=1000)) # timeout in ms
 
                         if _in in _socks:
-                            if _USE_MULTIPART:
-                                msg = _uninterruptible(_in.recv_multipart, flags=zmq.NOBLOCK)
-                                _uninterruptible(_out.send_multipart, msg)
-                            else:
-                                msg = _uninterruptible(_in.recv, flags=zmq.NOBLOCK)
-                                _uninterruptible(_out.send, msg)
+                            msg = _uninterruptible(_in.recv_multipart, flags=zmq.NOBLOCK)
+                            _uninterruptible(_out.send_multipart, msg)
                           # self._log.debug("-> %s", msg)
 
 
                         if _out in _socks:
-                            if _USE_MULTIPART:
-                                msg = _uninterruptible(_out.recv_multipart)
-                                _uninterruptible(_in.send_multipart, msg)
-                            else:
-                                msg = _uninterruptible(_out.recv)
-                                _uninterruptible(_in.send, msg)
+                            msg = _uninterruptible(_out.recv_multipart)
+                            _uninterruptible(_in.send_multipart, msg)
                           # self._log.debug("<- %s", msg)
 
                 except Exception as e:
@@ -328,6 +336,19 @@ class PubsubZMQ(Pubsub):
             self._p.terminate()
 
 
+    # --------------------------------------------------------------------------
+    #
+    def close(self):
+        """
+        Close the endpoint's socket.  Messages which are not sent yet are
+        dropped.  (Bridges are stopped with stop()).
+        """
+
+        if self._q:
+            self._q.close(linger=0)
+            self._q = None
+
+
     # --------------------------------------------------------------------------
     #
     def subscribe(self, topic):
@@ -348,16 +369,12 @@ class PubsubZMQ(Pubsub):
         if not self._role == PUBSUB_PUB:
             raise RuntimeError("channel %s (%s) can't put()" % (self._channel, self._role))
 
-        topic = topic.replace(' ', '_')
-        data = json.dumps(msg)
-
-        if _USE_MULTIPART:
-          # self._log.debug("-> %s", str([topic, data]))
-            _uninterruptible(self._q.send_multipart, [topic, data])
+        topic  = str(topic.replace(' ', '_'))
+        frames = [topic] + serialize(msg, self._codec)
 
-        else:
-          # self._log.debug("-> %s %s", topic, data)
-            _uninterruptible(self._q.send, "%s %s" % (topic, data))
+      # self._log.debug("-> %s", str(frames))
+        # large fields are passed to zmq without copy
+        _uninterruptible(self._q.send_multipart, frames, copy=(len(frames) < 4))
 
 
     # --------------------------------------------------------------------------
@@ -367,14 +384,9 @@ class PubsubZMQ(Pubsub):
         if not self._role == PUBSUB_SUB:
             raise RuntimeError("channel %s (%s) can't get()" % (self._channel, self._role))
 
-        if _USE_MULTIPART:
-            topic, data = _uninterruptible(self._q.recv_multipart)
-
-        else:
-            raw = _uninterruptible(self._q.recv)
-            topic, data = raw.split(' ', 1)
-
-        msg = json.loads(data)
+        frames = _uninterruptible(self._q.recv_multipart)
+        topic  = frames[0]
+        msg    = deserialize(frames[1:])
       # self._log.debug("<- %s", str([topic, pprint.pformat(msg)]))
         return [topic, msg]
 
@@ -388,14 +400,9 @@ class PubsubZMQ(Pubsub):
 
         if _uninterruptible(self._q.poll, flags=zmq.POLLIN, timeout=timeout):
 
-            if _USE_MULTIPART:
-                topic, data = _uninterruptible(self._q.recv_multipart, flags=zmq.NOBLOCK)
-
-            else:
-                raw = _uninterruptible(self._q.recv)
-                topic, data = raw.split(' ', 1)
-
-            msg = json.loads(data)
+            frames = _uninterruptible(self._q.recv_multipart, flags=zmq.NOBLOCK)
+            topic  = frames[0]
+            msg    = deserialize(frames[1:])
             self._log.debug(">> %s", str([topic, pprint.pformat(msg)]))
             return [topic, msg]
 
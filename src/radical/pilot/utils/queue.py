@@ -4,11 +4,15 @@ import zmq
 import time
 import errno
 import pprint
+import collections
 import Queue           as pyq
 import threading       as mt
 import multiprocessing as mp
 import radical.utils   as ru
 
+from .serializer import serialize, deserialize, check_serializer
+from .serializer import SERIALIZER_DEFAULT
+
 # --------------------------------------------------------------------------
 # defines for queue roles
 QUEUE_INPUT   = 'input'
@@ -17,12 +21,15 @@ QUEUE_OUTPUT  = 'output'
 QUEUE_ROLES   = [QUEUE_INPUT, QUEUE_BRIDGE, QUEUE_OUTPUT]
 
 # defines for queue types
-QUEUE_THREAD  = 'thread'
-QUEUE_PROCESS = 'process'
-QUEUE_ZMQ     = 'zmq'
-QUEUE_TYPES   = [QUEUE_THREAD, QUEUE_PROCESS, QUEUE_ZMQ]
+QUEUE_THREAD     = 'thread'
+QUEUE_PROCESS    = 'process'
+QUEUE_ZMQ        = 'zmq'
+QUEUE_ZMQ_DEALER = 'zmq_dealer'
+QUEUE_TYPES      = [QUEUE_THREAD, QUEUE_PROCESS, QUEUE_ZMQ, QUEUE_ZMQ_DEALER]
 
 _BRIDGE_TIMEOUT = 5.0  # how long to wait for bridge startup
+_CREDIT_WINDOW  = 64   # msgs prefetched per consumer (QUEUE_ZMQ_DEALER)
+_BRIDGE_HWM     = 1024 # max msgs buffered by the bridge (QUEUE_ZMQ_DEALER)
 
 # --------------------------------------------------------------------------
 #
@@ -82,6 +89,13 @@ def _uninterruptible(f, *args, **kwargs):
 #   get()
 #   get_nowait()
 #
+# and additionally
+#
+#   get_bulk(size, timeout)
+#
+# which returns a list of up to 'size' messages, and waits at most 'timeout'
+# milliseconds for the first one.
+#
 # Not implemented is, at the moment:
 #
 #   qsize
@@ -93,6 +107,9 @@ def _uninterruptible(f, *args, **kwargs):
 #   task_done
 #   join
 #
+# Messages on zmq queues are encoded with the given 'serializer' (see
+# serializer.py) -- other queue types pass messages as they are.
+#
 # Our Queue additionally takes 'name', 'role' and 'address' parameter on the
 # constructor.  'role' can be 'input', 'bridge' or 'output', where 'input' is
 # the end of a queue one can 'put()' messages into, and 'output' the end of the
@@ -143,19 +160,24 @@ class Queue(object):
     """
     This is really just the queue interface we want to implement
     """
-    def __init__(self, flavor, qname, role, address=None):
+    def __init__(self, flavor, qname, role, address=None, serializer=None):
 
         self._flavor = flavor
         self._qname  = qname
         self._role   = role
         self._addr   = address
         self._debug  = False
+        self._codec  = serializer
         self._log    = ru.get_logger('rp.bridges')
         self._name   = "queue.%s.%s" % (self._qname, self._role)
 
         if not self._addr:
             self._addr = 'tcp://*:*'
 
+        if not self._codec:
+            self._codec = SERIALIZER_DEFAULT
+        check_serializer(self._codec)
+
         if role in [QUEUE_INPUT, QUEUE_OUTPUT]:
             self._log.info("create %s - %s - %s - %s", flavor, qname, role, address)
 
@@ -185,7 +207,7 @@ class Queue(object):
     # This class-method creates the appropriate sub-class for the Queue.
     #
     @classmethod
-    def create(cls, flavor, name, role, address=None):
+    def create(cls, flavor, name, role, address=None, serializer=None):
 
         # Make sure that we are the base-class!
         if cls != Queue:
@@ -193,12 +215,13 @@ class Queue(object):
 
         try:
             impl = {
-                QUEUE_THREAD  : QueueThread,
-                QUEUE_PROCESS : QueueProcess,
-                QUEUE_ZMQ     : QueueZMQ,
+                QUEUE_THREAD     : QueueThread,
+                QUEUE_PROCESS    : QueueProcess,
+                QUEUE_ZMQ        : QueueZMQ,
+                QUEUE_ZMQ_DEALER : QueueZMQDealer,
             }[flavor]
           # print 'instantiating %s' % impl
-            return impl(flavor, name, role, address)
+            return impl(flavor, name, role, address, serializer)
         except KeyError:
             raise RuntimeError("Queue type '%s' unknown!" % flavor)
 
@@ -233,19 +256,31 @@ class Queue(object):
         raise NotImplementedError('get_nowait() is not implemented')
 
 
+    # --------------------------------------------------------------------------
+    #
+    def get_bulk(self, size, timeout=None):
+        raise NotImplementedError('get_bulk() is not implemented')
+
+
     # --------------------------------------------------------------------------
     #
     def stop(self):
         raise NotImplementedError('stop() is not implemented')
 
 
+    # --------------------------------------------------------------------------
+    #
+    def close(self):
+        raise NotImplementedError('close() is not implemented')
+
+
 # ==============================================================================
 #
 class QueueThread(Queue):
 
-    def __init__(self, flavor, name, role, address=None):
+    def __init__(self, flavor, name, role, address=None, serializer=None):
 
-        Queue.__init__(self, flavor, name, role, address)
+        Queue.__init__(self, flavor, name, role, address, serializer)
         self._q = _registry.get(flavor, name, pyq.Queue)
 
 
@@ -282,13 +317,36 @@ class QueueThread(Queue):
             return None
 
 
+    # --------------------------------------------------------------------------
+    #
+    def get_bulk(self, size, timeout=None): # timeout in ms
+
+        if not self._role == QUEUE_OUTPUT:
+            raise RuntimeError("queue %s (%s) can't get_bulk()" % (self._qname, self._role))
+
+        msgs = list()
+        try:
+            if timeout:
+                msgs.append(self._q.get(True, timeout / 1000.0))
+            else:
+                msgs.append(self._q.get_nowait())
+
+            while len(msgs) < size:
+                msgs.append(self._q.get_nowait())
+
+        except pyq.Empty:
+            pass
+
+        return msgs
+
+
 # ==============================================================================
 #
 class QueueProcess(Queue):
 
-    def __init__(self, flavor, name, role, address=None):
+    def __init__(self, flavor, name, role, address=None, serializer=None):
 
-        Queue.__init__(self, flavor, name, role, address)
+        Queue.__init__(self, flavor, name, role, address, serializer)
         self._q = _registry.get(flavor, name, mp.Queue)
 
 
@@ -325,12 +383,35 @@ class QueueProcess(Queue):
             return None
 
 
+    # --------------------------------------------------------------------------
+    #
+    def get_bulk(self, size, timeout=None): # timeout in ms
+
+        if not self._role == QUEUE_OUTPUT:
+            raise RuntimeError("queue %s (%s) can't get_bulk()" % (self._qname, self._role))
+
+        msgs = list()
+        try:
+            if timeout:
+                msgs.append(self._q.get(True, timeout / 1000.0))
+            else:
+                msgs.append(self._q.get_nowait())
+
+            while len(msgs) < size:
+                msgs.append(self._q.get_nowait())
+
+        except pyq.Empty:
+            pass
+
+        return msgs
+
+
 # ==============================================================================
 #
 class QueueZMQ(Queue):
 
 
-    def __init__(self, flavor, name, role, address=None):
+    def __init__(self, flavor, name, role, address=None, serializer=None):
         """
         This Queue type sets up an zmq channel of this kind:
 
@@ -340,7 +421,10 @@ class QueueZMQ(Queue):
 
         ie. any number of inputs can 'zmq.push()' to a bridge (which
         'zmq.pull()'s), and any number of outputs can 'zmq.request()' 
-        messages from the bridge (which 'zmq.response()'s).
+        messages from the bridge (which 'zmq.response()'s).  A request for
+        a single message is 'request', and is answered with that message.
+        A bulk request is 'request:<size>', and is answered with a list of up
+        to <size> messages -- all messages the bridge holds at that point.
 
         The bridge is the entity which 'bind()'s network interfaces, both input
         and output type endpoints 'connect()' to it.  It is the callees
@@ -354,11 +438,12 @@ class QueueZMQ(Queue):
         self._p          = None           # the bridge process
         self._q          = None           # the zmq queue
         self._lock       = mt.RLock()     # for _requested
-        self._requested  = False          # send/recv sync
+        self._requested  = None           # send/recv sync: pending request
+        self._cache      = list()         # surplus msgs from bulk replies
         self._bridge_in  = None           # bridge input  addr
         self._bridge_out = None           # bridge output addr
 
-        Queue.__init__(self, flavor, name, role, address)
+        Queue.__init__(self, flavor, name, role, address, serializer)
 
         # ----------------------------------------------------------------------
         # behavior depends on the role...
@@ -418,7 +503,29 @@ class QueueZMQ(Queue):
 
                         if _out in events:
                             req = _uninterruptible(_out.recv)
-                            _uninterruptible(_out.send_json, _uninterruptible(_in.recv_json))
+
+                            # messages are forwarded as they are, without
+                            # decoding them
+                            if req == 'request':
+                                _uninterruptible(_out.send_multipart,
+                                                 _uninterruptible(_in.recv_multipart))
+                                continue
+
+                            # bulk request: wait for the first message, then
+                            # collect whatever else is available right now.
+                            # The reply frames are, per message, the number
+                            # of frames followed by the message frames.
+                            size  = int(req.split(':', 1)[1])
+                            msg   = _uninterruptible(_in.recv_multipart)
+                            reply = [str(len(msg))] + msg
+                            for _ in range(size - 1):
+                                try:
+                                    msg = _in.recv_multipart(flags=zmq.NOBLOCK)
+                                except zmq.Again:
+                                    break
+                                reply.append(str(len(msg)))
+                                reply.extend(msg)
+                            _uninterruptible(_out.send_multipart, reply)
 
                 except Exception as e:
                     self._log.exception('bridge error: %s', e)
@@ -487,6 +594,19 @@ class QueueZMQ(Queue):
             self._p.terminate()
 
 
+    # --------------------------------------------------------------------------
+    #
+    def close(self):
+        """
+        Close the endpoint's socket.  Messages which are not sent yet are
+        dropped.  (Bridges are stopped with stop()).
+        """
+
+        if self._q:
+            self._q.close(linger=0)
+            self._q = None
+
+
     # --------------------------------------------------------------------------
     #
     def put(self, msg):
@@ -495,7 +615,10 @@ class QueueZMQ(Queue):
             raise RuntimeError("queue %s (%s) can't put()" % (self._qname, self._role))
 
       # self._log.debug("-> %s", pprint.pformat(msg))
-        _uninterruptible(self._q.send_json, msg)
+        frames = serialize(msg, self._codec)
+
+        # large fields are passed to zmq without copy
+        _uninterruptible(self._q.send_multipart, frames, copy=(len(frames) < 3))
 
 
     # --------------------------------------------------------------------------
@@ -505,11 +628,40 @@ class QueueZMQ(Queue):
         if not self._role == QUEUE_OUTPUT:
             raise RuntimeError("queue %s (%s) can't get()" % (self._qname, self._role))
 
-        _uninterruptible(self._q.send, 'request')
+        with self._lock: # need to protect self._requested
 
-        msg = _uninterruptible(self._q.recv_json)
-      # self._log.debug("<- %s", pprint.pformat(msg))
-        return msg
+            if not self._cache:
+                if not self._requested:
+                    _uninterruptible(self._q.send, 'request')
+                    self._requested = 'request'
+                self._recv()
+
+            msg = self._cache.pop(0)
+          # self._log.debug("<- %s", pprint.pformat(msg))
+            return msg
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _recv(self):
+        """
+        receive the reply to the pending request, and stash the received
+        message(s) in the cache.  The caller must hold the lock.
+        """
+
+        frames = _uninterruptible(self._q.recv_multipart)
+
+        if self._requested == 'request':
+            self._cache.append(deserialize(frames))
+
+        else:
+            idx = 0
+            while idx < len(frames):
+                n = int(frames[idx])
+                self._cache.append(deserialize(frames[idx + 1 : idx + 1 + n]))
+                idx += 1 + n
+
+        self._requested = None
 
 
     # --------------------------------------------------------------------------
@@ -521,10 +673,13 @@ class QueueZMQ(Queue):
 
         with self._lock: # need to protect self._requested
 
+            if self._cache:
+                return self._cache.pop(0)
+
             if not self._requested:
                 # we can only send the request once per recieval
                 _uninterruptible(self._q.send, 'request')
-                self._requested = True
+                self._requested = 'request'
 
           # try:
           #     msg = self._q.recv_json(flags=zmq.NOBLOCK)
@@ -536,8 +691,8 @@ class QueueZMQ(Queue):
           #     return None
 
             if _uninterruptible(self._q.poll, flags=zmq.POLLIN, timeout=timeout):
-                msg = _uninterruptible(self._q.recv_json)
-                self._requested = False
+                self._recv()
+                msg = self._cache.pop(0)
               # self._log.debug("<< %s", pprint.pformat(msg))
                 return msg
 
@@ -545,5 +700,327 @@ class QueueZMQ(Queue):
                 return None
 
 
+    # --------------------------------------------------------------------------
+    #
+    def get_bulk(self, size, timeout=None): # timeout in ms
+
+        if not self._role == QUEUE_OUTPUT:
+            raise RuntimeError("queue %s (%s) can't get_bulk()" % (self._qname, self._role))
+
+        with self._lock: # need to protect self._requested
+
+            if not self._cache:
+
+                if not self._requested:
+                    # we can only send the request once per recieval
+                    _uninterruptible(self._q.send, 'request:%d' % size)
+                    self._requested = 'bulk'
+
+                if _uninterruptible(self._q.poll, flags=zmq.POLLIN, timeout=timeout):
+                    self._recv()
+
+            msgs        = self._cache[:size]
+            self._cache = self._cache[size:]
+
+            return msgs
+
+
+# ==============================================================================
+#
+class QueueZMQDealer(Queue):
+
+
+    def __init__(self, flavor, name, role, address=None, serializer=None):
+        """
+        This Queue type sets up an zmq channel of this kind:
+
+            input \            / output
+                   -- bridge -- 
+            input /            \ output
+
+        like QueueZMQ, but the outputs are zmq DEALER sockets which connect to
+        a ROUTER socket on the bridge.  Instead of requesting every single
+        message, an output grants the bridge a number of credits (a window of
+        _CREDIT_WINDOW messages), and the bridge pushes messages to the
+        outputs as long as they have credits left, round-robin over all
+        outputs with credits.  Messages are thus prefetched by the outputs,
+        and get() does not need a round trip through the bridge.  Outputs
+        return credits as they consume messages.
+
+        The bridge only pulls messages from the inputs while any output has
+        credits left, and its input buffer is bounded by _BRIDGE_HWM -- inputs
+        thus block once the consumers can't keep up.
+
+        Messages are forwarded by the bridge without being decoded.  Messages
+        prefetched by an output which disappears are lost.
+        """
+
+        self._p          = None           # the bridge process
+        self._q          = None           # the zmq queue
+        self._lock       = mt.RLock()     # for _consumed
+        self._consumed   = 0              # msgs consumed since last credit
+        self._bridge_in  = None           # bridge input  addr
+        self._bridge_out = None           # bridge output addr
+
+        Queue.__init__(self, flavor, name, role, address, serializer)
+
+        # ----------------------------------------------------------------------
+        # behavior depends on the role...
+        if self._role == QUEUE_INPUT:
+            ctx = zmq.Context()
+            self._q = ctx.socket(zmq.PUSH)
+            self._q.connect(self._addr)
+
+
+        # ----------------------------------------------------------------------
+        elif self._role == QUEUE_BRIDGE:
+
+            # we expect bridges to always use a port wildcard. Make sure
+            # that's the case
+            elems = self._addr.split(':')
+            if len(elems) > 2 and elems[2] and elems[2] != '*':
+                raise RuntimeError('wildcard port (*) required for bridge addresses (%s)' \
+                                % self._addr)
+
+            # ------------------------------------------------------------------
+            def _bridge(addr, pqueue):
+
+                try:
+                    import setproctitle as spt
+                    spt.setproctitle('radical.pilot %s' % self._name)
+                except Exception as e:
+                    pass
+
+                try:
+                    self._log.info('start bridge %s on %s', self._name, addr)
+
+                    ctx = zmq.Context()
+                    _in = ctx.socket(zmq.PULL)
+                    _in.setsockopt(zmq.RCVHWM, _BRIDGE_HWM)
+                    _in.bind(addr)
+
+                    _out = ctx.socket(zmq.ROUTER)
+                    _out.bind(addr)
+
+                    # communicate the bridge ports to the parent process
+                    _in_port  =  _in.getsockopt(zmq.LAST_ENDPOINT)
+                    _out_port = _out.getsockopt(zmq.LAST_ENDPOINT)
+
+                    pqueue.put([_in_port, _out_port])
+
+                    self._log.info('bound bridge %s to %s : %s', self._name, _in_port, _out_port)
+
+                    credits = dict()                # output id : credits
+                    ready   = collections.deque()   # outputs with credits
+
+                    _poll = zmq.Poller()
+                    _poll.register(_out, zmq.POLLIN)
+                    polling_in = False
+
+                    while True:
+
+                        # only pull from the inputs while someone can take
+                        # the messages
+                        if ready and not polling_in:
+                            _poll.register(_in, zmq.POLLIN)
+                            polling_in = True
+                        elif not ready and polling_in:
+                            _poll.unregister(_in)
+                            polling_in = False
+
+                        events = dict(_uninterruptible(_poll.poll, 1000)) # timeout in ms
+
+                        if _out in events:
+                            # credit grants: [identity, credits]
+                            while True:
+                                try:
+                                    ident, credit = _out.recv_multipart(flags=zmq.NOBLOCK)
+                                except zmq.Again:
+                                    break
+                                if not credits.get(ident):
+                                    ready.append(ident)
+                                credits[ident] = credits.get(ident, 0) + int(credit)
+
+                        if _in in events:
+                            while ready:
+                                try:
+                                    msg = _in.recv_multipart(flags=zmq.NOBLOCK)
+                                except zmq.Again:
+                                    break
+
+                                ident = ready.popleft()
+                                _uninterruptible(_out.send_multipart, [ident] + msg)
+
+                                credits[ident] -= 1
+                                if credits[ident]:
+                                    ready.append(ident)
+
+                except Exception as e:
+                    self._log.exception('bridge error: %s', e)
+            # ------------------------------------------------------------------
+
+            pqueue   = mp.Queue()
+            self._p  = mp.Process(target=_bridge, args=[self._addr, pqueue])
+            self._p.start()
+
+            try:
+                self._bridge_in, self._bridge_out = pqueue.get(True, _BRIDGE_TIMEOUT)
+            except pyq.Empty as e:
+                raise RuntimeError ("bridge did not come up! (%s)" % e)
+
+        # ----------------------------------------------------------------------
+        elif self._role == QUEUE_OUTPUT:
+            ctx = zmq.Context()
+            self._q = ctx.socket(zmq.DEALER)
+            self._q.connect(self._addr)
+
+            # open the initial credit window
+            _uninterruptible(self._q.send, str(_CREDIT_WINDOW))
+
+        # ----------------------------------------------------------------------
+        else:
+            raise RuntimeError ("unsupported queue role '%s'" % self._role)
+
+
+    # --------------------------------------------------------------------------
+    #
+    def __del__(self):
+
+        self.stop()
+
+
+    # --------------------------------------------------------------------------
+    #
+    @property
+    def bridge_in(self):
+        if self._role != QUEUE_BRIDGE:
+            raise TypeError('bridge_in is only defined on a bridge')
+        return self._bridge_in
+
+
+    # --------------------------------------------------------------------------
+    #
+    @property
+    def bridge_out(self):
+        if self._role != QUEUE_BRIDGE:
+            raise TypeError('bridge_out is only defined on a bridge')
+        return self._bridge_out
+
+
+    # --------------------------------------------------------------------------
+    #
+    def poll(self):
+        """
+        Only check bridges -- endpoints are otherwise always considered valid
+        """
+        if self._p and not self._p.is_alive():
+            return 0
+
+
+    # --------------------------------------------------------------------------
+    #
+    def stop(self):
+
+        if self._p:
+            self._p.terminate()
+
+
+    # --------------------------------------------------------------------------
+    #
+    def close(self):
+        """
+        Close the endpoint's socket.  Messages which are not sent yet are
+        dropped.  (Bridges are stopped with stop()).
+        """
+
+        if self._q:
+            self._q.close(linger=0)
+            self._q = None
+
+
+    # --------------------------------------------------------------------------
+    #
+    def put(self, msg):
+
+        if not self._role == QUEUE_INPUT:
+            raise RuntimeError("queue %s (%s) can't put()" % (self._qname, self._role))
+
+        frames = serialize(msg, self._codec)
+
+        # large fields are passed to zmq without copy
+        _uninterruptible(self._q.send_multipart, frames, copy=(len(frames) < 3))
+
+
+    # --------------------------------------------------------------------------
+    #
+    def _consume(self, n):
+        """
+        account for n consumed messages, and return credits to the bridge once
+        half of the window is used up.  The caller must hold the lock.
+        """
+
+        self._consumed += n
+
+        if self._consumed >= _CREDIT_WINDOW / 2:
+            _uninterruptible(self._q.send, str(self._consumed))
+            self._consumed = 0
+
+
+    # --------------------------------------------------------------------------
+    #
+    def get(self):
+
+        if not self._role == QUEUE_OUTPUT:
+            raise RuntimeError("queue %s (%s) can't get()" % (self._qname, self._role))
+
+        with self._lock:
+            msg = deserialize(_uninterruptible(self._q.recv_multipart))
+            self._consume(1)
+            return msg
+
+
+    # --------------------------------------------------------------------------
+    #
+    def get_nowait(self, timeout=None): # timeout in ms
+
+        if not self._role == QUEUE_OUTPUT:
+            raise RuntimeError("queue %s (%s) can't get_nowait()" % (self._qname, self._role))
+
+        with self._lock:
+
+            if _uninterruptible(self._q.poll, flags=zmq.POLLIN, timeout=timeout):
+                msg = deserialize(_uninterruptible(self._q.recv_multipart))
+                self._consume(1)
+                return msg
+
+            else:
+                return None
+
+
+    # --------------------------------------------------------------------------
+    #
+    def get_bulk(self, size, timeout=None): # timeout in ms
+
+        if not self._role == QUEUE_OUTPUT:
+            raise RuntimeError("queue %s (%s) can't get_bulk()" % (self._qname, self._role))
+
+        msgs = list()
+
+        with self._lock:
+
+            if not _uninterruptible(self._q.poll, flags=zmq.POLLIN, timeout=timeout):
+                return msgs
+
+            while len(msgs) < size:
+                try:
+                    msgs.append(deserialize(self._q.recv_multipart(flags=zmq.NOBLOCK)))
+                except zmq.Again:
+                    break
+
+            self._consume(len(msgs))
+
+        return msgs
+
+
 # ------------------------------------------------------------------------------
 
@@ -0,0 +1,148 @@
+
+import json
+import cPickle
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# ------------------------------------------------------------------------------
+#
+# defines for message serializers
+SERIALIZER_JSON    = 'json'
+SERIALIZER_MSGPACK = 'msgpack'
+SERIALIZER_PICKLE  = 'pickle2'
+SERIALIZERS        = [SERIALIZER_JSON, SERIALIZER_MSGPACK, SERIALIZER_PICKLE]
+
+SERIALIZER_DEFAULT = SERIALIZER_JSON
+
+# top level string fields larger than this (in bytes) are sent as separate
+# frames, and are not run through the serializer
+_FRAME_THRESHOLD   = 4 * 1024
+
+
+# ------------------------------------------------------------------------------
+#
+# Messages sent over zmq queues and pubsub channels are multipart messages of
+# the form
+#
+#   [header, body, field_1, field_2, ...]
+#
+# where 'header' is 'codec' or 'codec:[[key_1, uni_1], [key_2, uni_2], ...]'.
+# 'body' is the message serialized by 'codec', minus the (top level) fields
+# 'key_1', 'key_2', ... which are sent as raw frames 'field_1', 'field_2', ...
+# Those are large string fields (like stdout / stderr of units), which we pass
+# to zmq without copy, and without running them through the codec.  Unicode
+# fields are sent utf-8 encoded, and are flagged by 'uni_n', so that only those
+# are decoded again -- byte string fields are passed on as they are.  The key
+# list is json encoded (ASCII only), so that keys can contain any character.
+#
+# Since the codec is tagged in each message, receivers can decode messages from
+# senders with a different serializer.
+#
+def check_serializer(codec):
+
+    if codec not in SERIALIZERS:
+        raise ValueError("serializer '%s' unknown (%s)" % (codec, SERIALIZERS))
+
+    if codec == SERIALIZER_MSGPACK and not msgpack:
+        raise RuntimeError("serializer '%s' needs the msgpack module" % codec)
+
+
+# ------------------------------------------------------------------------------
+#
+def _dumps(codec, msg):
+
+    if codec == SERIALIZER_JSON   : return json.dumps(msg)
+    if codec == SERIALIZER_PICKLE : return cPickle.dumps(msg, 2)
+
+    if codec == SERIALIZER_MSGPACK and msgpack:
+        return msgpack.packb(msg, use_bin_type=False)
+
+    check_serializer(codec)
+
+
+# ------------------------------------------------------------------------------
+#
+def _loads(codec, data):
+
+    if codec == SERIALIZER_JSON   : return json.loads(data)
+    if codec == SERIALIZER_PICKLE : return cPickle.loads(data)
+
+    if codec == SERIALIZER_MSGPACK and msgpack:
+        return msgpack.unpackb(data, raw=False)
+
+    check_serializer(codec)
+
+
+# ------------------------------------------------------------------------------
+#
+def serialize(msg, codec=None):
+    """
+    Return the list of frames representing msg.
+    """
+
+    if not codec:
+        codec = SERIALIZER_DEFAULT
+
+    fields = list()
+    keys   = list()
+
+    if isinstance(msg, dict):
+
+        for key, val in msg.iteritems():
+            if isinstance(val, basestring) and len(val) > _FRAME_THRESHOLD:
+                keys.append([key, isinstance(val, unicode)])
+
+        if keys:
+            # don't change the caller's dict
+            msg = dict(msg)
+            for key, uni in keys:
+                val = msg.pop(key)
+                if uni:
+                    val = val.encode('utf-8')
+                fields.append(val)
+
+    if keys: header = str('%s:%s' % (codec, json.dumps(keys)))
+    else   : header = str(codec)
+
+    return [header, _dumps(codec, msg)] + fields
+
+
+# ------------------------------------------------------------------------------
+#
+def deserialize(frames):
+    """
+    Return the message represented by the given list of frames.
+    """
+
+    header = frames[0]
+    if ':' in header:
+        codec, keys = header.split(':', 1)
+        keys        = json.loads(keys)
+    else:
+        codec, keys = header, []
+
+    msg = _loads(codec, frames[1])
+
+    for (key, uni), val in zip(keys, frames[2:]):
+
+        # json returns unicode keys -- keep plain ones as str
+        if isinstance(key, unicode):
+            try:
+                key = str(key)
+            except UnicodeEncodeError:
+                pass
+
+        if uni:
+            msg[key] = val.decode('utf-8')
+        else:
+            msg[key] = val
+
+    return msg
+
+
+# ------------------------------------------------------------------------------
+
@@ -185,10 +185,7 @@ def get_session_frames (sids, dburl=None, cachedir=None) :
     # print u_max - u_min
 
     if not dburl:
-        dburl = os.environ['RADICAL_PILOT_DBURL']
-
-    if not dburl:
-        raise RuntimeError ('Please set RADICAL_PILOT_DBURL')
+        dburl = os.environ.get('RADICAL_PILOT_DBURL')
 
 
     if not isinstance (sids, list) :
@@ -198,9 +195,14 @@ def get_session_frames (sids, dburl=None, cachedir=None) :
     pilot_dicts   = list()
     unit_dicts    = list()
 
+    # without a db url, we work off the session cache alone
+    mongo, db = None, None
+    if dburl:
+        mongo, db, _, _, _ = ru.mongodb_connect(dburl)
+
     for sid in sids :
 
-        docs = get_session_docs (dburl, sid, cachedir=cachedir)
+        docs, units = open_session_docs (db, sid, cachedir=cachedir)
 
         session       = docs['session']
         session_start = session['created']
@@ -262,7 +264,7 @@ def get_session_frames (sids, dburl=None, cachedir=None) :
             pilot_dicts.append (pilot_dict)
 
 
-        for unit in docs['unit']:
+        for unit in units:
 
             uid         = unit['_id']
             started     = unit.get ('started')
@@ -416,6 +418,9 @@ def get_session_frames (sids, dburl=None, cachedir=None) :
         session_dict['finished'] = last_pilot_event
         session_dicts.append (session_dict)
 
+    if mongo:
+        mongo.close()
+
     import pandas 
     session_frame = pandas.DataFrame (session_dicts)
     pilot_frame   = pandas.DataFrame (pilot_dicts)
@@ -0,0 +1,225 @@
+
+import os
+import errno
+import fcntl
+import shutil
+import tarfile
+
+try:
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+except Exception:
+    _libc = None
+
+
+# ------------------------------------------------------------------------------
+#
+# methods used by copy_file()
+COPY_LINK  = 'link'      # hardlink (only if requested)
+COPY_CLONE = 'clone'     # reflink, copy on write
+COPY_RANGE = 'range'     # in-kernel copy (copy_file_range / sendfile)
+COPY_BYTES = 'bytes'     # read / write through user space
+
+_FICLONE   = 0x40049409  # linux ioctl, see ioctl_ficlone(2)
+_CHUNK     = 8 * 1024 * 1024
+
+# errors on which we fall back to the next copy method
+_FALLBACK  = [errno.EXDEV,  errno.EINVAL, errno.ENOSYS, errno.EPERM,
+              errno.EBADF,  errno.ENOTTY, errno.EMLINK, errno.EOPNOTSUPP]
+
+# Python 2 has no binding for copy_file_range or sendfile, so we use libc if
+# we can find it
+_copy_file_range = None
+_sendfile        = None
+
+if _libc:
+
+    if hasattr(_libc, 'copy_file_range'):
+        _copy_file_range          = _libc.copy_file_range
+        _copy_file_range.restype  = ctypes.c_ssize_t
+        _copy_file_range.argtypes = [ctypes.c_int, ctypes.c_void_p,
+                                     ctypes.c_int, ctypes.c_void_p,
+                                     ctypes.c_size_t, ctypes.c_uint]
+
+    if hasattr(_libc, 'sendfile'):
+        _sendfile                 = _libc.sendfile
+        _sendfile.restype         = ctypes.c_ssize_t
+        _sendfile.argtypes        = [ctypes.c_int, ctypes.c_int,
+                                     ctypes.c_void_p, ctypes.c_size_t]
+
+
+# ------------------------------------------------------------------------------
+#
+def _copy_kernel(fd_src, fd_tgt, size):
+
+    # copy 'size' bytes between the current positions of the given fds, with
+    # copy_file_range or sendfile.  Return the number of bytes copied (which
+    # is smaller than size if neither is usable).
+
+    done = 0
+    for call in [_copy_file_range, _sendfile]:
+
+        if not call:
+            continue
+
+        while done < size:
+
+            n = min(_CHUNK, size - done)
+
+            if call == _copy_file_range: ret = call(fd_src, None, fd_tgt, None, n, 0)
+            else                       : ret = call(fd_tgt, fd_src, None, n)
+
+            if ret < 0:
+                err = ctypes.get_errno()
+                if err == errno.EINTR:
+                    continue
+                if err in _FALLBACK and not done:
+                    break
+                raise OSError(err, os.strerror(err))
+
+            if not ret:
+                # source got shorter
+                return size
+
+            done += ret
+
+        if done:
+            break
+
+    return done
+
+
+# ------------------------------------------------------------------------------
+#
+def copy_file(source, target, hardlink=False):
+    """
+    Copy the file 'source' to 'target' (like shutil.copyfile), with the
+    cheapest method available: a hardlink (only if 'hardlink' is set, as the
+    target then shares its data with the source), a reflink clone on file
+    systems which support copy on write, an in-kernel copy, or finally
+    a plain read / write loop.  Returns a tuple of the method used and the
+    number of bytes moved through the kernel or user space.
+    """
+
+    if os.path.exists(target) and os.path.samefile(source, target):
+        raise shutil.Error("`%s` and `%s` are the same file" % (source, target))
+
+    if hardlink:
+        try:
+            os.link(source, target)
+            return COPY_LINK, 0
+        except OSError as e:
+            if e.errno not in _FALLBACK + [errno.EEXIST]:
+                raise
+
+    fd_src = os.open(source, os.O_RDONLY)
+    try:
+        size   = os.fstat(fd_src).st_size
+        fd_tgt = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666)
+        try:
+            try:
+                fcntl.ioctl(fd_tgt, _FICLONE, fd_src)
+                return COPY_CLONE, 0
+            except (IOError, OSError) as e:
+                if e.errno not in _FALLBACK:
+                    raise
+
+            # files in /proc and friends report size 0, and are read below
+            if size:
+                done = _copy_kernel(fd_src, fd_tgt, size)
+                if done >= size:
+                    return COPY_RANGE, done
+
+            done = 0
+            while True:
+                data = os.read(fd_src, _CHUNK)
+                if not data:
+                    break
+                done += len(data)
+                while data:
+                    data = data[os.write(fd_tgt, data):]
+
+            return COPY_BYTES, done
+
+        finally:
+            os.close(fd_tgt)
+    finally:
+        os.close(fd_src)
+
+
+# ------------------------------------------------------------------------------
+#
+def copy_range(source, offset, size, target, mode=None):
+    """
+    Copy 'size' bytes from 'offset' of the file 'source' into the file 'target'
+    (which is truncated), in-kernel if possible.  This is used to extract
+    members of a staging bundle (see write_bundle).  If 'mode' is given, it is
+    applied to the target.  Returns a tuple of the method used and the number
+    of bytes copied.
+    """
+
+    fd_src = os.open(source, os.O_RDONLY)
+    try:
+        os.lseek(fd_src, offset, os.SEEK_SET)
+        fd_tgt = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666)
+        try:
+            method = COPY_RANGE
+            done   = 0
+            if size:
+                done = _copy_kernel(fd_src, fd_tgt, size)
+
+            # the kernel copy continues from the current file positions, and
+            # so do we, for whatever it did not copy
+            if done < size:
+                method = COPY_BYTES
+                while done < size:
+                    data = os.read(fd_src, min(_CHUNK, size - done))
+                    if not data:
+                        break
+                    done += len(data)
+                    while data:
+                        data = data[os.write(fd_tgt, data):]
+        finally:
+            os.close(fd_tgt)
+    finally:
+        os.close(fd_src)
+
+    if mode is not None:
+        os.chmod(target, mode)
+
+    return method, done
+
+
+# ------------------------------------------------------------------------------
+#
+def write_bundle(archive, files):
+    """
+    Write the given files (a list of [source, name] pairs) into a new tar
+    archive, under the given member names.  Returns the index of the archive,
+    as a list of [name, offset, size, mode] entries, where 'offset' points to
+    the member's data -- so that single members can be extracted with
+    copy_range(), without reading the archive.
+    """
+
+    index = list()
+    tar   = tarfile.open(archive, 'w', format=tarfile.GNU_FORMAT)
+    try:
+        for source, name in files:
+            with open(source, 'rb') as f:
+                info = tar.gettarinfo(arcname=name, fileobj=f)
+                tar.addfile(info, f)
+
+            # the data ends on the current archive offset, padded to full
+            # blocks
+            blocks = (info.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE
+            index.append([name, tar.offset - blocks * tarfile.BLOCKSIZE,
+                          info.size, info.mode])
+    finally:
+        tar.close()
+
+    return index
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+# ------------------------------------------------------------------------------
+#
+# Compare the run time of the row-by-row reference implementations of
+# add_concurrency() and add_frequency() (see test_analysis.py) with the
+# vectorized ones in radical.pilot.utils.analysis, on profile frames of
+# growing size.  Set 'REF_MAX' lower to skip the (slow) reference runs on large
+# frames.
+#
+
+import sys
+import time
+
+import radical.pilot.utils as rpu
+
+from test_analysis import create_profile, ref_add_concurrency, \
+                          ref_add_frequency, SPECS
+
+SIZES   = [10 * 1000, 100 * 1000, 1000 * 1000]
+REF_MAX = 1000 * 1000
+WINDOW  = 1.0
+FREQ    = {'state' : 'Executing'}
+
+
+# ------------------------------------------------------------------------------
+#
+def timed(func, *args):
+
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        REF_MAX = int(sys.argv[1])
+
+    print "%10s  %-16s  %10s  %10s  %8s" \
+        % ('events', 'method', 'reference', 'vectorized', 'speedup')
+
+    for n in SIZES:
+
+        frame = create_profile(n)
+
+        for name, ref, new, args in [
+                ['add_concurrency', ref_add_concurrency, rpu.add_concurrency,
+                                    ['conc', SPECS[0]]],
+                ['add_frequency',   ref_add_frequency,   rpu.add_frequency,
+                                    ['freq', WINDOW, FREQ]]]:
+
+            t_new = timed(new, frame.copy(), *args)
+
+            if n <= REF_MAX:
+                t_ref = timed(ref, frame.copy(), *args)
+                print "%10d  %-16s  %9.3fs  %9.3fs  %7.0fx" \
+                    % (n, name, t_ref, t_new, t_ref / t_new)
+            else:
+                print "%10d  %-16s  %10s  %9.3fs  %8s" \
+                    % (n, name, '-', t_new, '-')
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# ------------------------------------------------------------------------------
+#
+# Compare time and peak memory of combine_profiles() (all rows as dicts in one
+# list), iter_profiles() (streaming k-way merge) and write_profile_columns()
+# (streaming merge into column files), on a set of generated profiles.  Each
+# method runs in its own process, so that its peak RSS can be reported.  Some
+# profiles are generated slightly out of order, to exercise the sort / spill
+# path.
+#
+
+import os
+import sys
+import time
+import random
+import shutil
+import resource
+import tempfile
+
+import radical.pilot.utils as rpu
+
+PROFILES = 100
+ROWS     = 20 * 1000    # rows per profile
+
+
+# ------------------------------------------------------------------------------
+#
+def create_profiles(tmp):
+
+    rnd   = random.Random(0)
+    profs = list()
+
+    for p in range(PROFILES):
+
+        fname = '%s/agent.%03d.prof' % (tmp, p)
+        profs.append(fname)
+
+        with open(fname, 'w') as f:
+            f.write("#time,name,uid,state,event,msg\n")
+            f.write("0.0000,agent.%03d:,,,sync abs,%f:%f:%f:sys\n"
+                    % (p, 1000.0 + p, 1000.0 + p, 1000.0 + p))
+            t = 0.0
+            for i in range(ROWS):
+                t += rnd.expovariate(1000.0)
+                ts = t
+                if p % 10 == 0 and rnd.random() < 0.01:
+                    ts -= 0.01
+                f.write("%.4f,agent.%03d:MainThread,unit.%06d,Executing,advance,\n"
+                        % (ts, p, i))
+
+    return profs
+
+
+# ------------------------------------------------------------------------------
+#
+def run(method, profs, tmp):
+
+    start = time.time()
+
+    if method == 'combine':
+        n = len(rpu.combine_profiles(profs))
+
+    elif method == 'iterate':
+        n = 0
+        for row in rpu.iter_profiles(profs):
+            n += 1
+
+    elif method == 'columns':
+        n = rpu.write_profile_columns(profs, '%s/columns' % tmp)
+
+    stop = time.time()
+    rss  = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    print "%-8s : %8d rows  %7.2fs  %8.1fMB peak RSS" \
+        % (method, n, stop - start, rss)
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    tmp   = tempfile.mkdtemp(prefix='bench_combine.')
+    profs = create_profiles(tmp)
+
+    print "profiles: %d  rows / profile: %d" % (PROFILES, ROWS)
+
+    for method in ['combine', 'iterate', 'columns']:
+        pid = os.fork()
+        if not pid:
+            run(method, profs, tmp)
+            sys.stdout.flush()
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+    shutil.rmtree(tmp)
+
+
+# ------------------------------------------------------------------------------
+
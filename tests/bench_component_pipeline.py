@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# ------------------------------------------------------------------------------
+#
+# Measure the unit throughput of a pipeline of rpu.Components with no-op
+# workers, once with per-unit workers and once with bulk workers.  Each stage
+# pulls units from its input queue, advances them to the next state, and
+# pushes them to the next stage's queue.  The main process feeds the first
+# queue and drains the last one.
+#
+
+import time
+
+import radical.pilot.utils as rpu
+
+N      = 10000      # units pushed through the pipeline
+STAGES = 3          # number of pipeline components
+
+
+# ------------------------------------------------------------------------------
+#
+class Stage(rpu.Component):
+
+    def __init__(self, cfg):
+
+        rpu.Component.__init__(self, 'Stage', cfg)
+
+
+    def initialize_child(self):
+
+        n = self._cfg['number']
+
+        self.declare_input (self._cfg['in_state'],  'bench_queue_%d' % n)
+        self.declare_output(self._cfg['out_state'], 'bench_queue_%d' % (n + 1))
+
+        if self._cfg['bulk']:
+            self.declare_worker(self._cfg['in_state'], self.work_bulk, bulk=True)
+        else:
+            self.declare_worker(self._cfg['in_state'], self.work)
+
+
+    def work(self, unit):
+
+        self.advance(unit, self._cfg['out_state'], publish=False, push=True)
+
+
+    def work_bulk(self, units):
+
+        self.advance(units, self._cfg['out_state'], publish=False, push=True)
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(bulk):
+
+    bridges = dict()
+    addrs   = dict()
+    for n in range(STAGES + 1):
+        name = 'bench_queue_%d' % n
+        bridges[name] = rpu.Queue.create(rpu.QUEUE_ZMQ, name, rpu.QUEUE_BRIDGE)
+        addrs[name]   = {'sink'   : bridges[name].bridge_in,
+                         'source' : bridges[name].bridge_out}
+
+    stages = list()
+    for n in range(STAGES):
+        cfg = {'agent_name'       : 'bench',
+               'number'           : n,
+               'bulk'             : bulk,
+               'in_state'         : 'STATE_%d' % n,
+               'out_state'        : 'STATE_%d' % (n + 1),
+               'bridge_addresses' : addrs}
+        stage = Stage(cfg)
+        stage.start()
+        stages.append(stage)
+
+    q_in  = rpu.Queue.create(rpu.QUEUE_ZMQ, 'bench_queue_0', rpu.QUEUE_INPUT,
+                             addrs['bench_queue_0']['sink'])
+    q_out = rpu.Queue.create(rpu.QUEUE_ZMQ, 'bench_queue_%d' % STAGES,
+                             rpu.QUEUE_OUTPUT,
+                             addrs['bench_queue_%d' % STAGES]['source'])
+
+    # give the components time to connect
+    time.sleep(3)
+
+    start = time.time()
+
+    for i in range(N):
+        q_in.put({'_id'   : 'unit.%06d' % i,
+                  'state' : 'STATE_0'})
+
+    recv = 0
+    while recv < N:
+        recv += len(q_out.get_bulk(rpu.BULK_SIZE, 1000))
+
+    stop = time.time()
+
+    print "bulk: %-5s : %d units through %d stages : %8.1f units/s" \
+        % (bulk, N, STAGES, N / (stop - start))
+
+    for stage in stages:
+        stage.stop()
+
+    for bridge in bridges.values():
+        bridge.stop()
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    bench(bulk=False)
+    bench(bulk=True)
+
+
+# ------------------------------------------------------------------------------
+
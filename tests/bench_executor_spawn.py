@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+# ------------------------------------------------------------------------------
+#
+# Compare the launch rate of the agent's unit spawning mechanisms, for short
+# running units:
+#
+#   POPEN : subprocess.Popen(shell=True, close_fds=True) from the agent process
+#   SHELL : the radical-pilot-spawner.sh script, driven over a saga PTYShell
+#   FORK  : the pre-forked launcher helper of AgentExecutingComponent_FORK
+#
+# The executors are not started as components -- we only drive their spawning
+# mechanism directly.  To mimic a (large) agent process, we allocate some
+# ballast memory and open some file descriptors before measuring.  For POPEN
+# and FORK, the time includes the collection of all unit exit codes.  For SHELL,
+# only the launches are timed (completion is reported by a separate monitor
+# shell).
+#
+
+import os
+import imp
+import json
+import time
+import tempfile
+import subprocess
+
+N          = 1000           # units to launch per spawner
+BALLAST_MB = 512            # agent process size to mimic
+FDS        = 256            # open file descriptors to mimic
+CMD        = '/bin/true'
+
+AGENT   = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '../src/radical/pilot/agent/radical-pilot-agent-multicore.py')
+SPAWNER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '../src/radical/pilot/agent/radical-pilot-spawner.sh')
+
+
+# ------------------------------------------------------------------------------
+#
+def bench_popen(agent, tmp):
+
+    start = time.time()
+    procs = list()
+    for i in range(N):
+        out = open('%s/popen.%d.out' % (tmp, i), 'w')
+        err = open('%s/popen.%d.err' % (tmp, i), 'w')
+        procs.append(subprocess.Popen(args=CMD, stdout=out, stderr=err,
+                                      close_fds=True, shell=True, cwd=tmp))
+        out.close()
+        err.close()
+
+    for proc in procs:
+        proc.wait()
+
+    return time.time() - start
+
+
+# ------------------------------------------------------------------------------
+#
+def bench_shell(agent, tmp):
+
+    import saga.utils.pty_shell as sups
+
+    shell = sups.PTYShell("fork://localhost/")
+    ret, out, _ = shell.run_sync("/bin/sh %s %s/shell" % (SPAWNER, tmp))
+    if ret != 0:
+        raise RuntimeError("failed to bootstrap spawner: (%s)(%s)" % (ret, out))
+
+    start = time.time()
+    for i in range(N):
+        cmd = "cd %s\n%s 1>%s/shell.%d.out 2>%s/shell.%d.err" \
+            % (tmp, CMD, tmp, i, tmp, i)
+        ret, out, _ = shell.run_sync("BULK\nLRUN\n%s\nLRUN_EOT\nBULK_RUN\n" % cmd)
+        if ret != 0:
+            raise RuntimeError("failed to run unit: (%s)(%s)" % (ret, out))
+        shell.find_prompt()
+
+    return time.time() - start
+
+
+# ------------------------------------------------------------------------------
+#
+def bench_fork(agent, tmp):
+
+    # the agent forks the helper while it is still small -- here it inherits
+    # the ballast, but that single fork is not timed
+    req_r, req_w = os.pipe()
+    rep_r, rep_w = os.pipe()
+
+    pid = os.fork()
+    if not pid:
+        os.close(req_w)
+        os.close(rep_r)
+        try:
+            agent._fork_server(req_r, rep_w)
+        except:
+            os._exit(1)
+        os._exit(0)
+
+    os.close(req_r)
+    os.close(rep_w)
+
+    os.write(req_w, json.dumps({'cmd' : 'env', 'env' : dict(os.environ)}) + '\n')
+
+    start = time.time()
+    for i in range(N):
+        os.write(req_w, json.dumps({'cmd'     : 'spawn',
+                                    'uid'     : 'unit.%06d' % i,
+                                    'cmdline' : CMD,
+                                    'cwd'     : tmp,
+                                    'stdout'  : '%s/fork.%d.out' % (tmp, i),
+                                    'stderr'  : '%s/fork.%d.err' % (tmp, i)})
+                         + '\n')
+    done = 0
+    buf  = ''
+    while done < N:
+        lines = (buf + os.read(rep_r, 64 * 1024)).split('\n')
+        buf   = lines.pop()
+        done += len(lines)
+
+    stop = time.time()
+
+    os.close(req_w)
+    os.close(rep_r)
+    os.waitpid(pid, 0)
+
+    return stop - start
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    agent = imp.load_source('agent', AGENT)
+
+    ballast = bytearray(BALLAST_MB * 1024 * 1024)
+    for i in range(0, len(ballast), 4096):
+        ballast[i] = 1
+
+    fds = [os.open('/dev/null', os.O_RDONLY) for _ in range(FDS)]
+
+    print "n: %d  ballast: %dMB  fds: %d" % (N, BALLAST_MB, FDS)
+
+    for name, bench in [['POPEN', bench_popen],
+                        ['SHELL', bench_shell],
+                        ['FORK',  bench_fork ]]:
+        tmp = tempfile.mkdtemp(prefix='bench_spawn.')
+        try:
+            t = bench(agent, tmp)
+            print "%-6s : %8.1f launches/s" % (name, N / t)
+        except Exception as e:
+            print "%-6s : skipped (%s)" % (name, e)
+
+
+# ------------------------------------------------------------------------------
+
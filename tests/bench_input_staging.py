@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# ------------------------------------------------------------------------------
+#
+# Compare client side input staging of many units with few small files each,
+# to a local file:// target:
+#
+#   serial : one saga directory handle, one copy after the other (like the old
+#            InputFileTransferWorker)
+#   engine : the StagingEngine of the InputFileTransferWorker, with different
+#            pool sizes
+#
+# No database is involved -- we only measure the transfers.
+#
+# usage: bench_input_staging.py [n_units] [n_files] [file_size]
+#
+
+import os
+import sys
+import time
+import saga
+import shutil
+import tempfile
+
+import radical.pilot as rp
+
+from radical.pilot.controller.input_file_transfer_worker import StagingEngine
+
+N     = 1000                # units
+F     = 3                   # input files per unit
+SIZE  = 4 * 1024            # bytes per input file
+POOLS = [1, 4, 8, 16, 32]   # engine pool sizes
+
+
+# ------------------------------------------------------------------------------
+#
+def create_units(src, tgt):
+
+    files = list()
+    for f in range(F):
+        fname = '%s/input.%d.dat' % (src, f)
+        with open(fname, 'w') as fout:
+            fout.write(os.urandom(SIZE))
+        files.append(fname)
+
+    units = list()
+    for i in range(N):
+        uid = 'unit.%06d' % i
+        units.append([uid, 'file://localhost%s/%s' % (tgt, uid),
+                      [{'source'   : fname,
+                        'target'   : os.path.basename(fname),
+                        'flags'    : [rp.CREATE_PARENTS],
+                        'priority' : 0,
+                        'state'    : rp.PENDING} for fname in files]])
+    return units
+
+
+# ------------------------------------------------------------------------------
+#
+def bench_serial(units):
+
+    saga_dir = saga.filesystem.Directory(saga.Url(units[0][1]),
+                                         flags=saga.filesystem.CREATE_PARENTS)
+    start = time.time()
+    for uid, sandbox, directives in units:
+        for sd in directives:
+            saga_dir.copy(saga.Url('file://localhost%s' % sd['source']),
+                          '%s/%s' % (sandbox, sd['target']),
+                          flags=saga.filesystem.CREATE_PARENTS)
+    return time.time() - start
+
+
+# ------------------------------------------------------------------------------
+#
+def bench_engine(units, size):
+
+    engine = StagingEngine(size=size)
+    start  = time.time()
+    for uid, sandbox, directives in units:
+        engine.submit(uid, sandbox, directives)
+
+    done = list()
+    while len(done) < len(units):
+        done += engine.get_done(timeout=1.0)
+    stop = time.time()
+
+    failed = [d for d in done if d[2]]
+    engine.stop()
+    if failed:
+        raise RuntimeError('%d units failed: %s' % (len(failed), failed[0]))
+
+    return stop - start
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1: N    = int(sys.argv[1])
+    if len(sys.argv) > 2: F    = int(sys.argv[2])
+    if len(sys.argv) > 3: SIZE = int(sys.argv[3])
+
+    print "units: %d  files/unit: %d  file size: %d bytes" % (N, F, SIZE)
+
+    src = tempfile.mkdtemp(prefix='bench_staging.src.')
+    try:
+        tgt   = tempfile.mkdtemp(prefix='bench_staging.tgt.')
+        units = create_units(src, tgt)
+        t     = bench_serial(units)
+        print "%-10s : %8.1f files/s  %8.1f kB/s" \
+            % ('serial', N * F / t, N * F * SIZE / t / 1024)
+        shutil.rmtree(tgt)
+
+        for size in POOLS:
+            tgt   = tempfile.mkdtemp(prefix='bench_staging.tgt.')
+            units = create_units(src, tgt)
+            t     = bench_engine(units, size)
+            print "%-10s : %8.1f files/s  %8.1f kB/s" \
+                % ('engine %d' % size, N * F / t, N * F * SIZE / t / 1024)
+            shutil.rmtree(tgt)
+
+    finally:
+        shutil.rmtree(src)
+
+
+# ------------------------------------------------------------------------------
+
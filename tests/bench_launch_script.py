@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+# ------------------------------------------------------------------------------
+#
+# Measure the cost of constructing the launch script (or command line) of
+# a unit in the POPEN and SHELL executors.  The executors are not started as
+# components -- we configure just enough of them to call spawn() (with the
+# actual launch stubbed out) and _cu_to_cmd() directly.  Units form a bag of
+# tasks which differ in their arguments only, so all but the first unit find
+# their template in the cache.  The 'cold' runs give each unit a different
+# environment, so that every unit compiles its own template.
+#
+
+import os
+import imp
+import time
+import shutil
+import logging
+import tempfile
+
+N     = 10000
+AGENT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                     '../src/radical/pilot/agent/radical-pilot-agent-multicore.py')
+
+
+# ------------------------------------------------------------------------------
+#
+class Launcher(object):
+
+    name           = 'FORK'
+    launch_command = ''
+
+    def construct_command(self, executable, args, cores, script, slots):
+        return "%s %s" % (executable, args), None
+
+
+# ------------------------------------------------------------------------------
+#
+class Profiler(object):
+
+    def prof(self, *args, **kwargs):
+        pass
+
+
+# ------------------------------------------------------------------------------
+#
+def create_executor(agent, name, launch_script):
+
+    exe = object.__new__(name)
+    exe._log           = logging.getLogger('bench')
+    exe._prof          = Profiler()
+    exe._cfg           = {'session_id' : 'rp.session.0000',
+                          'pilot_id'   : 'pilot.0000',
+                          'agent_name' : 'agent_0'}
+    exe._templates     = dict()
+    exe._deactivate    = 'unset VIRTUAL_ENV\n\n'
+    exe._launch_script = launch_script
+    exe._launch        = lambda cu, cmdline, cu_tmpdir: None
+    exe._cname         = 'AgentExecutingComponent.0000'
+
+    return exe
+
+
+# ------------------------------------------------------------------------------
+#
+def create_units(tmp, cold):
+
+    units = list()
+    for i in range(N):
+        uid = 'unit.%06d' % i
+        env = {'OMP_NUM_THREADS' : '1'}
+        if cold:
+            env['SEED'] = str(i)
+        units.append({'_id'          : uid,
+                      'workdir'      : '%s/%s' % (tmp, uid),
+                      'gtod'         : '%s/gtod' % tmp,
+                      'opaque_slots' : {},
+                      'description'  : {'executable'  : '/bin/sleep',
+                                        'arguments'   : ['0', '--seed=%d' % i],
+                                        'environment' : env,
+                                        'cores'       : 1,
+                                        'mpi'         : False,
+                                        'pre_exec'    : [],
+                                        'post_exec'   : [],
+                                        'stdout'      : None,
+                                        'stderr'      : None}})
+    return units
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(name, run, units):
+
+    start = time.time()
+    for unit in units:
+        run(unit)
+    stop  = time.time()
+
+    print "%-22s : %8.2fus / unit" % (name, (stop - start) / N * 1e6)
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    agent    = imp.load_source('agent', AGENT)
+    launcher = Launcher()
+
+    for cold in [False, True]:
+
+        tmp   = tempfile.mkdtemp(prefix='bench_script.')
+        units = create_units(tmp, cold)
+        tag   = 'cold' if cold else 'warm'
+
+        # create the unit workdirs up front, to time script construction only
+        for unit in units:
+            os.mkdir(unit['workdir'])
+
+        popen = create_executor(agent, agent.AgentExecutingComponent_POPEN, True)
+        bench('POPEN script   (%s)' % tag, lambda u: popen.spawn(launcher, u), units)
+
+        popen = create_executor(agent, agent.AgentExecutingComponent_POPEN, False)
+        bench('POPEN noscript (%s)' % tag, lambda u: popen.spawn(launcher, u), units)
+
+        shell = create_executor(agent, agent.AgentExecutingComponent_SHELL, True)
+        bench('SHELL          (%s)' % tag, lambda u: shell._cu_to_cmd(u, launcher), units)
+
+        shutil.rmtree(tmp)
+
+
+# ------------------------------------------------------------------------------
+
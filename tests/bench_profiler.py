@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+# ------------------------------------------------------------------------------
+#
+# Measure the per-event cost of Profiler.prof() for the CSV and the binary
+# profile format, from a single thread and from several threads at once.  The
+# events mimic the component run loop (a handful of events per unit, with
+# a new uid for each unit).  'prof' is the time spent in the prof() calls,
+# 'flush' the time needed to write out the events afterwards (for the binary
+# format, that work is otherwise done by the background flusher).  The binary
+# profile is converted to CSV afterwards, and both profiles are checked for the
+# same number of events.
+#
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '../src/radical/pilot/utils'))
+import prof_utils
+
+N       = 200000    # events per thread
+THREADS = 4
+
+
+# ------------------------------------------------------------------------------
+#
+def emit(prof, n):
+
+    for i in xrange(n / 5):
+        uid = 'unit.%06d' % i
+        prof.prof('get',     uid=uid, state='Executing', msg='bulk size: 1')
+        prof.prof('work',    uid=uid, state='Executing')
+        prof.prof('advance', uid=uid, state='Executing', msg='Executing')
+        prof.prof('put',     uid=uid, state='Executing', msg='bulk size: 1')
+        prof.prof('work done', uid=uid)
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(fmt, threads):
+
+    os.environ['RADICAL_PILOT_PROFILE_FORMAT'] = fmt
+
+    prof = prof_utils.Profiler('bench.%s.%d' % (fmt, threads))
+    thr  = [threading.Thread(target=emit, args=[prof, N])
+            for _ in range(threads)]
+
+    start = time.time()
+    for t in thr: t.start()
+    for t in thr: t.join()
+    mid   = time.time()
+    prof.flush()
+    stop  = time.time()
+
+    n = float(N * threads)
+    print "%-6s %d thread(s) : prof %5.2fus  flush %5.2fus / event  (%4.1f bytes)" \
+        % (fmt, threads, (mid - start) / n * 1e6, (stop - mid) / n * 1e6,
+           os.path.getsize('%s.prof' % prof._name) / n)
+
+    return '%s.prof' % prof._name
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    os.environ['RADICAL_PILOT_PROFILE'] = 'True'
+
+    tmp = tempfile.mkdtemp(prefix='bench_prof.')
+    os.chdir(tmp)
+
+    for threads in [1, THREADS]:
+
+        csv_prof = bench('csv',    threads)
+        bin_prof = bench('binary', threads)
+
+        start = time.time()
+        prof_utils.convert_profile(bin_prof)
+        stop  = time.time()
+
+        n_csv = len(prof_utils.read_profile(csv_prof))
+        n_bin = len(prof_utils.read_profile(bin_prof))
+        print "convert %d events : %6.2fs  (%s)" \
+            % (n_bin, stop - start, 'ok' if n_csv == n_bin else 'MISMATCH')
+
+    shutil.rmtree(tmp)
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+# ------------------------------------------------------------------------------
+#
+# Compare message throughput and latency of the zmq queue flavors.  A producer
+# process pushes timestamped unit-like messages through a bridge, and the main
+# process consumes them with get(), recording the per-message latency.
+#
+
+import time
+import multiprocessing     as mp
+
+import radical.pilot.utils as rpu
+
+N       = 20000
+FLAVORS = [rpu.QUEUE_ZMQ, rpu.QUEUE_ZMQ_DEALER]
+
+
+# ------------------------------------------------------------------------------
+#
+def produce(flavor, addr):
+
+    q_in = rpu.Queue.create(flavor, 'bench_queue', rpu.QUEUE_INPUT, addr)
+
+    for i in range(N):
+        q_in.put({'_id'         : 'unit.%06d' % i,
+                  'state'       : 'AGENT_STAGING_INPUT_PENDING',
+                  'ts'          : time.time(),
+                  'description' : {'executable' : '/bin/date',
+                                   'arguments'  : ['-u'],
+                                   'cores'      : 1}})
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(flavor):
+
+    q_bri = rpu.Queue.create(flavor, 'bench_queue', rpu.QUEUE_BRIDGE)
+    q_out = rpu.Queue.create(flavor, 'bench_queue', rpu.QUEUE_OUTPUT,
+                             q_bri.bridge_out)
+
+    # give the output time to connect
+    time.sleep(1)
+
+    lat   = list()
+    prod  = mp.Process(target=produce, args=[flavor, q_bri.bridge_in])
+    start = time.time()
+    prod.start()
+
+    for i in range(N):
+        msg = q_out.get()
+        lat.append(time.time() - msg['ts'])
+
+    stop = time.time()
+    prod.join()
+    q_bri.stop()
+
+    lat.sort()
+    print "%-12s : %8.1f msg/s   p50 %8.3fms   p99 %8.3fms" \
+        % (flavor, N / (stop - start), lat[N / 2] * 1000, lat[N * 99 / 100] * 1000)
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    print "n  : %d" % N
+    for flavor in FLAVORS:
+        bench(flavor)
+
+
+# ------------------------------------------------------------------------------
+
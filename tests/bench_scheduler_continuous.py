@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# ------------------------------------------------------------------------------
+#
+# Measure the allocation / release throughput of the continuous agent scheduler
+# for different pilot sizes.  The scheduler instance is not started as
+# a component -- we only configure its slot structure and then hammer
+# _allocate_slot / _release_slot directly, with a mix of single-core,
+# single-node and multi-node requests on a fragmented allocation.
+#
+
+import os
+import imp
+import time
+import random
+import logging
+
+CORES_PER_NODE = 16
+TOTALS         = [1000, 10000, 100000]      # total number of cores
+SIZES          = [1, 1, 1, 2, 4, 8, 16, 32] # requested cores per unit
+OPS            = 20000                      # allocations to time per run
+
+AGENT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                     '../src/radical/pilot/agent/radical-pilot-agent-multicore.py')
+
+
+# ------------------------------------------------------------------------------
+#
+def create_scheduler(agent, cores):
+
+    sched = object.__new__(agent.SchedulerContinuous)
+    sched._log                 = logging.getLogger('bench')
+    sched._lrms_lm_info        = dict()
+    sched._lrms_cores_per_node = CORES_PER_NODE
+    sched._lrms_node_list      = ['node_%06d' % n
+                                  for n in range(cores / CORES_PER_NODE)]
+    sched._configure()
+
+    return sched
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(agent, cores):
+
+    sched = create_scheduler(agent, cores)
+    live  = list()
+    rnd   = random.Random(42)
+
+    # fill the pilot, then free a random half to fragment it
+    while True:
+        slots = sched._allocate_slot(1)
+        if not slots:
+            break
+        live.append(slots)
+
+    rnd.shuffle(live)
+    for slots in live[:len(live) / 2]:
+        sched._release_slot(slots)
+    live = live[len(live) / 2:]
+
+    allocs = 0
+    fails  = 0
+    start  = time.time()
+
+    for _ in range(OPS):
+
+        slots = sched._allocate_slot(rnd.choice(SIZES))
+        if slots:
+            allocs += 1
+            live.append(slots)
+        else:
+            fails += 1
+
+        # keep utilization stable by releasing a random unit per attempt
+        if live:
+            idx = rnd.randint(0, len(live) - 1)
+            live[idx], live[-1] = live[-1], live[idx]
+            sched._release_slot(live.pop())
+
+    stop = time.time()
+
+    print "%8d cores : %10.1f attempts/s  (%d allocated, %d failed)" \
+        % (cores, OPS / (stop - start), allocs, fails)
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    agent = imp.load_source('rp_agent', AGENT)
+
+    for total in TOTALS:
+        bench(agent, total)
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+# ------------------------------------------------------------------------------
+#
+# Measure the serialize / deserialize cost per unit for the available message
+# serializers, for a unit as it travels through the agent pipeline, and for
+# a final unit which carries stdout / stderr.
+#
+
+import time
+
+import radical.pilot.utils as rpu
+
+N = 10000
+
+
+# ------------------------------------------------------------------------------
+#
+def make_unit(io_size):
+
+    unit = {'_id'          : 'unit.000042',
+            'state'        : 'AGENT_STAGING_OUTPUT_PENDING',
+            'pilot'        : 'pilot.0000',
+            'unitmanager'  : 'umgr.0000',
+            'workdir'      : '/scratch/rp.session.0000/pilot.0000/unit.000042',
+            'opaque_slots' : {'task_slots'   : ['node_0001:%d' % i for i in range(8)],
+                              'task_offsets' : 16,
+                              'lm_info'      : {}},
+            'description'  : {'executable'    : '/bin/sleep',
+                              'arguments'     : ['10'],
+                              'environment'   : {'OMP_NUM_THREADS' : '1'},
+                              'cores'         : 8,
+                              'mpi'           : True,
+                              'pre_exec'      : ['module load python'],
+                              'post_exec'     : [],
+                              'input_staging' : [],
+                              'output_staging': []},
+            'exit_code'    : 0}
+
+    if io_size:
+        unit['stdout'] = u'x' * io_size
+        unit['stderr'] = u'y' * (io_size / 10)
+
+    return unit
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(codec, io_size):
+
+    unit = make_unit(io_size)
+
+    start = time.time()
+    for _ in range(N):
+        frames = rpu.serialize(unit, codec)
+    t_ser = time.time() - start
+
+    start = time.time()
+    for _ in range(N):
+        rpu.deserialize(frames)
+    t_des = time.time() - start
+
+    print "%-8s io %8d : ser %8.2fus  des %8.2fus  (%d bytes in %d frames)" \
+        % (codec, io_size, t_ser / N * 1e6, t_des / N * 1e6,
+           sum([len(f) for f in frames]), len(frames))
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    for io_size in [0, 1024, 1024 * 1024]:
+        for codec in rpu.SERIALIZERS:
+            try:
+                rpu.check_serializer(codec)
+            except Exception as e:
+                print "%-8s skipped: %s" % (codec, e)
+                continue
+            bench(codec, io_size)
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+# ------------------------------------------------------------------------------
+#
+# Compare the transfer of many small files to a local file:// target:
+#
+#   per-file : one saga copy per file (like transfer directives without the
+#              BUNDLE flag)
+#   bundle   : pack all files into one archive, one saga copy of the archive,
+#              and extract the files from it again (like the input transfer
+#              worker and the agent do for bundled directives)
+#
+# usage: bench_staging_bundle.py [max_files] [file_size]
+#
+
+import os
+import sys
+import time
+import saga
+import shutil
+import tempfile
+
+import radical.pilot.utils as rpu
+
+COUNTS = [1000, 10000, 100000]  # number of files
+SIZE   = 1024                   # bytes per file
+
+
+# ------------------------------------------------------------------------------
+#
+def create_files(src, n):
+
+    data  = os.urandom(SIZE)
+    files = list()
+    for i in range(n):
+        fname = '%s/input.%06d.dat' % (src, i)
+        with open(fname, 'w') as fout:
+            fout.write(data)
+        files.append(fname)
+
+    return files
+
+
+# ------------------------------------------------------------------------------
+#
+def bench_per_file(files, tgt):
+
+    saga_dir = saga.filesystem.Directory(saga.Url('file://localhost%s' % tgt))
+    start    = time.time()
+    for fname in files:
+        saga_dir.copy(saga.Url('file://localhost%s' % fname),
+                      '%s/%s' % (tgt, os.path.basename(fname)))
+    return time.time() - start
+
+
+# ------------------------------------------------------------------------------
+#
+def bench_bundle(files, tgt):
+
+    saga_dir = saga.filesystem.Directory(saga.Url('file://localhost%s' % tgt))
+    archive  = tempfile.mktemp(prefix='bench_staging.', suffix='.tar')
+    start    = time.time()
+    try:
+        index = rpu.write_bundle(archive, [[fname, os.path.basename(fname)]
+                                           for fname in files])
+        saga_dir.copy(saga.Url('file://localhost%s' % archive),
+                      '%s/bundle.tar' % tgt)
+
+        bundle = '%s/bundle.tar' % tgt
+        for name, offset, size, mode in index:
+            rpu.copy_range(bundle, offset, size, '%s/%s' % (tgt, name), mode)
+
+    finally:
+        os.unlink(archive)
+
+    return time.time() - start
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1: COUNTS = [n for n in COUNTS if n <= int(sys.argv[1])]
+    if len(sys.argv) > 2: SIZE   = int(sys.argv[2])
+
+    print "file size: %d bytes" % SIZE
+
+    for n in COUNTS:
+
+        src = tempfile.mkdtemp(prefix='bench_staging.src.')
+        try:
+            files = create_files(src, n)
+
+            for name, bench in [['per-file', bench_per_file],
+                                ['bundle',   bench_bundle  ]]:
+                tgt = tempfile.mkdtemp(prefix='bench_staging.tgt.')
+                try:
+                    t = bench(files, tgt)
+                    print "%7d files  %-10s : %8.2fs  %10.1f files/s" \
+                        % (n, name, t, n / t)
+                finally:
+                    shutil.rmtree(tgt)
+        finally:
+            shutil.rmtree(src)
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# ------------------------------------------------------------------------------
+#
+# Compare the cost of one UnitManagerController state pull for the full unit
+# list and for the statehistory based delta feed.  The delta pull should remain
+# constant for a constant number of changed units, independent of the total
+# number of units in the session.
+#
+# needs RADICAL_PILOT_DBURL to point to a (preferably local) mongodb.
+#
+
+import os
+import sys
+import time
+
+import radical.utils     as ru
+import radical.pilot     as rp
+import radical.pilot.db  as rpdb
+
+CHANGED = 100                       # units changed per tick
+TOTALS  = [1000, 10000, 100000]     # total number of units per session
+REPEAT  = 10                        # ticks to average over
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(dburl, total):
+
+    sid  = ru.generate_id('rp.bench.feed', mode=ru.ID_PRIVATE)
+    dbs  = rpdb.Session(sid=sid, name=sid, dburl=dburl)
+    umgr = 'umgr.0000'
+
+    try:
+        ts   = time.time() - 3600
+        docs = list()
+        for i in range(total):
+            docs.append({'_id'          : 'unit.%06d' % i,
+                         'unitmanager'  : umgr,
+                         'state'        : rp.EXECUTING,
+                         'statehistory' : [{'state'     : rp.EXECUTING,
+                                            'timestamp' : ts}],
+                         'description'  : {'executable' : '/bin/true',
+                                           'arguments'  : ['%d' % i] * 10}})
+            if len(docs) >= 10000:
+                dbs._w.insert(docs)
+                docs = list()
+        if docs:
+            dbs._w.insert(docs)
+
+        t_full  = 0.0
+        t_delta = 0.0
+
+        for n in range(REPEAT):
+
+            since = time.time()
+            uids  = ['unit.%06d' % (n * CHANGED + i) for i in range(CHANGED)]
+            dbs.set_compute_unit_state(uids, rp.DONE, 'bench')
+
+            start   = time.time()
+            units   = dbs.get_compute_units(unit_manager_id=umgr)
+            t_full += time.time() - start
+            assert(len(units) == total)
+
+            start    = time.time()
+            units    = dbs.get_updated_compute_units(unit_manager_id=umgr,
+                                                     since=since - 0.1)
+            t_delta += time.time() - start
+            assert(len(units) == CHANGED)
+
+        print "%8d units : full %8.4fs / tick   delta %8.4fs / tick" \
+            % (total, t_full / REPEAT, t_delta / REPEAT)
+
+    finally:
+        dbs.delete()
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    dburl = os.environ.get('RADICAL_PILOT_DBURL')
+    if not dburl:
+        print 'need RADICAL_PILOT_DBURL'
+        sys.exit(1)
+
+    print "changed units per tick: %d" % CHANGED
+    for total in TOTALS:
+        bench(dburl, total)
+
+
+# ------------------------------------------------------------------------------
+
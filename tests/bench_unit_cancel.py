@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+# ------------------------------------------------------------------------------
+#
+# Measure the latency of canceling many units on a local pilot.  The units
+# are long running, and the pilot has few cores, so that most units wait in
+# the agent scheduler when they are canceled.  Once all units arrived in the
+# agent, they are canceled either
+#
+#   bulk     : with one UnitManager.cancel_units() call (one cancel command
+#              per pilot)
+#   per-unit : with one ComputeUnit.cancel() call per unit (one cancel command
+#              per unit)
+#
+# and we measure the time until the cancel calls return, and until all units
+# are reported as CANCELED.
+#
+# needs RADICAL_PILOT_DBURL to point to a (preferably local) mongodb.
+#
+# usage: bench_unit_cancel.py [n_units] [bulk|per-unit]
+#
+
+import os
+import sys
+import time
+
+import radical.pilot as rp
+
+N        = 10000
+CORES    = 4
+RUNTIME  = 60                       # minutes
+RESOURCE = 'local.localhost'
+MODES    = ['bulk', 'per-unit']
+TIMEOUT  = 1800                     # seconds to wait for state transitions
+
+AGENT_STATES = [rp.AGENT_STAGING_INPUT, rp.ALLOCATING_PENDING, rp.ALLOCATING,
+                rp.EXECUTING_PENDING,   rp.EXECUTING]
+
+
+# ------------------------------------------------------------------------------
+#
+def wait_for(counts, states, n):
+
+    start = time.time()
+    while sum([counts.get(s, 0) for s in states]) < n:
+        if time.time() - start > TIMEOUT:
+            raise RuntimeError('timeout (%s)' % counts)
+        time.sleep(0.1)
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(mode):
+
+    states = dict()   # uid : state
+    counts = dict()   # state : number of units
+
+    def unit_state_cb(unit, state):
+        if not unit:
+            return
+        old = states.get(unit.uid)
+        if old == state:
+            return
+        if old in AGENT_STATES and state in AGENT_STATES:
+            # only count the arrival in the agent once
+            return
+        states[unit.uid] = state
+        counts[state]    = counts.get(state, 0) + 1
+
+    session = rp.Session()
+    try:
+        pmgr  = rp.PilotManager(session=session)
+        pdesc = rp.ComputePilotDescription()
+        pdesc.resource = RESOURCE
+        pdesc.cores    = CORES
+        pdesc.runtime  = RUNTIME
+
+        pilot = pmgr.submit_pilots(pdesc)
+
+        umgr = rp.UnitManager(session=session, scheduler=rp.SCHED_DIRECT_SUBMISSION)
+        umgr.register_callback(unit_state_cb, rp.UNIT_STATE)
+        umgr.add_pilots(pilot)
+
+        cuds = list()
+        for i in range(N):
+            cud = rp.ComputeUnitDescription()
+            cud.executable = '/bin/sleep'
+            cud.arguments  = ['3600']
+            cud.cores      = 1
+            cuds.append(cud)
+
+        units = umgr.submit_units(cuds)
+        wait_for(counts, AGENT_STATES, N)
+
+        start = time.time()
+        if mode == 'bulk':
+            umgr.cancel_units([unit.uid for unit in units])
+        else:
+            for unit in units:
+                unit.cancel()
+        called = time.time()
+
+        wait_for(counts, [rp.CANCELED], N)
+        stop = time.time()
+
+        print "%-8s : %6d units  cancel call %8.2fs  all canceled %8.2fs  (%8.1f units/s)" \
+            % (mode, N, called - start, stop - start, N / (stop - start))
+
+    finally:
+        session.close(cleanup=True, terminate=True)
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    if not os.environ.get('RADICAL_PILOT_DBURL'):
+        print 'need RADICAL_PILOT_DBURL'
+        sys.exit(1)
+
+    if len(sys.argv) > 1: N     = int(sys.argv[1])
+    if len(sys.argv) > 2: MODES = [sys.argv[2]]
+
+    for mode in MODES:
+        bench(mode)
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+# ------------------------------------------------------------------------------
+#
+# Compare the unit ingestion of AgentWorker.check_units() in its two modes:
+#
+#   find  : find / count / update -- three roundtrips per pull, and only one
+#           ingestor can pull without seeing the same units twice
+#   claim : a single update which claims the units with a unique token, then
+#           a find on that token
+#
+# The agent worker is not started as a component -- we configure just enough
+# of it to call _find_units_db() and _claim_units_db() against a scratch
+# collection in the database given by RADICAL_PILOT_DBURL (a mongodb instance
+# on localhost by default).  The claim mode is also run with several concurrent
+# ingestors, and every run checks that no unit is ingested twice.
+#
+# usage: bench_unit_ingest.py [n_units] [n_ingestors]
+#
+
+import os
+import imp
+import sys
+import time
+import logging
+import threading
+
+import pymongo
+
+N      = 10000
+K      = 4
+DBURL  = os.environ.get('RADICAL_PILOT_DBURL', 'mongodb://localhost:27017/')
+PILOT  = 'pilot.0000'
+AGENT  = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '../src/radical/pilot/agent/radical-pilot-agent-multicore.py')
+
+
+# ------------------------------------------------------------------------------
+#
+def create_worker(agent, coll, name):
+
+    worker = object.__new__(agent.AgentWorker)
+    worker._log        = logging.getLogger('bench')
+    worker._cu         = coll
+    worker._pilot_id   = PILOT
+    worker._claims     = 0
+    worker.agent_name  = name
+
+    return worker
+
+
+# ------------------------------------------------------------------------------
+#
+def insert_units(agent, coll):
+
+    coll.drop()
+    coll.ensure_index([('claim', 1)], sparse=True)
+    coll.insert([{'_id'         : 'unit.%06d' % i,
+                  'pilot'       : PILOT,
+                  'state'       : agent.rp.AGENT_STAGING_INPUT_PENDING,
+                  'control'     : 'umgr',
+                  'description' : {'executable' : '/bin/true',
+                                   'arguments'  : ['--seed=%d' % i],
+                                   'cores'      : 1}}
+                 for i in range(N)])
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(agent, coll, name, k):
+
+    insert_units(agent, coll)
+
+    uids    = list()
+    lock    = threading.Lock()
+    workers = [create_worker(agent, coll, 'agent_%d' % i) for i in range(k)]
+
+    def ingest(worker):
+        if name == 'claim': pull = worker._claim_units_db
+        else              : pull = worker._find_units_db
+        while True:
+            cu_list = pull()
+            if not cu_list:
+                break
+            with lock:
+                uids.extend([cu['_id'] for cu in cu_list])
+
+    # the units are inserted in one go, so a pull which comes up empty means
+    # all units are ingested
+    start   = time.time()
+    threads = [threading.Thread(target=ingest, args=[w]) for w in workers]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    stop    = time.time()
+
+    dups = len(uids) - len(set(uids))
+    print "%-6s x %d : %8.1f units/s  (%d units, %d duplicates)" \
+        % (name, k, len(uids) / (stop - start), len(uids), dups)
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1: N = int(sys.argv[1])
+    if len(sys.argv) > 2: K = int(sys.argv[2])
+
+    agent = imp.load_source('agent', AGENT)
+    db    = pymongo.MongoClient(DBURL)['rp_bench_unit_ingest']
+    coll  = db['bench.cu']
+
+    try:
+        bench(agent, coll, 'find',  1)
+        bench(agent, coll, 'claim', 1)
+        bench(agent, coll, 'claim', K)
+    finally:
+        coll.drop()
+
+
+# ------------------------------------------------------------------------------
+
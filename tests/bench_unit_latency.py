@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+# ------------------------------------------------------------------------------
+#
+# Compare the submit-to-execute latency of units on a local pilot, for units
+# which travel through MongoDB (unit manager -> db -> agent poll) and for units
+# which are pushed over the agent's client channel (see 'client_channel' in the
+# agent config).  Units are submitted one at a time, and each unit is waited
+# for before the next one is submitted.  Latencies are measured on the client
+# side, from submit_units() to the EXECUTING and DONE state callbacks.
+#
+# needs RADICAL_PILOT_DBURL to point to a (preferably local) mongodb.
+#
+
+import os
+import sys
+import time
+
+import radical.utils as ru
+import radical.pilot as rp
+
+N        = 100
+CORES    = 4
+RUNTIME  = 15                       # minutes
+RESOURCE = 'local.localhost'
+CONFIG   = os.path.join(os.path.dirname(rp.__file__), 'configs/agent_default.json')
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(channel):
+
+    cfg = ru.read_json(CONFIG)
+    cfg['client_channel'] = channel
+
+    seen    = dict()    # uid : {state : time}
+
+    def unit_state_cb(unit, state):
+        if unit:
+            seen.setdefault(unit.uid, dict()).setdefault(state, time.time())
+
+    session = rp.Session()
+    try:
+        pmgr  = rp.PilotManager(session=session)
+        pdesc = rp.ComputePilotDescription()
+        pdesc.resource = RESOURCE
+        pdesc.cores    = CORES
+        pdesc.runtime  = RUNTIME
+        pdesc.set_attribute('_config', cfg)
+
+        pilot = pmgr.submit_pilots(pdesc)
+        pilot.wait(state=[rp.ACTIVE, rp.FAILED, rp.CANCELED, rp.DONE])
+        if pilot.state != rp.ACTIVE:
+            raise RuntimeError('pilot did not become active (%s)' % pilot.state)
+
+        umgr = rp.UnitManager(session=session, scheduler=rp.SCHED_DIRECT_SUBMISSION)
+        umgr.register_callback(unit_state_cb, rp.UNIT_STATE)
+        umgr.add_pilots(pilot)
+
+        submitted = dict()
+        for i in range(N):
+            cud = rp.ComputeUnitDescription()
+            cud.executable = '/bin/true'
+            cud.cores      = 1
+
+            start = time.time()
+            unit  = umgr.submit_units(cud)
+            submitted[unit.uid] = start
+            unit.wait()
+
+        exe  = sorted([seen[uid][rp.EXECUTING] - submitted[uid]
+                       for uid in submitted if rp.EXECUTING in seen.get(uid, {})])
+        done = sorted([seen[uid][rp.DONE] - submitted[uid]
+                       for uid in submitted if rp.DONE in seen.get(uid, {})])
+
+        name = 'channel' if channel else 'mongodb'
+        if exe:
+            print "%-8s : submit -> EXECUTING  median %7.3fs  mean %7.3fs  (%d units)" \
+                % (name, exe[len(exe) / 2], sum(exe) / len(exe), len(exe))
+        if done:
+            print "%-8s : submit -> DONE       median %7.3fs  mean %7.3fs  (%d units)" \
+                % (name, done[len(done) / 2], sum(done) / len(done), len(done))
+
+    finally:
+        session.close(cleanup=True, terminate=True)
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    if not os.environ.get('RADICAL_PILOT_DBURL'):
+        print 'need RADICAL_PILOT_DBURL'
+        sys.exit(1)
+
+    if len(sys.argv) > 1:
+        N = int(sys.argv[1])
+
+    print "units: %d (submitted one at a time)" % N
+    bench(channel=False)
+    bench(channel=True)
+
+
+# ------------------------------------------------------------------------------
+
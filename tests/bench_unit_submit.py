@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+# ------------------------------------------------------------------------------
+#
+# Measure the throughput of UnitManager.submit_units() for large bulks of
+# units, for schedulers which schedule up front (units are inserted into the
+# database as scheduled, in one write) and for the backfilling scheduler
+# (units are inserted first, and scheduled once the pilot is active).  Only
+# the submit_units() call is timed -- the units are not waited for.
+#
+# needs RADICAL_PILOT_DBURL to point to a (preferably local) mongodb.
+#
+# usage: bench_unit_submit.py [max_units]
+#
+
+import os
+import sys
+import time
+
+import radical.pilot as rp
+
+COUNTS     = [1000, 10000, 100000]  # units per bulk
+CORES      = 1
+RUNTIME    = 15                     # minutes
+RESOURCE   = 'local.localhost'
+SCHEDULERS = [rp.SCHED_DIRECT_SUBMISSION, rp.SCHED_ROUND_ROBIN,
+              rp.SCHED_BACKFILLING]
+
+
+# ------------------------------------------------------------------------------
+#
+def bench(scheduler, n):
+
+    session = rp.Session()
+    try:
+        pmgr  = rp.PilotManager(session=session)
+        pdesc = rp.ComputePilotDescription()
+        pdesc.resource = RESOURCE
+        pdesc.cores    = CORES
+        pdesc.runtime  = RUNTIME
+
+        pilot = pmgr.submit_pilots(pdesc)
+
+        umgr = rp.UnitManager(session=session, scheduler=scheduler)
+        umgr.add_pilots(pilot)
+
+        cuds = list()
+        for i in range(n):
+            cud = rp.ComputeUnitDescription()
+            cud.executable = '/bin/true'
+            cud.arguments  = ['%d' % i]
+            cud.cores      = 1
+            cuds.append(cud)
+
+        start = time.time()
+        umgr.submit_units(cuds)
+        stop  = time.time()
+
+        print "%-18s : %7d units  %8.2fs  %10.1f units/s" \
+            % (scheduler, n, stop - start, n / (stop - start))
+
+    finally:
+        session.close(cleanup=True, terminate=True)
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    if not os.environ.get('RADICAL_PILOT_DBURL'):
+        print 'need RADICAL_PILOT_DBURL'
+        sys.exit(1)
+
+    if len(sys.argv) > 1:
+        COUNTS = [n for n in COUNTS if n <= int(sys.argv[1])]
+
+    for n in COUNTS:
+        for scheduler in SCHEDULERS:
+            bench(scheduler, n)
+
+
+# ------------------------------------------------------------------------------
+
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+# ------------------------------------------------------------------------------
+#
+# Compare the vectorized add_concurrency() and add_frequency() against the
+# original row-by-row implementations (kept below as reference), on profile
+# frames which mimic the agent's unit events.
+#
+
+import random
+
+import numpy  as np
+import pandas as pd
+
+import radical.pilot.utils as rpu
+
+STATES = ['AgentStagingInputPending', 'AgentStagingInput', 'AllocatingPending',
+          'Allocating', 'ExecutingPending', 'Executing',
+          'AgentStagingOutputPending', 'AgentStagingOutput', 'Done']
+
+SPECS  = [{'in'  : [{'state' : 'Executing'}],
+           'out' : [{'state' : 'Done'},
+                    {'state' : 'Failed'},
+                    {'state' : 'Canceled'}]},
+          {'in'  : [{'event' : 'get',  'msg' : 'AgentStagingInput'}],
+           'out' : [{'event' : 'put',  'msg' : 'AgentStagingInput'}]},
+          {'in'  : [{'state' : 'Allocating'}, {'state' : 'ExecutingPending'}],
+           'out' : [{'state' : 'AgentStagingOutputPending'}]}]
+
+
+# ------------------------------------------------------------------------------
+#
+def create_profile(n, seed=0):
+    """
+    create a profile frame with about n events: units advance through the
+    agent states, with get/put events around each state.  Timestamps have the
+    profile resolution (so some coincide), some units fail, and some events are
+    swapped out of order (which drives the concurrency negative).
+    """
+
+    rnd  = random.Random(seed)
+    rows = list()
+    t    = 0.0
+    uid  = 0
+
+    while len(rows) < n:
+
+        u    = 'unit.%06d' % uid
+        uid += 1
+        t    = round(t + rnd.expovariate(100.0), 4)
+        ts   = t
+
+        for state in STATES:
+
+            if state == 'Done' and rnd.random() < 0.05:
+                state = 'Failed'
+
+            ts = round(ts + rnd.expovariate(10.0), 4)
+            rows.append({'time' : ts, 'name' : 'agent:MainThread', 'uid' : u,
+                         'state' : '', 'event' : 'get', 'msg' : state})
+            rows.append({'time' : ts, 'name' : 'agent:MainThread', 'uid' : u,
+                         'state' : state, 'event' : 'advance', 'msg' : ''})
+            ts = round(ts + rnd.expovariate(100.0), 4)
+            rows.append({'time' : ts, 'name' : 'agent:MainThread', 'uid' : u,
+                         'state' : '', 'event' : 'put', 'msg' : state})
+
+        if rnd.random() < 0.1:
+            rows.append({'time' : ts, 'name' : 'agent:MainThread', 'uid' : None,
+                         'state' : None, 'event' : 'heartbeat', 'msg' : None})
+
+    rows = sorted(rows[:n], key=lambda r: r['time'])
+
+    for _ in range(n / 100):
+        i = rnd.randint(0, n - 2)
+        rows[i], rows[i + 1] = rows[i + 1], rows[i]
+
+    return pd.DataFrame(rows, columns=['time', 'name', 'uid', 'state',
+                                       'event', 'msg'])
+
+
+# ------------------------------------------------------------------------------
+#
+def ref_add_concurrency(frame, tgt, spec):
+
+    def _conc(row, spec):
+        for f in spec['in']:
+            if all([row[col] == pat for col, pat in f.iteritems()]):
+                return 1
+        for f in spec['out']:
+            if all([row[col] == pat for col, pat in f.iteritems()]):
+                return -1
+        return np.NaN
+
+    state = {'tmp' : None}
+    def _time(x):
+        if x != state['tmp']: state['tmp'] = x
+        else                : x = np.NaN
+        return x
+
+    def _abs(x):
+        if x < 0:
+            return np.NaN
+        return x
+
+    frame[tgt] = frame.apply(lambda row: _conc(row, spec), axis=1).cumsum()
+    frame[tgt] = frame.apply(lambda row: _abs (row[tgt]),  axis=1)
+    frame[tgt] = frame.apply(lambda row: _time(row[tgt]),  axis=1)
+
+    return frame
+
+
+# ------------------------------------------------------------------------------
+#
+def ref_add_frequency(frame, tgt, window, spec):
+
+    def _freq(t, _tmp, _window):
+        return len(_tmp.uid[(_tmp.time > t-_window) & (_tmp.time <= t)])
+
+    tmp = frame
+    for key,val in spec.iteritems():
+        tmp = tmp[tmp[key].isin([val])]
+    frame[tgt] = tmp.time.apply(_freq, args=[tmp, window])
+
+    return frame
+
+
+# ------------------------------------------------------------------------------
+#
+def test_add_concurrency():
+
+    for seed in range(3):
+        frame = create_profile(5000, seed)
+        for spec in SPECS:
+            ref = ref_add_concurrency(frame.copy(), 'conc', spec)['conc']
+            new = rpu.add_concurrency(frame.copy(), 'conc', spec)['conc']
+            assert ref.notnull().any()
+            pd.util.testing.assert_series_equal(ref, new)
+
+
+# ------------------------------------------------------------------------------
+#
+def test_add_frequency():
+
+    for seed in range(3):
+        frame = create_profile(5000, seed)
+        for window in [0.01, 0.1, 1.0]:
+            for spec in [{'state' : 'Executing'},
+                         {'event' : 'get', 'msg' : 'Done'}]:
+                ref = ref_add_frequency(frame.copy(), 'freq', window, spec)['freq']
+                new = rpu.add_frequency(frame.copy(), 'freq', window, spec)['freq']
+                assert ref.notnull().any()
+                pd.util.testing.assert_series_equal(ref, new)
+
+
+# ------------------------------------------------------------------------------
+#
+if __name__ == '__main__':
+
+    test_add_concurrency()
+    test_add_frequency()
+
+
+# ------------------------------------------------------------------------------
+